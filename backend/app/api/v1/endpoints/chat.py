@@ -18,7 +18,9 @@ from app.models.chat_conversation import ChatConversation
 from app.models.chat_message import ChatMessage
 from app.schemas.knowledge_base import ChatRequest, ChatResponse
 from app.services.vector_store import vector_store_manager
+from app.services.federated_search import search_knowledge_bases
 from app.services.bailian_client import rag_service
+from app.services.resilience import CircuitOpenError
 from app.services.storage import storage
 from app.models.file import File
 from app.models.document_chunk import DocumentChunk
@@ -108,12 +110,40 @@ async def ask_question(
         if not kb:
             raise HTTPException(status_code=404, detail="Knowledge base not found")
 
-        # 2) 检索相关文档
-        search_results = list(await vector_store_manager.search_knowledge_base(
-            collection_name=kb.collection_name,
-            query=chat_request.question,
-            n_results=chat_request.max_chunks
-        ))
+        # 2) 检索相关文档（指定了额外知识库时并发检索并合并）
+        filters = chat_request.filters.model_dump(exclude_none=True) if chat_request.filters else None
+        extra_kb_ids = [i for i in dict.fromkeys(chat_request.knowledge_base_ids or []) if i != kb.id]
+        if extra_kb_ids:
+            extra_result = await db.execute(
+                select(KnowledgeBase).where(KnowledgeBase.id.in_(extra_kb_ids))
+            )
+            extra_kbs = extra_result.scalars().all()
+            missing = set(extra_kb_ids) - {k.id for k in extra_kbs}
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Knowledge base not found: {sorted(missing)}")
+            search_results = await search_knowledge_bases(
+                vector_store_manager,
+                [
+                    {
+                        "knowledge_base_id": k.id,
+                        "collection_name": k.collection_name,
+                        "retrieval_config": k.retrieval_config
+                    }
+                    for k in [kb, *extra_kbs]
+                ],
+                query=chat_request.question,
+                n_results=chat_request.max_chunks,
+                filters=filters
+            )
+        else:
+            search_results = list(await vector_store_manager.search_knowledge_base(
+                collection_name=kb.collection_name,
+                query=chat_request.question,
+                n_results=chat_request.max_chunks,
+                knowledge_base_id=kb.id,
+                retrieval_config=kb.retrieval_config,
+                filters=filters
+            ))
 
         # 3) 获取或创建对话（用 session_id 作为外显 ID）
         conversation_id = chat_request.conversation_id or str(uuid.uuid4())
@@ -220,6 +250,14 @@ async def ask_question(
 
     except HTTPException:
         raise
+    except CircuitOpenError as e:
+        await db.rollback()
+        logger.warning(f"Chat rejected, upstream unavailable: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, int(e.retry_after)))}
+        )
     except Exception as e:
         await db.rollback()
         logger.error(f"Error in chat: {e}")
@@ -7,7 +7,7 @@ import inspect
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 from loguru import logger
 from datetime import datetime, timedelta
 from minio import Minio 
@@ -27,6 +27,9 @@ from app.services.storage import storage
 from app.services.file_processor import file_processor
 from app.services.text_splitter import create_document_chunks
 from app.services.bailian_client import bailian_client
+from app.services.embedding_provider import embedding_provider
+from app.services.embedding_backfill import embedding_backfiller
+from app.services.lexical_index import lexical_index_manager
 import uuid
 import hashlib
 import io
@@ -210,11 +213,19 @@ async def delete_knowledge_base(
         kb_id_val = kb.id
         collection_name = kb.collection_name
 
-        # 先删向量集合（同步方法，别 await）
-        vector_store_manager.delete_knowledge_base_collection(collection_name)
+        # 先删向量集合（在向量库线程池中执行）
+        await vector_store_manager.delete_knowledge_base_collection(collection_name)
 
-        # 标记删除并提交
+        # 标记删除并提交；块保留（软删除），但不再需要补齐嵌入
         kb.status = "deleted"
+        await db.execute(
+            update(DocumentChunk)
+            .where(
+                DocumentChunk.knowledge_base_id == kb_id_val,
+                DocumentChunk.embedding_pending.is_(True)
+            )
+            .values(embedding_pending=False)
+        )
         await db.commit()
 
         # 提交后只用局部变量，避免触发 ORM 过期刷新
@@ -242,6 +253,7 @@ def process_uploaded_file(file_id: int, kb_id: int):
     from app.services.storage import storage
     from app.services.file_processor import file_processor
     from app.services.text_splitter import create_document_chunks
+    from app.services.tokenizer import count_tokens
     from datetime import datetime
 
     # === 新增：把过短的相邻切片自动合并，避免被过滤丢失 ===
@@ -414,6 +426,9 @@ def process_uploaded_file(file_id: int, kb_id: int):
                 chunk_meta.setdefault("file_type", file_record.file_type)
                 chunk_meta.setdefault("chunk_index", ch.get("chunk_index", i))
 
+            # 记录 token 数（计数结果按内容缓存，向量化时直接复用）
+            chunk_meta["token_count"] = count_tokens(content)
+
             # 入库时把 file_id 放进向量 metadata
             chunks_for_vector_store.append({
                 "content": content,
@@ -443,7 +458,7 @@ def process_uploaded_file(file_id: int, kb_id: int):
             kb_result = session.execute(
                 select(KnowledgeBase).where(KnowledgeBase.id == kb_id)
             ).scalar_one()
-            return await vector_store_manager.add_document_chunks(
+            return await vector_store_manager.add_document_chunks_with_pending(
                 collection_name=kb_result.collection_name,
                 chunks=chunks_for_vector_store
             )
@@ -451,8 +466,11 @@ def process_uploaded_file(file_id: int, kb_id: int):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         try:
-            vector_ids = loop.run_until_complete(_add_chunks_async())
+            # pending_ids：嵌入失败、暂未写入索引的块，交给后台补齐任务
+            vector_ids, pending_ids = loop.run_until_complete(_add_chunks_async())
         finally:
+            # 本事件循环上的百炼连接池随循环一起释放
+            loop.run_until_complete(bailian_client.aclose())
             loop.close()
 
         # 9) 写回 DB（严格 1:1）
@@ -470,7 +488,11 @@ def process_uploaded_file(file_id: int, kb_id: int):
                     chunk_overlap=meta.get("chunk_overlap", 0),
                     chunk_metadata=meta,
                     vector_id=vid,
-                    vectorized_at=datetime.now()
+                    embedding_model=embedding_provider.model,
+                    embedding_dimensions=embedding_provider.dimension,
+                    embedding_pending=vid in pending_ids,
+                    embedding_attempts=0,
+                    vectorized_at=None if vid in pending_ids else datetime.now()
                 )
                 document_chunks_to_add.append(document_chunk)
 
@@ -478,8 +500,11 @@ def process_uploaded_file(file_id: int, kb_id: int):
 
             # 10) 更新统计 & 文件记录
             file_record.processing_status = "completed"
-            file_record.vectorization_status = "completed"       # <== 可选：补上向量化状态
-            file_record.vectorization_error = None
+            # 有块待补齐时标记 partial（不用 pending，避免 /reindex 重复切块入库）
+            file_record.vectorization_status = "partial" if pending_ids else "completed"
+            file_record.vectorization_error = (
+                f"{len(pending_ids)} chunks pending embedding" if pending_ids else None
+            )
             file_record.extracted_text = extracted_text
             file_record.extracted_metadata = file_metadata        # <== 修复：不再被 chunk 覆盖
             file_record.chunk_count = len(chunks_for_vector_store)
@@ -490,7 +515,22 @@ def process_uploaded_file(file_id: int, kb_id: int):
             kb.document_count += len(chunks_for_vector_store)
 
             session.commit()
-            logger.info(f"Successfully processed and vectorized file {file_record.filename} (chunks={len(chunks_for_vector_store)})")
+
+            # 增量更新混合检索的 BM25 索引（只更新已加载的；未加载的首次检索时读库构建）
+            lexical_index_manager.add_chunks(kb.collection_name, [
+                {
+                    "id": dc.id,
+                    "vector_id": dc.vector_id,
+                    "file_id": dc.file_id,
+                    "content": dc.content,
+                    "metadata": dc.chunk_metadata
+                }
+                for dc in document_chunks_to_add
+            ])
+            logger.info(
+                f"Successfully processed and vectorized file {file_record.filename} "
+                f"(chunks={len(chunks_for_vector_store)}, pending={len(pending_ids)})"
+            )
         else:
             raise Exception(
                 f"Vectorization failed: ids={len(vector_ids) if vector_ids else 0} "
@@ -718,3 +758,15 @@ async def sign_file_download(kb_id: int, file_id: int, session: AsyncSession = D
         logger.exception(e)
         raise HTTPException(status_code=500, detail=f"生成签名链接失败: {e}")
 
+
+@router.get("/{kb_id}/files/{file_id}/embedding-progress")
+async def get_file_embedding_progress(kb_id: int, file_id: int, session: AsyncSession = Depends(get_async_session)):
+    """文件嵌入进度：含入库时嵌入失败、等待后台补齐的块数"""
+    stmt = select(FileModel).where(FileModel.id == file_id, FileModel.knowledge_base_id == kb_id)
+    file = (await session.execute(stmt)).scalar_one_or_none()
+    if not file:
+        raise HTTPException(status_code=404, detail="文件不存在或不属于该知识库")
+
+    progress = await embedding_backfiller.progress(session, file_id)
+    progress["vectorization_status"] = file.vectorization_status
+    return progress
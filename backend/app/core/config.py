@@ -30,10 +30,136 @@ class Settings(BaseSettings):
     BAILIAN_EMBEDDING_MODEL: str = "text-embedding-v1"
     BAILIAN_CHAT_MODEL: str = "qwen3-max"
 
+    # 百炼 HTTP 连接池配置（进程内共享一个长连接客户端）
+    BAILIAN_HTTP2: bool = True
+    BAILIAN_MAX_CONNECTIONS: int = 100
+    BAILIAN_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    BAILIAN_KEEPALIVE_EXPIRY: float = 60.0
+    BAILIAN_CONNECT_TIMEOUT: float = 5.0
+    BAILIAN_EMBEDDING_TIMEOUT: float = 30.0
+    BAILIAN_CHAT_TIMEOUT: float = 60.0
+    BAILIAN_WARMUP_ON_STARTUP: bool = True
+    # 对话请求对冲：超过最近延迟的该分位仍无响应时再发一份，先到先用（样本不足时按最大等待）
+    BAILIAN_CHAT_HEDGING: bool = False
+    BAILIAN_CHAT_HEDGE_PERCENTILE: float = 95.0
+    BAILIAN_CHAT_HEDGE_MIN_DELAY: float = 0.5
+    BAILIAN_CHAT_HEDGE_MAX_DELAY: float = 10.0
+    BAILIAN_CHAT_HEDGE_MIN_SAMPLES: int = 20
+
+    # 嵌入请求并发与限流（<= 0 表示不限）
+    BAILIAN_EMBEDDING_CONCURRENCY: int = 4
+    BAILIAN_EMBEDDING_RPS: float = 10.0
+    BAILIAN_EMBEDDING_TPM: int = 1200000
+    # 限流额度中只留给在线查询的比例：入库请求用不到这一截，查询不必排在入库积压之后
+    BAILIAN_EMBEDDING_INTERACTIVE_RESERVE: float = 0.1
+    # 单条输入的 token 上限（服务端 8192，留余量）与单次请求的总 token 预算
+    BAILIAN_EMBEDDING_MAX_INPUT_TOKENS: int = 8000
+    BAILIAN_EMBEDDING_MAX_REQUEST_TOKENS: int = 32000
+    # 进程级在途嵌入请求上限：批量入库与在线查询各自独立，互不挤占
+    BAILIAN_EMBEDDING_BULK_MAX_INFLIGHT: int = 8
+    BAILIAN_EMBEDDING_INTERACTIVE_MAX_INFLIGHT: int = 8
+    # 熔断：连续失败次数阈值、熔断冷却秒数、半开状态放行的探测请求数
+    BAILIAN_BREAKER_FAILURE_THRESHOLD: int = 5
+    BAILIAN_BREAKER_RECOVERY_TIMEOUT: float = 30.0
+    BAILIAN_BREAKER_HALF_OPEN_PROBES: int = 1
+    # 进程级嵌入任务队列：调度协程数、只发查询的专用调度协程数、单批最大条数、单条最多尝试次数、重试基础退避（秒）
+    EMBEDDING_QUEUE_WORKERS: int = 2
+    EMBEDDING_QUEUE_INTERACTIVE_WORKERS: int = 1
+    EMBEDDING_QUEUE_MAX_BATCH: int = 256
+    EMBEDDING_QUEUE_MAX_ATTEMPTS: int = 4
+    EMBEDDING_QUEUE_RETRY_DELAY: float = 1.0
+    # 查询向量合批：并发提问在窗口内合成一次嵌入请求（窗口 <= 0 表示关闭）
+    EMBEDDING_QUERY_COALESCE_WINDOW_MS: float = 5.0
+    EMBEDDING_QUERY_COALESCE_MAX_BATCH: int = 32
+
+    # 嵌入后端：bailian（远程 API）/ hashing（本地哈希向量，离线压测用）/ onnx（本地 ONNX 模型）
+    EMBEDDING_PROVIDER: str = "bailian"
+    EMBEDDING_HASHING_DIM: int = 1536
+    EMBEDDING_ONNX_MODEL_PATH: str = ""
+    EMBEDDING_ONNX_TOKENIZER_PATH: str = ""
+    EMBEDDING_ONNX_MAX_LENGTH: int = 512
+    EMBEDDING_ONNX_BATCH_SIZE: int = 32
+    # ONNX 模型所在的向量空间名；与远程模型等价（同一模型的本地导出）时可填同名，以便互为兜底
+    EMBEDDING_ONNX_SPACE: str = ""
+    # 主后端超时/出错时的兜底后端（必须与主后端处于同一向量空间），留空表示不兜底
+    EMBEDDING_FALLBACK_PROVIDER: str = ""
+    # 在线查询等待主后端的时间，超时即改用兜底后端
+    EMBEDDING_FALLBACK_TIMEOUT: float = 2.0
+    # 批量嵌入（入库/补齐）等待主后端的时间；0 表示不设超时，只在出错时兜底
+    EMBEDDING_FALLBACK_BULK_TIMEOUT: float = 300.0
+
+    # 嵌入失败块的后台补齐：按 updated_at + BASE_DELAY * 2^attempts（封顶 MAX_DELAY）退避重试
+    EMBEDDING_BACKFILL_ENABLED: bool = True
+    EMBEDDING_BACKFILL_INTERVAL: float = 30.0
+    EMBEDDING_BACKFILL_BATCH: int = 128
+    EMBEDDING_BACKFILL_BASE_DELAY: float = 30.0
+    EMBEDDING_BACKFILL_MAX_DELAY: float = 3600.0
+
+    # 嵌入模型元数据（维度/单条 token 上限/批上限）的持久化位置，留空则只在内存中
+    MODEL_REGISTRY_PATH: str = "./cache/model_registry.json"
+
+    # 嵌入缓存配置（内存 LRU + SQLite 持久层）
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MEMORY_ITEMS: int = 20000
+    EMBEDDING_CACHE_PATH: str = "./cache/embeddings.sqlite3"
+
+    # 向量库后端：chroma（Chroma 服务，不可用时退回模拟实现）/ numpy（进程内 memmap 向量库）
+    VECTOR_STORE_BACKEND: str = "chroma"
+    NUMPY_VECTOR_STORE_PATH: str = "./vector_data"
+    # IVF 粗量化的簇数，0 表示始终精确暴力搜索；nprobe 为每次查询扫描的簇数
+    NUMPY_VECTOR_STORE_IVF_NLIST: int = 0
+    NUMPY_VECTOR_STORE_IVF_NPROBE: int = 8
+    # 向量压缩：none / int8（标量量化，1/4 内存）/ pq（乘积量化，每向量 PQ_M 字节）；
+    # 行数达到 COMPRESSION_MIN_ROWS 后启用，检索取 k*RERANK 个候选用原向量精排
+    NUMPY_VECTOR_STORE_COMPRESSION: str = "none"
+    NUMPY_VECTOR_STORE_PQ_M: int = 96
+    NUMPY_VECTOR_STORE_RERANK: int = 4
+    NUMPY_VECTOR_STORE_COMPRESSION_MIN_ROWS: int = 10000
+
     # Chroma配置
     CHROMA_HOST: str = "localhost"
     CHROMA_PORT: int = 8000
     CHROMA_PERSIST_DIRECTORY: str = "./chroma_data"
+    # Chroma 客户端是同步的：调用放进专用线程池，避免阻塞事件循环；超时单位秒
+    CHROMA_EXECUTOR_WORKERS: int = 8
+    CHROMA_QUERY_TIMEOUT: float = 10.0
+    CHROMA_WRITE_TIMEOUT: float = 120.0
+    # 混合检索：BM25 与向量结果做 RRF 融合；知识库可在 retrieval_config["hybrid"] 中覆盖这些默认值
+    HYBRID_SEARCH_ENABLED: bool = True
+    HYBRID_VECTOR_WEIGHT: float = 1.0
+    HYBRID_BM25_WEIGHT: float = 1.0
+    HYBRID_RRF_K: int = 60
+    # 每路召回的候选数（至少为 n_results）
+    HYBRID_CANDIDATES: int = 20
+    # MMR 多样化：先取 n_results * MMR_FETCH_FACTOR 个候选，再按相关性与冗余度的折中挑出 n_results 个；
+    # MMR_LAMBDA 越大越偏相关性。知识库可在 retrieval_config["mmr"] 中覆盖
+    MMR_ENABLED: bool = False
+    MMR_LAMBDA: float = 0.7
+    MMR_FETCH_FACTOR: int = 4
+    # 检索结果重排：lexical（查询词覆盖率）/ onnx（本地交叉编码器）；知识库可在 retrieval_config["rerank"] 中覆盖
+    RERANK_ENABLED: bool = False
+    RERANK_PROVIDER: str = "lexical"
+    RERANK_FETCH_FACTOR: int = 3
+    RERANK_BATCH_SIZE: int = 16
+    # 超出预算后剩余候选不再打分（按批检查，至少打完第一批）
+    RERANK_LATENCY_BUDGET_MS: float = 150.0
+    # 原排序第一名与第二名分差不小于该值时跳过重排
+    RERANK_SKIP_MARGIN: float = 0.3
+    RERANK_ONNX_MODEL_PATH: str = ""
+    RERANK_ONNX_TOKENIZER_PATH: str = ""
+    RERANK_ONNX_MAX_LENGTH: int = 512
+    # 检索结果缓存：集合写入（入库/补齐/删除）后失效；TTL 兜底多进程部署下其他进程的写入
+    RETRIEVAL_CACHE_ENABLED: bool = True
+    RETRIEVAL_CACHE_MAX_ENTRIES: int = 2048
+    RETRIEVAL_CACHE_TTL: float = 300.0
+    # 大于 0 时启用语义命中：查询向量余弦相似度达到该值即复用（如 0.97），0 表示只做精确命中
+    RETRIEVAL_CACHE_SIMILARITY_THRESHOLD: float = 0.0
+    # 跨知识库检索时每个知识库的截止时间（秒），超时的知识库跳过
+    FEDERATED_SEARCH_TIMEOUT: float = 3.0
+    # 跨知识库合并时“按向量相似度排序”那一路的 RRF 权重（各知识库自身排序那一路权重为 1）
+    FEDERATED_SIMILARITY_WEIGHT: float = 2.0
+    # 入库流水线深度：嵌入最多领先写入多少批（有界队列，兼作背压）
+    VECTOR_INGEST_PIPELINE_DEPTH: int = 2
 
     # JWT配置
     SECRET_KEY: str
@@ -5,11 +5,22 @@ from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 import time
+import asyncio
 from loguru import logger
 
 from app.core.config import settings
 from app.core.logging import setup_logging
 from app.api.v1.api import api_router
+from app.services.bailian_client import bailian_client
+from app.services.embedding_cache import embedding_cache
+from app.services.embedding_provider import embedding_provider
+from app.services.model_registry import model_registry
+from app.services.embedding_backfill import embedding_backfiller
+from app.services.vector_store import vector_store_manager
+from app.services.lexical_index import lexical_index_manager
+from app.services.reranker import rerank_stage
+from app.services.retrieval_cache import retrieval_cache
+from app.services.chat_stream import chat_stream_stats
 from dotenv import load_dotenv
 import os
 
@@ -102,6 +113,43 @@ async def health_check():
         "version": settings.APP_VERSION
     }
 
+# 运行指标
+@app.get("/metrics")
+async def metrics():
+    return {
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+        "embedding_rate_limit": bailian_client.embedding_limiter.stats(),
+        "embedding_batching": bailian_client.batch_controller.stats(),
+        "embedding_queue": bailian_client.embedding_queue.stats(),
+        "query_coalescing": bailian_client.query_coalescer.stats(),
+        "embedding_provider": embedding_provider.stats(),
+        "embedding_models": model_registry.stats(),
+        "embedding_backfill": embedding_backfiller.stats(),
+        "lexical_index_chunks": lexical_index_manager.stats(),
+        "rerank": rerank_stage.stats(),
+        "retrieval_cache": retrieval_cache.stats() if retrieval_cache is not None else None,
+        "vector_store_compression": (
+            vector_store_manager.vector_store.compression_stats()
+            if hasattr(vector_store_manager.vector_store, "compression_stats") else None
+        ),
+        "vector_store_collections": (
+            vector_store_manager.vector_store.collection_cache_stats()
+            if hasattr(vector_store_manager.vector_store, "collection_cache_stats") else None
+        ),
+        "chat_streaming": chat_stream_stats.stats(),
+        "circuit_breakers": {
+            "embeddings": bailian_client.embedding_breaker.stats(),
+            "chat": bailian_client.chat_breaker.stats()
+        },
+        "embedding_bulkheads": {
+            name: bulkhead.stats() for name, bulkhead in bailian_client.embedding_bulkheads.items()
+        },
+        "chat_hedging": {
+            "completion": bailian_client.chat_hedge.stats(),
+            "stream_first_event": bailian_client.stream_hedge.stats()
+        }
+    }
+
 # 根路径
 @app.get("/")
 async def root():
@@ -120,11 +168,19 @@ async def startup_event():
     logger.info(f"Starting {settings.APP_NAME} v{settings.APP_VERSION}")
     logger.info(f"Debug mode: {settings.DEBUG}")
     logger.info(f"Database URL: {settings.DATABASE_URL.split('@')[1] if '@' in settings.DATABASE_URL else 'Not configured'}")
+    # 建立百炼共享连接池并预热
+    await bailian_client.startup()
+    # 补齐入库时嵌入失败的文档块
+    if settings.EMBEDDING_BACKFILL_ENABLED:
+        embedding_backfiller.start()
 
 # 关闭事件
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info(f"Shutting down {settings.APP_NAME}")
+    await embedding_backfiller.stop()
+    await asyncio.to_thread(bailian_client.embedding_queue.shutdown)
+    await bailian_client.aclose()
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Float
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Float, Boolean, false
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db.database import Base
@@ -30,6 +30,9 @@ class DocumentChunk(Base):
     vector_id = Column(String(255), comment="在向量数据库中的ID")
     embedding_model = Column(String(100), comment="使用的嵌入模型")
     embedding_dimensions = Column(Integer, comment="向量维度")
+    embedding_pending = Column(Boolean, default=False, server_default=false(), index=True, comment="嵌入失败、等待后台补齐")
+    embedding_attempts = Column(Integer, default=0, server_default="0", comment="补齐嵌入的失败次数")
+    next_attempt_at = Column(DateTime(timezone=True), index=True, comment="下次补齐嵌入的时间（退避）")
 
     # 元数据
     chunk_metadata = Column(JSON, comment="文档块元数据")
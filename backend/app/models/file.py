@@ -33,7 +33,7 @@ class File(Base):
     extracted_metadata = Column(JSON, comment="提取的元数据")
 
     # 向量化状态
-    vectorization_status = Column(String(50), default="pending", comment="向量化状态: pending, processing, completed, failed")
+    vectorization_status = Column(String(50), default="pending", comment="向量化状态: pending, processing, partial, completed, failed")
     vectorization_error = Column(Text, comment="向量化错误信息")
 
     # 时间戳
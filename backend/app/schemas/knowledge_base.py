@@ -53,12 +53,27 @@ class DocumentChunkResponse(BaseModel):
     created_at: datetime
 
 
+class SearchFilters(BaseModel):
+    file_ids: Optional[List[int]] = Field(None, description="只在这些文件中检索")
+    content_types: Optional[List[str]] = Field(None, description="内容类型，如 text / table / list / code")
+    section_titles: Optional[List[str]] = Field(None, description="章节标题")
+    source_files: Optional[List[str]] = Field(None, description="源文件名")
+    page_from: Optional[int] = Field(None, ge=0, description="起始页码（含）")
+    page_to: Optional[int] = Field(None, ge=0, description="结束页码（含）")
+    created_after: Optional[datetime] = Field(None, description="入库时间不早于")
+    created_before: Optional[datetime] = Field(None, description="入库时间不晚于")
+
+
 class ChatRequest(BaseModel):
     question: str = Field(..., min_length=1, description="用户问题")
     knowledge_base_id: int = Field(..., description="知识库ID")
+    knowledge_base_ids: Optional[List[int]] = Field(
+        None, max_length=10, description="同时检索的其他知识库ID（对话仍归属 knowledge_base_id）"
+    )
     conversation_id: Optional[str] = Field(None, description="对话ID")
     stream: bool = Field(False, description="是否流式响应")
     max_chunks: int = Field(5, ge=1, le=20, description="最大检索块数")
+    filters: Optional[SearchFilters] = Field(None, description="检索过滤条件（下推到向量库）")
 
 
 class ChatResponse(BaseModel):
@@ -0,0 +1,116 @@
+"""
+嵌入请求的自适应批大小控制（AIMD：加性增、乘性减）
+
+- 每个模型的批大小与上限从模型表的 max_batch 起步（见 model_registry）
+- 连续成功若干次后批大小 +step，直到学到的上限
+- 服务端明确报“批过大”（413 / 批大小类 400）时把上限压到出错批大小以下，并减半；
+  单条输入不合法的 400 不算批过大，由调用方按条标记失败
+- 上限被压低后，满批连续成功 recover_after 次再把上限 +step，直到模型表的 max_batch，
+  偶发的误判不会让上限在进程生命周期内只降不升
+- 429（限流）时只减半，不动上限
+每个模型各自学习，状态跨事件循环共享（线程锁保护）。
+"""
+
+import threading
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+
+
+@dataclass
+class _ModelBatchState:
+    batch_size: int
+    ceiling: int
+    max_batch: int
+    successes: int = 0
+    ceiling_successes: int = 0
+    grows: int = 0
+    too_large: int = 0
+    recoveries: int = 0
+    throttled: int = 0
+
+
+class AdaptiveBatchController:
+    """按模型维护批大小的 AIMD 控制器"""
+
+    def __init__(self, default_max_batch: int = 64, step: int = 2, grow_after: int = 5, recover_after: int = 20):
+        self.default_max_batch = max(1, default_max_batch)
+        self.step = max(1, step)
+        self.grow_after = max(1, grow_after)
+        self.recover_after = max(1, recover_after)
+        self._states: Dict[str, _ModelBatchState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, model: str) -> _ModelBatchState:
+        state = self._states.get(model)
+        if state is None:
+            size = self.default_max_batch
+            state = _ModelBatchState(batch_size=size, ceiling=size, max_batch=size)
+            self._states[model] = state
+        return state
+
+    def configure(self, model: str, max_batch: int) -> None:
+        """按模型表的批上限设定（首次）或更新该模型的最大批大小；已学到的更低上限保留"""
+        if max_batch <= 0:
+            return
+        with self._lock:
+            state = self._states.get(model)
+            if state is None:
+                self._states[model] = _ModelBatchState(batch_size=max_batch, ceiling=max_batch, max_batch=max_batch)
+                return
+            state.max_batch = max_batch
+            state.ceiling = min(state.ceiling, max_batch)
+            state.batch_size = min(state.batch_size, state.ceiling)
+
+    def current(self, model: str) -> int:
+        with self._lock:
+            return self._state(model).batch_size
+
+    def on_success(self, model: str, size: int) -> None:
+        with self._lock:
+            state = self._state(model)
+            # 只有“满批”的成功才说明当前批大小可行，小尾巴批不计入
+            if size < state.batch_size:
+                return
+            state.successes += 1
+            if state.batch_size >= state.ceiling and state.ceiling < state.max_batch:
+                # 已顶到学到的上限：攒够成功次数后试探性放宽上限
+                state.ceiling_successes += 1
+                if state.ceiling_successes >= self.recover_after:
+                    state.ceiling = min(state.max_batch, state.ceiling + self.step)
+                    state.ceiling_successes = 0
+                    state.recoveries += 1
+            if state.successes >= self.grow_after and state.batch_size < state.ceiling:
+                state.batch_size = min(state.ceiling, state.batch_size + self.step)
+                state.successes = 0
+                state.grows += 1
+
+    def on_too_large(self, model: str, size: int, allowed: Optional[int] = None) -> None:
+        """
+        服务端拒绝了 size 条的批：上限压到 size-1，当前值减半。
+        allowed 为服务端错误信息里给出的批上限（如有），直接作为该模型的最大批大小
+        """
+        with self._lock:
+            state = self._state(model)
+            if allowed:
+                state.max_batch = min(state.max_batch, max(1, allowed))
+                state.ceiling = min(state.ceiling, state.max_batch)
+            elif size > state.ceiling:
+                # 并发中的旧批次：上限已经学到，不再重复惩罚
+                return
+            state.too_large += 1
+            state.successes = 0
+            state.ceiling_successes = 0
+            if size > 1:
+                state.ceiling = max(1, min(state.ceiling, size - 1))
+            state.batch_size = max(1, min(state.ceiling, size // 2, state.batch_size))
+
+    def on_throttled(self, model: str) -> None:
+        with self._lock:
+            state = self._state(model)
+            state.throttled += 1
+            state.successes = 0
+            state.batch_size = max(1, state.batch_size // 2)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {model: asdict(state) for model, state in self._states.items()}
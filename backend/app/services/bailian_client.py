@@ -1,21 +1,52 @@
 # ./backend/app/services/bailian_client.py
 import json
+import re
 import asyncio
-from typing import List, Dict, Optional, Union, AsyncGenerator, Tuple
+import weakref
+from collections import deque
+from typing import List, Dict, Optional, Union, AsyncGenerator, Tuple, Deque
 import httpx
+import numpy as np
 from loguru import logger
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
 from app.core.config import settings
+from app.services.embedding_cache import embedding_cache
+from app.services.embedding_coalescer import EmbeddingCoalescer
+from app.services.embedding_queue import EmbeddingJobQueue
+from app.services.rate_limit import RequestRateLimiter
+from app.services.adaptive_batch import AdaptiveBatchController
+from app.services.chat_stream import DONE, OpenedSSEStream, StreamTimer, chat_stream_stats
+from app.services.hedging import HedgePolicy
+from app.services.model_registry import model_registry
+from app.services.resilience import BULK, INTERACTIVE, Bulkhead, CircuitBreaker, CircuitOpenError, is_retryable
+from app.services.tokenizer import count_tokens, split_by_tokens
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+    logger.warning("h2 not installed, Bailian client falls back to HTTP/1.1")
 
 
 # === 内部常量：不改变外部契约，仅用于稳健性 ===
-# 由于服务报错 “Range of input length should be [1, 8192]”，这里用字符长度做保守裁剪；
-# 6000 字符在中/英混合场景下通常 < 8192 token，必要时你可以调整到 5500 或 6500。
-_MAX_INPUT_CHARS = 6000
-# 对单次请求的最大子批量，避免一次性发太多 input
-_SUB_BATCH_SIZE = 64
-# 兜底的向量维度（不调用 create_embeddings 以免递归）
+# 服务端单条输入上限为 8192 token（“Range of input length should be [1, 8192]”），
+# 单条上限与单次请求的总 token 预算见 BAILIAN_EMBEDDING_MAX_INPUT_TOKENS / MAX_REQUEST_TOKENS
+# 子批大小从模型表的 max_batch 起步，由 AdaptiveBatchController 按服务端反馈调整
+# 服务端“批过大”的 400 错误信息（如 “batch size is invalid, it should not be larger than 10”）；
+# 其余 400（单条输入过长/为空等）只影响个别条目，不代表批过大
+_BATCH_TOO_LARGE_RE = re.compile(r"batch size|too many (?:inputs|texts)|not be larger than", re.IGNORECASE)
+_BATCH_LIMIT_RE = re.compile(r"(?:larger than|exceed(?:s|ed)?|at most|maximum(?: of)?)\s*(\d+)", re.IGNORECASE)
+# 遇到 429 时同一子批最多退避重试的次数，超过后按逐条降级处理
+_MAX_THROTTLE_RETRIES = 5
+# 兜底的向量维度：仅当模型既未实测过、也不在已知模型表里时使用（见 model_registry）
 _FALLBACK_EMBED_DIM = 1536
 
 
@@ -35,40 +66,195 @@ class BailianClient:
             "Accept": "application/json"
         }
 
+        # 嵌入请求的进程级限流（请求数/秒 + token/分钟），跨事件循环共享
+        self.embedding_limiter = RequestRateLimiter(
+            requests_per_second=settings.BAILIAN_EMBEDDING_RPS,
+            tokens_per_minute=settings.BAILIAN_EMBEDDING_TPM,
+            interactive_reserve=settings.BAILIAN_EMBEDDING_INTERACTIVE_RESERVE
+        )
+
+        # 按服务端反馈（批过大/429）自适应调整每个模型的子批大小，起点取模型表的 max_batch
+        self.batch_controller = AdaptiveBatchController(
+            default_max_batch=model_registry.get(self.embedding_model).max_batch
+        )
+
+        # 进程级嵌入任务队列：入库与查询统一排队，失败条目重新入队而不是补零
+        self.embedding_queue = EmbeddingJobQueue(
+            self.create_embeddings_partial,
+            default_model=self.embedding_model,
+            workers=settings.EMBEDDING_QUEUE_WORKERS,
+            interactive_workers=settings.EMBEDDING_QUEUE_INTERACTIVE_WORKERS,
+            max_batch=settings.EMBEDDING_QUEUE_MAX_BATCH,
+            max_attempts=settings.EMBEDDING_QUEUE_MAX_ATTEMPTS,
+            retry_delay=settings.EMBEDDING_QUEUE_RETRY_DELAY,
+            on_stop=self.aclose
+        )
+
+        # 并发查询在短窗口内合成一次嵌入请求
+        self.query_coalescer = EmbeddingCoalescer(
+            lambda texts: self.embedding_queue.embed(texts, priority=INTERACTIVE),
+            window_ms=settings.EMBEDDING_QUERY_COALESCE_WINDOW_MS,
+            max_batch=settings.EMBEDDING_QUERY_COALESCE_MAX_BATCH
+        )
+
+        # 对话请求对冲：非流式整次请求、流式首个事件之前各自按延迟分位触发
+        hedge_options = dict(
+            percentile=settings.BAILIAN_CHAT_HEDGE_PERCENTILE,
+            min_delay=settings.BAILIAN_CHAT_HEDGE_MIN_DELAY,
+            max_delay=settings.BAILIAN_CHAT_HEDGE_MAX_DELAY,
+            min_samples=settings.BAILIAN_CHAT_HEDGE_MIN_SAMPLES
+        )
+        self.chat_hedge = HedgePolicy("chat", **hedge_options)
+        self.stream_hedge = HedgePolicy("chat_stream_first_event", **hedge_options)
+
+        # 按接口熔断：上游故障时快速失败，不让重试把请求和入库任务挂住几十秒
+        breaker_options = dict(
+            failure_threshold=settings.BAILIAN_BREAKER_FAILURE_THRESHOLD,
+            recovery_timeout=settings.BAILIAN_BREAKER_RECOVERY_TIMEOUT,
+            half_open_max_calls=settings.BAILIAN_BREAKER_HALF_OPEN_PROBES
+        )
+        self.embedding_breaker = CircuitBreaker("embeddings", **breaker_options)
+        self.chat_breaker = CircuitBreaker("chat", **breaker_options)
+
+        # 舱壁隔离：批量入库与在线查询的嵌入请求各用一个并发池，入库再多也挤不占查询
+        self.embedding_bulkheads = {
+            BULK: Bulkhead("embeddings_bulk", settings.BAILIAN_EMBEDDING_BULK_MAX_INFLIGHT),
+            INTERACTIVE: Bulkhead("embeddings_interactive", settings.BAILIAN_EMBEDDING_INTERACTIVE_MAX_INFLIGHT),
+        }
+
+        # 每个事件循环一个共享连接池：主循环由应用生命周期管理，
+        # 后台任务自建的事件循环在退出前调用 aclose() 释放自己的那一个
+        self._http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    # ----------------- 连接池：创建 / 预热 / 关闭 -----------------
+
+    def _build_http_client(self) -> httpx.AsyncClient:
+        http2 = settings.BAILIAN_HTTP2 and HTTP2_AVAILABLE
+        client = httpx.AsyncClient(
+            http2=http2,
+            headers=self.headers,
+            limits=httpx.Limits(
+                max_connections=settings.BAILIAN_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.BAILIAN_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.BAILIAN_KEEPALIVE_EXPIRY,
+            ),
+            timeout=self._timeout(settings.BAILIAN_CHAT_TIMEOUT),
+        )
+        logger.info(
+            f"Created Bailian HTTP client (http2={http2}, "
+            f"max_connections={settings.BAILIAN_MAX_CONNECTIONS})"
+        )
+        return client
+
+    @staticmethod
+    def _timeout(read: float) -> httpx.Timeout:
+        """按操作设置读超时，连接超时统一较短，便于快速发现网络问题"""
+        return httpx.Timeout(read, connect=settings.BAILIAN_CONNECT_TIMEOUT)
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """获取当前事件循环上的共享客户端（不存在或已关闭时重建）"""
+        loop = asyncio.get_running_loop()
+        client = self._http_clients.get(loop)
+        if client is None or client.is_closed:
+            client = self._build_http_client()
+            self._http_clients[loop] = client
+        return client
+
+    async def startup(self) -> None:
+        """应用启动时调用：建立连接池，并按配置预热"""
+        self._get_http_client()
+        if settings.BAILIAN_WARMUP_ON_STARTUP:
+            await self.warmup()
+            # 首次部署时探测一次嵌入维度并登记，之后启动直接复用持久化结果
+            if model_registry.dimension(self.embedding_model) is None:
+                await self.get_embedding_dimensions()
+
+    async def warmup(self) -> bool:
+        """
+        预热连接：提前完成 DNS / TCP / TLS 握手，让首个真实请求直接复用连接。
+        只发一个轻量 GET，不消耗嵌入/对话配额；任何 HTTP 响应都视为连接已建立。
+        """
+        try:
+            response = await self._get_http_client().get(
+                f"{self.endpoint}/models",
+                timeout=self._timeout(settings.BAILIAN_CONNECT_TIMEOUT),
+            )
+            logger.info(f"Bailian connection warmed up ({response.http_version}, status={response.status_code})")
+            return True
+        except Exception as e:
+            logger.warning(f"Bailian warm-up failed: {e}")
+            return False
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的连接池（应用关闭 / 后台事件循环退出前调用）"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        client = self._http_clients.pop(loop, None)
+        if client is not None and not client.is_closed:
+            await client.aclose()
+            logger.info("Closed Bailian HTTP client")
+
     # ----------------- 私有辅助：文本分段 & 均值合并 -----------------
 
     @staticmethod
-    def _soft_segments(text: str, max_chars: int = _MAX_INPUT_CHARS) -> List[str]:
-        """把过长文本按字符安全上限切分；短文本保持 1 段。"""
+    def _soft_segments(text: str, max_tokens: Optional[int] = None) -> List[str]:
+        """把过长文本按 token 上限切分；短文本保持 1 段。"""
         if text is None:
             text = ""
-        if len(text) <= max_chars:
-            return [text]
-        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+        return split_by_tokens(text, max_tokens or settings.BAILIAN_EMBEDDING_MAX_INPUT_TOKENS)
+
+    @staticmethod
+    def _mean_vectors(vectors: np.ndarray) -> np.ndarray:
+        """对同一条文本的多个分段向量 (k, d) 求均值并做 L2 归一化，保持与单段向量同一尺度"""
+        mean = vectors.mean(axis=0, dtype=np.float32)
+        norm = float(np.linalg.norm(mean))
+        return mean / norm if norm > 0 else mean
+
+    def _zero_vector(self, dim: int = _FALLBACK_EMBED_DIM) -> np.ndarray:
+        return np.zeros(dim, dtype=np.float32)
 
     @staticmethod
-    def _mean_vectors(vectors: List[List[float]]) -> List[float]:
-        """对同一条文本的多个分段向量做元素均值（无 numpy 版）。"""
-        if not vectors:
-            return []
-        length = len(vectors[0])
-        if any(len(v) != length for v in vectors):
-            # 维度不一致，直接返回首段，避免出错（极少发生）
-            return vectors[0]
-        sums = [0.0] * length
-        for v in vectors:
-            for i, x in enumerate(v):
-                sums[i] += float(x)
-        n = float(len(vectors))
-        return [s / n for s in sums]
-
-    def _zero_vector(self, dim: int = _FALLBACK_EMBED_DIM) -> List[float]:
-        return [0.0] * dim
+    def _parse_embeddings(result: Dict) -> np.ndarray:
+        """从多种可能的响应格式中取出向量，直接转成 (n, d) float32 矩阵"""
+        if "data" in result:
+            # OpenAI 兼容格式带 index，按 index 排序保证与输入对齐
+            items = sorted(result["data"], key=lambda item: item.get("index", 0))
+            rows = [item.get("embedding", []) for item in items]
+        elif "output" in result and "embeddings" in result["output"]:
+            rows = [
+                item.get("embedding", []) if isinstance(item, dict) else item
+                for item in result["output"]["embeddings"]
+            ]
+        else:
+            rows = []
+            for key in result:
+                if isinstance(result[key], list) and len(result[key]) > 0:
+                    if isinstance(result[key][0], list):
+                        rows = result[key]
+                        break
+
+        if not rows or not rows[0]:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.asarray(rows, dtype=np.float32)
 
     # ----------------- 私有辅助：真正的 HTTP 调用（复用/降级） -----------------
 
-    async def _post_embeddings(self, inputs: List[str], model_name: str) -> List[List[float]]:
-        """对一批 inputs 调一次真实的 /embeddings 接口，返回等长向量列表。"""
+    async def _post_embeddings(
+        self,
+        inputs: List[str],
+        model_name: str,
+        tokens: Optional[int] = None,
+        priority: str = BULK
+    ) -> np.ndarray:
+        """
+        对一批 inputs 调一次真实的 /embeddings 接口，返回 (len(inputs), d) 的 float32 矩阵。
+        - 先过熔断器与对应优先级的舱壁，再限流
+        - 在线查询与入库都等令牌，查询可用入库用不到的预留额度（见 rate_limit），不排在入库积压之后
+        """
         payload = {"model": model_name, "input": inputs}
 
         # 调试信息可按需打开
@@ -76,127 +262,271 @@ class BailianClient:
         # logger.debug(f"Request headers: {self.headers}")
         # logger.debug(f"Request payload size: {len(inputs)}")
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.endpoint}/embeddings",
-                headers=self.headers,
-                json=payload,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
-
-        # 解析多种可能格式
-        if "data" in result:
-            embeddings = [item.get("embedding", []) for item in result["data"]]
-        elif "output" in result and "embeddings" in result["output"]:
-            embeddings = result["output"]["embeddings"]
-        else:
-            embeddings = []
-            for key in result:
-                if isinstance(result[key], list) and len(result[key]) > 0:
-                    if isinstance(result[key][0], list):
-                        embeddings = result[key]
-                        break
+        if tokens is None:
+            tokens = sum(count_tokens(s) for s in inputs)
+        self.embedding_breaker.check()  # 熔断时不进舱壁排队，直接失败
+        async with self.embedding_bulkheads[priority].slot():
+            await self.embedding_limiter.acquire(tokens, priority)
+            async with self.embedding_breaker.guard():
+                response = await self._get_http_client().post(
+                    f"{self.endpoint}/embeddings",
+                    json=payload,
+                    timeout=self._timeout(settings.BAILIAN_EMBEDDING_TIMEOUT)
+                )
+                response.raise_for_status()
+        result = _json_loads(response.content)
 
-        if not embeddings:
-            logger.error(f"Unexpected response format: {result}")
+        embeddings = self._parse_embeddings(result)
+        if embeddings.size == 0:
+            logger.error(f"Unexpected response format: {str(result)[:500]}")
             raise ValueError("Failed to extract embeddings from response")
 
         return embeddings
 
+    async def _embed_one_by_one(
+        self,
+        sub: List[str],
+        model_name: str,
+        priority: str = BULK
+    ) -> List[Optional[np.ndarray]]:
+        """
+        逐条降级重试。
+        返回与 sub 等长的向量列表，失败的位置为 None（合并时再按实际维度补零向量）；
+        熔断时直接抛出，不再逐条空转
+        """
+        vecs: List[Optional[np.ndarray]] = []
+        for s in sub:
+            try:
+                v = await self._post_embeddings([s], model_name, priority=priority)
+                vecs.append(v[0])
+            except CircuitOpenError:
+                raise
+            except Exception as ex2:
+                logger.error(f"embedding failed on single segment: {ex2}")
+                vecs.append(None)
+        return vecs
+
+    @staticmethod
+    def _batch_too_large(status: Optional[int], message: str) -> Tuple[bool, Optional[int]]:
+        """是否为“批过大”错误，以及错误信息里给出的批上限（如有）"""
+        if status == 413:
+            return True, None
+        if status != 400 or not _BATCH_TOO_LARGE_RE.search(message or ""):
+            return False, None
+        match = _BATCH_LIMIT_RE.search(message)
+        return True, int(match.group(1)) if match else None
+
+    @staticmethod
+    def _retry_after(response: Optional[httpx.Response], attempt: int) -> float:
+        """优先采用服务端 Retry-After，否则指数退避（上限 30s）"""
+        if response is not None:
+            try:
+                return max(0.0, float(response.headers.get("Retry-After", "")))
+            except ValueError:
+                pass
+        return min(30.0, 2.0 ** attempt)
+
     # ----------------- 对外：保持签名/契约不变的 create_embeddings -----------------
 
     @retry(
         stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=4, max=10)
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception(is_retryable),
+        reraise=True
     )
     async def create_embeddings(
         self,
         texts: Union[str, List[str]],
-        model: Optional[str] = None
-    ) -> List[List[float]]:
+        model: Optional[str] = None,
+        priority: str = BULK
+    ) -> np.ndarray:
         """
         创建文本嵌入向量
-        - 保持对外契约：输入 N 条文本 -> 返回 N 条向量
-        - 内部新增：过长文本自动分段；对分段向量做均值合并；子批失败降级逐条重试
+        - 对外契约：输入 N 条文本 -> 返回 (N, d) 的 float32 矩阵，第 i 行对应第 i 条文本
+        - 整条失败的文本补零向量；需要区分失败条目时用 create_embeddings_partial 或 embedding_queue
         """
         if isinstance(texts, str):
             texts = [texts]
+        vectors, _ = await self.create_embeddings_partial(texts, model, priority)
+        return vectors
+
+    async def create_embeddings_partial(
+        self,
+        texts: List[str],
+        model: Optional[str] = None,
+        priority: str = BULK
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        创建文本嵌入向量，返回 ((N, d) float32 矩阵, (N,) 失败掩码)；失败行为零向量
+        - 过长文本按 token 自动分段；对分段向量做均值合并；子批失败降级逐条重试
+        - 子批按 BAILIAN_EMBEDDING_CONCURRENCY 并发派发，按单次请求 token 预算装箱，受进程级令牌桶限流
+        - 子批大小按“批过大”/429 反馈自适应（AIMD），批过大时二分重试，限流时退避重排；
+          其他 400（单条输入问题）逐条重试，只把出错的条目标为失败
+        - priority：INTERACTIVE（在线查询）/ BULK（入库），各走独立的并发池；熔断时抛 CircuitOpenError
+        """
         if not texts:
-            return []
+            return np.empty((0, 0), dtype=np.float32), np.zeros(0, dtype=bool)
 
         model_name = model or self.embedding_model
 
-        # 1) 先将每条文本做“软分段”，记录映射关系
-        # segments_flat: 扁平化后的所有分段；index_map[i] = (start_idx_in_flat, segment_count)
+        # 0) 先查缓存，只把未命中的文本交给真实接口
+        out_vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        if embedding_cache is not None:
+            out_vectors = embedding_cache.get_many(model_name, texts)
+        pending = [idx for idx, v in enumerate(out_vectors) if v is None]
+        if not pending:
+            logger.info(f"Embeddings served from cache for {len(texts)} texts (model {model_name})")
+            return np.stack(out_vectors), np.zeros(len(texts), dtype=bool)
+
+        # 1) 先将每条未命中文本做“软分段”，记录映射关系
+        # segments_flat: 扁平化后的所有分段；index_map = [(text_idx, start_idx_in_flat, segment_count)]
         segments_flat: List[str] = []
-        index_map: List[Tuple[int, int]] = []
-        for t in texts:
-            segs = self._soft_segments(t, _MAX_INPUT_CHARS)
+        index_map: List[Tuple[int, int, int]] = []
+        info = model_registry.get(model_name)
+        max_input_tokens = model_registry.max_input_tokens(model_name, settings.BAILIAN_EMBEDDING_MAX_INPUT_TOKENS)
+        for idx in pending:
+            segs = self._soft_segments(texts[idx], max_input_tokens)
             start = len(segments_flat)
             segments_flat.extend(segs)
-            index_map.append((start, len(segs)))
-
-        if not segments_flat:
-            return []
-
-        # 2) 以子批为单位调用真实接口；若子批失败，降级到逐条重试，确保每段都有向量
-        seg_vectors: List[List[float]] = []
-        i = 0
-        while i < len(segments_flat):
-            sub = segments_flat[i:i + _SUB_BATCH_SIZE]
-            try:
-                vecs = await self._post_embeddings(sub, model_name)
-                if not vecs or len(vecs) != len(sub):
-                    raise RuntimeError("embedding api length mismatch")
-                seg_vectors.extend(vecs)
-                i += _SUB_BATCH_SIZE
-                # 避免限流：如需更稳可适当 sleep
-                # if i < len(segments_flat):
-                #     await asyncio.sleep(0.1)
-            except httpx.HTTPStatusError as e:
-                # 如果是 400 且包含长度错误，直接降级逐条
-                msg = e.response.text if e.response is not None else str(e)
-                logger.error(f"HTTP error on segments batch ({i}-{i+len(sub)}): {e.response.status_code} - {msg}")
-                # 降级逐条重试，避免整批失败
-                for s in sub:
-                    try:
-                        v = await self._post_embeddings([s], model_name)
-                        seg_vectors.extend(v)  # 单条也是列表
-                    except Exception as ex2:
-                        logger.error(f"embedding failed on single segment: {ex2}")
-                        seg_vectors.append(self._zero_vector())
-                i += _SUB_BATCH_SIZE
-            except Exception as e:
-                logger.error(f"Unexpected error on segments batch ({i}-{i+len(sub)}): {e}")
-                # 同样降级逐条
-                for s in sub:
-                    try:
-                        v = await self._post_embeddings([s], model_name)
-                        seg_vectors.extend(v)
-                    except Exception as ex2:
-                        logger.error(f"embedding failed on single segment: {ex2}")
-                        seg_vectors.append(self._zero_vector())
-                i += _SUB_BATCH_SIZE
-
-        # 3) 将分段向量按映射关系合并为“每条文本一条向量”
-        out_vectors: List[List[float]] = []
-        for start, count in index_map:
-            if count == 1:
-                out_vectors.append(seg_vectors[start])
-            else:
-                merged = self._mean_vectors(seg_vectors[start:start + count])
-                out_vectors.append(merged)
+            index_map.append((idx, start, len(segs)))
+
+        # 2) N 个 worker 并发拉取子批：每次按“当前”自适应批大小从游标切出下一批，
+        #    并在单次请求 token 预算内尽量装满；限流在 _post_embeddings 内统一处理，结果按下标回填保持顺序
+        seg_tokens = [count_tokens(seg) for seg in segments_flat]
+        request_budget = settings.BAILIAN_EMBEDDING_MAX_REQUEST_TOKENS
+        seg_vectors: List[Optional[np.ndarray]] = [None] * len(segments_flat)  # 失败的分段保持 None
+        controller = self.batch_controller
+        controller.configure(model_name, info.max_batch)
+        retry_jobs: Deque[Tuple[int, List[str], int]] = deque()  # (offset, 分段, 已限流次数)
+        cursor = 0
+
+        def _next_job() -> Optional[Tuple[int, List[str], int]]:
+            nonlocal cursor
+            size = controller.current(model_name)
+            if retry_jobs:
+                offset, sub, throttles = retry_jobs.popleft()
+                if len(sub) > size:
+                    retry_jobs.appendleft((offset + size, sub[size:], throttles))
+                    sub = sub[:size]
+                return offset, sub, throttles
+            if cursor < len(segments_flat):
+                offset = cursor
+                end = offset + 1  # 至少放一段
+                used = seg_tokens[offset]
+                while (
+                    end < len(segments_flat)
+                    and end - offset < size
+                    and used + seg_tokens[end] <= request_budget
+                ):
+                    used += seg_tokens[end]
+                    end += 1
+                cursor = end
+                return offset, segments_flat[offset:end], 0
+            return None
+
+        async def _worker() -> None:
+            while True:
+                job = _next_job()
+                if job is None:
+                    return
+                offset, sub, throttles = job
+                try:
+                    vecs = await self._post_embeddings(
+                        sub, model_name, tokens=sum(seg_tokens[offset:offset + len(sub)]), priority=priority
+                    )
+                    if len(vecs) != len(sub):
+                        raise RuntimeError("embedding api length mismatch")
+                    controller.on_success(model_name, len(sub))
+                    seg_vectors[offset:offset + len(sub)] = list(vecs)  # 行视图，不复制数据
+                    continue
+                except httpx.HTTPStatusError as e:
+                    status = e.response.status_code if e.response is not None else None
+                    msg = e.response.text if e.response is not None else str(e)
+                    logger.error(f"HTTP error on segments batch ({offset}-{offset+len(sub)}): {status} - {msg}")
+                    if status == 429 and throttles < _MAX_THROTTLE_RETRIES:
+                        # 限流：缩小批大小，退避后放回队首重试
+                        controller.on_throttled(model_name)
+                        await asyncio.sleep(self._retry_after(e.response, throttles))
+                        retry_jobs.appendleft((offset, sub, throttles + 1))
+                        continue
+                    too_large, allowed = self._batch_too_large(status, msg)
+                    if too_large and len(sub) > 1:
+                        # 批过大：学习上限并二分重试，而不是直接逐条
+                        controller.on_too_large(model_name, len(sub), allowed)
+                        half = len(sub) // 2
+                        retry_jobs.appendleft((offset + half, sub[half:], throttles))
+                        retry_jobs.appendleft((offset, sub[:half], throttles))
+                        continue
+                except CircuitOpenError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Unexpected error on segments batch ({offset}-{offset+len(sub)}): {e}")
+
+                # 其他错误（含单条输入不合法的 400）：降级逐条重试，只有出错的条目记为失败
+                seg_vectors[offset:offset + len(sub)] = await self._embed_one_by_one(sub, model_name, priority)
+
+        # 把回队的任务留给仍在运行的 worker：放回任务的 worker 自己会继续循环领取，不会丢任务；
+        # 任一 worker 遇到熔断即整体失败，其余 worker 一并取消
+        workers = [
+            asyncio.ensure_future(_worker())
+            for _ in range(max(1, settings.BAILIAN_EMBEDDING_CONCURRENCY))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
 
-        logger.info(f"Created embeddings for {len(texts)} texts using model {model_name}")
-        return out_vectors
+        # 3) 将分段向量按映射关系合并为“每条文本一条向量”，成功的结果回写缓存；
+        #    失败的分段不参与均值，整条都失败时用零向量兜底（不写缓存）
+        dim = next((v.shape[0] for v in seg_vectors if v is not None), None)
+        if dim is not None:
+            model_registry.record_dimension(model_name, dim)
+        else:
+            dim = next(
+                (v.shape[0] for v in out_vectors if v is not None),
+                model_registry.expected_dimension(model_name, _FALLBACK_EMBED_DIM)
+            )
+        cache_texts: List[str] = []
+        cache_vectors: List[np.ndarray] = []
+        failed = np.zeros(len(texts), dtype=bool)
+        for idx, start, count in index_map:
+            parts = [v for v in seg_vectors[start:start + count] if v is not None]
+            if not parts:
+                out_vectors[idx] = self._zero_vector(dim)
+                failed[idx] = True
+                continue
+            vec = parts[0] if count == 1 else self._mean_vectors(np.stack(parts))
+            out_vectors[idx] = vec
+            if len(parts) == count:
+                cache_texts.append(texts[idx])
+                cache_vectors.append(vec)
+
+        if embedding_cache is not None and cache_texts:
+            embedding_cache.put_many(model_name, cache_texts, cache_vectors)
+
+        logger.info(
+            f"Created embeddings for {len(texts)} texts using model {model_name} "
+            f"(api={len(pending)}, cached={len(texts) - len(pending)}, failed={int(failed.sum())})"
+        )
+        return np.stack(out_vectors).astype(np.float32, copy=False), failed
+
+    async def embed_query(self, query: str) -> np.ndarray:
+        """
+        检索用的单条查询向量（一维 float32）
+        - 与同一窗口内其他并发查询合批发送，见 EmbeddingCoalescer
+        """
+        return await self.query_coalescer.embed(query)
 
     # ----------------- 对外：聊天接口（未改动） -----------------
 
     @retry(
         stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=4, max=10)
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception(is_retryable),
+        reraise=True
     )
     async def chat_completion(
         self,
@@ -232,47 +562,77 @@ class BailianClient:
             raise
 
     async def _single_chat_completion(self, payload: Dict) -> Dict:
-        """非流式聊天完成"""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
+        """非流式聊天完成（开启对冲时，慢于近期 p 分位会再发一份，先到先用）"""
+        if settings.BAILIAN_CHAT_HEDGING:
+            result = await self.chat_hedge.run(lambda: self._post_chat_completion(payload))
+        else:
+            result = await self._post_chat_completion(payload)
+
+        logger.info(f"Chat completion completed with model {payload['model']}")
+        return result
+
+    async def _post_chat_completion(self, payload: Dict) -> Dict:
+        self.chat_breaker.check()
+        async with self.chat_breaker.guard():
+            response = await self._get_http_client().post(
                 f"{self.endpoint}/chat/completions",
-                headers=self.headers,
                 json=payload,
-                timeout=60.0
+                timeout=self._timeout(settings.BAILIAN_CHAT_TIMEOUT)
             )
-
             response.raise_for_status()
-            result = response.json()
-
-            logger.info(f"Chat completion completed with model {payload['model']}")
-            return result
+        return _json_loads(response.content)
 
     async def _stream_chat_completion(self, payload: Dict) -> AsyncGenerator[Dict, None]:
-        """流式聊天完成"""
+        """
+        流式聊天完成
+        - 按字节增量解析 SSE，orjson 解码，不逐行构造 str
+        - 记录 TTFT / token 间隔 / tokens/s，结束时写入 chat_stream_stats
+        - 开启对冲时只对冲“首个事件之前”这一段，拿到首个事件后落败的连接立即断开
+        """
         payload["stream"] = True
-
-        async with httpx.AsyncClient() as client:
-            async with client.stream(
-                "POST",
-                f"{self.endpoint}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=60.0
-            ) as response:
-                response.raise_for_status()
-
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data_str = line[6:]  # 去掉 "data: " 前缀
-
-                        if data_str.strip() == "[DONE]":
-                            break
-
-                        try:
-                            data = json.loads(data_str)
-                            yield data
-                        except json.JSONDecodeError:
-                            continue
+        # 让服务端在最后一个事件里带上 usage，用真实 completion_tokens 计算吞吐
+        payload.setdefault("stream_options", {"include_usage": True})
+
+        timer = StreamTimer()
+
+        async def _open() -> OpenedSSEStream:
+            # 熔断器只看“首个事件之前”的成败；流建立后的中断由调用方处理
+            self.chat_breaker.check()
+            async with self.chat_breaker.guard():
+                return await OpenedSSEStream(
+                    self._get_http_client(),
+                    f"{self.endpoint}/chat/completions",
+                    payload,
+                    self._timeout(settings.BAILIAN_CHAT_TIMEOUT)
+                ).open()
+
+        stream: Optional[OpenedSSEStream] = None
+        try:
+            if settings.BAILIAN_CHAT_HEDGING:
+                stream = await self.stream_hedge.run(_open, discard=lambda s: s.aclose())
+            else:
+                stream = await _open()
+
+            async for data in stream.payloads():
+                if data.strip() == DONE:
+                    return
+                try:
+                    chunk = _json_loads(data)
+                except ValueError:
+                    continue
+
+                choices = chunk.get("choices")
+                if choices and choices[0].get("delta", {}).get("content"):
+                    timer.on_token()
+                usage = chunk.get("usage")
+                if usage and usage.get("completion_tokens"):
+                    timer.usage_tokens = usage["completion_tokens"]
+                yield chunk
+        finally:
+            if stream is not None:
+                await stream.aclose()
+            chat_stream_stats.record(timer)
+            logger.info(f"Chat stream finished with model {payload['model']}: {timer.summary()}")
 
     # ----------------- 对外：批量嵌入（不改用法） -----------------
 
@@ -281,62 +641,46 @@ class BailianClient:
         texts: List[str],
         batch_size: int = 10,
         model: Optional[str] = None
-    ) -> List[List[float]]:
+    ) -> np.ndarray:
         """
         批量创建嵌入向量
-        - 保持原用法：按 batch_size 分批调用 create_embeddings
-        - create_embeddings 内部已具备分段/容错，这里无需再切分
+        - 保持原用法；改为提交到进程级任务队列，由队列统一按优先级/限流调度
+        - batch_size 仅为兼容保留，实际批大小由队列与自适应控制器决定
+        - 失败条目由队列重试，重试用尽时抛 EmbeddingFailedError（不再补零向量）
         """
         if not texts:
-            return []
-
-        all_embeddings = []
-
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i + batch_size]
-            try:
-                batch_embeddings = await self.create_embeddings(batch_texts, model)
-                all_embeddings.extend(batch_embeddings)
-
-                # 避免API限流（按需调整/或关闭）
-                if i + batch_size < len(texts):
-                    await asyncio.sleep(0.5)
-
-            except Exception as e:
-                logger.error(f"Error processing batch {i}-{i + batch_size}: {e}")
-                # 为失败的批次创建空向量（保持返回长度一致）
-                all_embeddings.extend([self._zero_vector() for _ in batch_texts])
+            return np.empty((0, 0), dtype=np.float32)
 
+        all_embeddings = await self.embedding_queue.embed(texts, model, BULK)
         logger.info(f"Completed batch embeddings for {len(texts)} texts")
         return all_embeddings
 
     async def get_embedding_dimensions(self, model: Optional[str] = None) -> int:
         """
         获取嵌入向量维度
+        - 优先取模型登记表里的实测值；未知时才发一次真实请求探测，结果会被登记并持久化
         """
+        model_name = model or self.embedding_model
+        dimension = model_registry.dimension(model_name)
+        if dimension:
+            return dimension
         try:
-            # 使用测试文本获取维度
-            test_embeddings = await self.create_embeddings(["test"], model)
-            if test_embeddings and test_embeddings[0]:
-                return len(test_embeddings[0])
-            else:
-                # 默认维度（根据百炼平台的默认embedding模型）
-                return _FALLBACK_EMBED_DIM
+            test_embeddings = await self.create_embeddings(["test"], model_name)
+            if test_embeddings.size:
+                return int(test_embeddings.shape[1])
         except Exception as e:
             logger.warning(f"Could not determine embedding dimensions: {e}")
-            return _FALLBACK_EMBED_DIM  # 默认维度
+        # 默认维度（已知模型表中的值，否则按百炼默认embedding模型）
+        return model_registry.expected_dimension(model_name, _FALLBACK_EMBED_DIM)
 
     async def health_check(self) -> bool:
         """
-        健康检查
+        健康检查：熔断器未打开且上游可达即视为健康（不消耗嵌入配额）
         """
-        try:
-            # 简单的embedding测试
-            await self.create_embeddings(["health check"])
-            return True
-        except Exception as e:
-            logger.error(f"Health check failed: {e}")
+        if self.embedding_breaker.state == CircuitBreaker.OPEN:
+            logger.error("Health check failed: embeddings circuit is open")
             return False
+        return await self.warmup()
 
 
 class RAGService:
@@ -447,24 +791,25 @@ class RAGService:
         response_stream: AsyncGenerator[Dict, None],
         context_chunks: List[Dict]
     ) -> AsyncGenerator[Dict, None]:
-        """处理流式响应"""
+        """处理流式响应（来源只计算一次，各增量事件共享同一个列表）"""
+        sources = self._extract_sources(context_chunks)
         try:
             async for chunk in response_stream:
-                choice = chunk.get("choices", [{}])[0]
-                delta = choice.get("delta", {})
-                content = delta.get("content", "")
+                choices = chunk.get("choices")
+                if not choices:
+                    # include_usage 的最后一个事件 choices 为空，只带 usage
+                    continue
+                choice = choices[0]
+                delta = choice.get("delta")
+                content = delta.get("content") if delta else None
 
                 if content:
-                    yield {
-                        "content": content,
-                        "sources": self._extract_sources(context_chunks),
-                        "finished": False
-                    }
+                    yield {"content": content, "sources": sources, "finished": False}
 
                 if choice.get("finish_reason"):
                     yield {
                         "content": "",
-                        "sources": self._extract_sources(context_chunks),
+                        "sources": sources,
                         "finished": True,
                         "context_chunks": len(context_chunks)
                     }
@@ -505,6 +850,8 @@ async def test_embeddings():
         print("测试成功！结果:", result)
     except Exception as e:
         print("测试失败！错误:", e)
+    finally:
+        await client.aclose()
 
 # 运行测试
 if __name__ == "__main__":
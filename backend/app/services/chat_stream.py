@@ -0,0 +1,214 @@
+"""
+对话流式响应：增量 SSE 解析 + 首 token / token 间隔时延统计
+
+- SSEParser 直接在字节上按行切分，不做逐行 str 解码，data 负载交给 orjson 解析
+- StreamTimer 记录单次请求的 TTFT、token 间隔与 tokens/s
+- StreamLatencyStats 汇总最近若干次请求的分位数，供 /metrics 查看
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+DONE = b"[DONE]"
+
+
+class SSEParser:
+    """
+    增量 SSE 解析器：feed() 接收任意切分的字节块，返回其中已完整的事件 data 负载。
+    - 支持 \\n / \\r\\n 换行，多行 data 按规范以 \\n 拼接
+    - 忽略注释行（以冒号开头）与 event/id/retry 等字段
+    """
+
+    __slots__ = ("_buffer", "_data")
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        self._buffer += chunk
+        events: List[bytes] = []
+        buf = self._buffer
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            line = bytes(buf[start:end])
+            start = end + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            if not line:
+                # 空行：事件结束
+                if self._data:
+                    events.append(self._data[0] if len(self._data) == 1 else b"\n".join(self._data))
+                    self._data = []
+                continue
+            if line.startswith(b"data:"):
+                value = line[5:]
+                self._data.append(value[1:] if value.startswith(b" ") else value)
+        if start:
+            del buf[:start]
+        return events
+
+    def flush(self) -> List[bytes]:
+        """流结束时取出尚未以空行结束的最后一个事件"""
+        events = self.feed(b"\n") if self._buffer else []
+        if self._data:
+            events.append(b"\n".join(self._data))
+            self._data = []
+        return events
+
+
+class OpenedSSEStream:
+    """
+    已收到首个事件的 SSE 流。
+    open() 在拿到第一个 data 负载（或流结束）后才返回，
+    因此可以把“等首个事件”这一段交给对冲逻辑，落败的一方 aclose() 即断开连接。
+    """
+
+    def __init__(self, client: httpx.AsyncClient, url: str, payload: Dict, timeout: httpx.Timeout):
+        self.client = client
+        self.url = url
+        self.payload = payload
+        self.timeout = timeout
+        self.parser = SSEParser()
+        self._pending: Deque[bytes] = deque()
+        self._stack = AsyncExitStack()
+        self._chunks: Optional[AsyncIterator[bytes]] = None
+
+    async def open(self) -> "OpenedSSEStream":
+        try:
+            response = await self._stack.enter_async_context(
+                self.client.stream("POST", self.url, json=self.payload, timeout=self.timeout)
+            )
+            response.raise_for_status()
+            self._chunks = response.aiter_bytes()
+            while not self._pending:
+                try:
+                    raw = await self._chunks.__anext__()
+                except StopAsyncIteration:
+                    self._pending.extend(self.parser.flush())
+                    break
+                self._pending.extend(self.parser.feed(raw))
+        except BaseException:
+            await self._stack.aclose()
+            raise
+        return self
+
+    async def payloads(self) -> AsyncIterator[bytes]:
+        """依次产出全部 data 负载（含 open() 时已读到的）"""
+        while self._pending:
+            yield self._pending.popleft()
+        async for raw in self._chunks:
+            for data in self.parser.feed(raw):
+                yield data
+        for data in self.parser.flush():
+            yield data
+
+    async def aclose(self) -> None:
+        await self._stack.aclose()
+
+
+@dataclass
+class StreamTimer:
+    """单次流式请求的时延记录（秒）"""
+
+    started: float = field(default_factory=time.perf_counter)
+    first_token: Optional[float] = None
+    last_token: Optional[float] = None
+    tokens: int = 0                          # 收到的内容增量数（用于 token 间隔）
+    usage_tokens: Optional[int] = None       # 服务端 usage.completion_tokens（用于吞吐）
+    max_gap: float = 0.0
+
+    def on_token(self, count: int = 1) -> None:
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+        elif now - self.last_token > self.max_gap:
+            self.max_gap = now - self.last_token
+        self.last_token = now
+        self.tokens += count
+
+    @property
+    def ttft(self) -> Optional[float]:
+        return None if self.first_token is None else self.first_token - self.started
+
+    @property
+    def mean_gap(self) -> Optional[float]:
+        if self.first_token is None or self.tokens < 2:
+            return None
+        return (self.last_token - self.first_token) / (self.tokens - 1)
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if self.first_token is None or self.last_token == self.first_token:
+            return None
+        generated = self.usage_tokens or self.tokens
+        return (generated - 1) / (self.last_token - self.first_token)
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        def ms(v: Optional[float]) -> Optional[float]:
+            return None if v is None else round(v * 1000, 1)
+
+        tps = self.tokens_per_second
+        return {
+            "ttft_ms": ms(self.ttft),
+            "mean_inter_token_ms": ms(self.mean_gap),
+            "max_inter_token_ms": ms(self.max_gap),
+            "tokens": self.usage_tokens or self.tokens,
+            "tokens_per_second": None if tps is None else round(tps, 1),
+            "total_ms": ms(time.perf_counter() - self.started),
+        }
+
+
+class StreamLatencyStats:
+    """最近 window 次流式请求的时延分位数（线程安全）"""
+
+    def __init__(self, window: int = 1000):
+        self._ttft: Deque[float] = deque(maxlen=window)
+        self._gap: Deque[float] = deque(maxlen=window)
+        self._tps: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.no_token = 0
+
+    def record(self, timer: StreamTimer) -> None:
+        with self._lock:
+            self.requests += 1
+            if timer.ttft is None:
+                self.no_token += 1
+                return
+            self._ttft.append(timer.ttft)
+            if timer.mean_gap is not None:
+                self._gap.append(timer.mean_gap)
+            if timer.tokens_per_second is not None:
+                self._tps.append(timer.tokens_per_second)
+
+    @staticmethod
+    def _percentiles(values, scale: float = 1.0) -> Optional[Dict[str, float]]:
+        if not values:
+            return None
+        p50, p95, p99 = np.percentile(np.fromiter(values, dtype=np.float64), [50, 95, 99]) * scale
+        return {"p50": round(float(p50), 1), "p95": round(float(p95), 1), "p99": round(float(p99), 1)}
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "no_token": self.no_token,
+                "ttft_ms": self._percentiles(self._ttft, 1000),
+                "inter_token_ms": self._percentiles(self._gap, 1000),
+                "tokens_per_second": self._percentiles(self._tps),
+            }
+
+
+# 创建全局实例
+chat_stream_stats = StreamLatencyStats()
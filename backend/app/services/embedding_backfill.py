@@ -0,0 +1,236 @@
+"""
+嵌入补齐任务：把入库时嵌入失败的文档块补写进向量库
+
+入库时嵌入失败的块不写零向量（零向量会污染相似度检索），而是在 document_chunks
+里标记 embedding_pending。本任务在主事件循环上周期性扫描这些块，失败后按
+BASE_DELAY * 2^attempts（封顶 MAX_DELAY）退避，下次补齐时间写入 next_attempt_at 并在 SQL 中过滤，
+重新嵌入后用原 vector_id upsert 进集合；某个文件的块全部补齐后把文件的 vectorization_status 置为 completed。
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy import select, func, or_
+
+from app.core.config import settings
+from app.db.database import AsyncSessionLocal
+from app.models.document_chunk import DocumentChunk
+from app.models.file import File as FileModel
+from app.models.knowledge_base import KnowledgeBase
+
+
+class EmbeddingBackfiller:
+    """周期性补齐 embedding_pending 的文档块"""
+
+    def __init__(
+        self,
+        interval: float = 30.0,
+        batch_size: int = 128,
+        base_delay: float = 30.0,
+        max_delay: float = 3600.0
+    ):
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+        self.runs = 0
+        self.backfilled = 0
+        self.failed = 0
+        self.files_completed = 0
+        self.last_run_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    # ----------------- 生命周期 -----------------
+
+    def start(self) -> None:
+        """在当前事件循环上启动后台任务（重复调用无副作用）"""
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"Embedding backfill started (interval={self.interval}s)")
+
+    def trigger(self) -> None:
+        """立即触发一轮扫描"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # 一轮处理满批说明还有积压，不等间隔直接继续
+                while await self.run_once() >= self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)[:500]
+                logger.error(f"Embedding backfill run failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    # ----------------- 单轮补齐 -----------------
+
+    def _backoff(self, attempts: int) -> timedelta:
+        return timedelta(seconds=min(self.max_delay, self.base_delay * (2 ** attempts)))
+
+    async def run_once(self) -> int:
+        """补齐一批到期的块，返回本轮处理（成功 + 失败）的块数"""
+        # 延迟导入：向量库模块在导入时就会连接 Chroma
+        from app.services.vector_store import vector_store_manager
+
+        self.runs += 1
+        self.last_run_at = time.time()
+        now = datetime.now(timezone.utc)
+
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                select(DocumentChunk, KnowledgeBase.collection_name)
+                .join(KnowledgeBase, KnowledgeBase.id == DocumentChunk.knowledge_base_id)
+                .where(
+                    DocumentChunk.embedding_pending.is_(True),
+                    # 到期条件放在 SQL 里，避免 LIMIT 窗口被仍在退避的块占满；NULL 表示立即补齐
+                    or_(DocumentChunk.next_attempt_at.is_(None), DocumentChunk.next_attempt_at <= now),
+                    # 软删除的知识库保留了块，但集合已删；upsert 会把集合重新建出来
+                    KnowledgeBase.status != "deleted"
+                )
+                .order_by(DocumentChunk.next_attempt_at, DocumentChunk.id)
+                .limit(self.batch_size)
+            )).all()
+
+            due = list(rows)
+            if not due:
+                return 0
+
+            by_collection: Dict[str, List[DocumentChunk]] = defaultdict(list)
+            for chunk, collection_name in due:
+                by_collection[collection_name].append(chunk)
+
+            touched_files = set()
+            for collection_name, chunks in by_collection.items():
+                payload = [
+                    {
+                        # 沿用块 id，_build_document 写入 chunk_id，检索结果才能对回 DocumentChunk
+                        "id": c.id,
+                        "content": c.content,
+                        "metadata": dict(c.chunk_metadata or {}),
+                        "file_id": c.file_id,
+                        "knowledge_base_id": c.knowledge_base_id,
+                        "chunk_index": c.chunk_index,
+                        "vector_id": c.vector_id,
+                    }
+                    for c in chunks
+                ]
+                try:
+                    _, pending = await vector_store_manager.add_document_chunks_with_pending(
+                        collection_name, payload, upsert=True
+                    )
+                except Exception as e:
+                    # 整组失败（熔断、向量库不可用等）：全部计一次失败，等下一轮退避
+                    logger.warning(f"Backfill for collection {collection_name} failed: {e}")
+                    self.last_error = str(e)[:500]
+                    pending = {c.vector_id for c in chunks}
+
+                for c in chunks:
+                    if c.vector_id in pending:
+                        c.embedding_attempts = (c.embedding_attempts or 0) + 1
+                        c.next_attempt_at = datetime.now(timezone.utc) + self._backoff(c.embedding_attempts)
+                        self.failed += 1
+                    else:
+                        c.embedding_pending = False
+                        c.next_attempt_at = None
+                        c.vectorized_at = datetime.now()
+                        self.backfilled += 1
+                    touched_files.add(c.file_id)
+
+            await session.flush()
+            await self._complete_files(session, touched_files)
+            await session.commit()
+
+        logger.info(f"Embedding backfill processed {len(due)} chunks")
+        return len(due)
+
+    async def _complete_files(self, session, file_ids) -> None:
+        """没有剩余待补齐块的 partial 文件置为 completed"""
+        for file_id in file_ids:
+            remaining = await self._pending_count(session, file_id)
+            if remaining:
+                continue
+            file_record = (await session.execute(
+                select(FileModel).where(FileModel.id == file_id)
+            )).scalar_one_or_none()
+            if file_record is not None and file_record.vectorization_status == "partial":
+                file_record.vectorization_status = "completed"
+                file_record.vectorization_error = None
+                file_record.vectorized_at = datetime.now()
+                self.files_completed += 1
+                logger.info(f"File {file_id} fully vectorized after backfill")
+
+    @staticmethod
+    async def _pending_count(session, file_id: int) -> int:
+        return (await session.execute(
+            select(func.count()).select_from(DocumentChunk).where(
+                DocumentChunk.file_id == file_id,
+                DocumentChunk.embedding_pending.is_(True)
+            )
+        )).scalar_one()
+
+    # ----------------- 进度与统计 -----------------
+
+    async def progress(self, session, file_id: int) -> Dict[str, object]:
+        """单个文件的嵌入进度"""
+        total, pending, max_attempts = (await session.execute(
+            select(
+                func.count(),
+                func.count().filter(DocumentChunk.embedding_pending.is_(True)),
+                func.max(DocumentChunk.embedding_attempts).filter(DocumentChunk.embedding_pending.is_(True))
+            ).where(DocumentChunk.file_id == file_id)
+        )).one()
+        return {
+            "file_id": file_id,
+            "total_chunks": total,
+            "embedded_chunks": total - pending,
+            "pending_chunks": pending,
+            "max_attempts": max_attempts or 0,
+            "progress": round((total - pending) / total, 4) if total else 1.0,
+        }
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "runs": self.runs,
+            "backfilled": self.backfilled,
+            "failed": self.failed,
+            "files_completed": self.files_completed,
+            "last_run_at": self.last_run_at,
+            "last_error": self.last_error,
+        }
+
+
+# 创建全局实例
+embedding_backfiller = EmbeddingBackfiller(
+    interval=settings.EMBEDDING_BACKFILL_INTERVAL,
+    batch_size=settings.EMBEDDING_BACKFILL_BATCH,
+    base_delay=settings.EMBEDDING_BACKFILL_BASE_DELAY,
+    max_delay=settings.EMBEDDING_BACKFILL_MAX_DELAY
+)
@@ -0,0 +1,189 @@
+"""
+嵌入向量缓存：内存 LRU + SQLite 持久层
+
+键为 (模型名, 规范化文本的 sha256)，值为 float32 二进制。
+重复上传、/reindex、重复提问时只把未命中的文本发给嵌入接口。
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """NFKC 归一化 + 折叠空白，使仅有空白/全半角差异的文本命中同一条缓存"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+class EmbeddingCache:
+    """两级嵌入缓存（线程安全：后台入库任务运行在独立线程/事件循环中）"""
+
+    def __init__(
+        self,
+        max_memory_items: int = 20000,
+        db_path: Optional[str] = None
+    ):
+        self.max_memory_items = max_memory_items
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        # SQLite 在首次读写时才打开：导入模块不应在当前目录下创建文件
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_failed = False
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # ----------------- 持久层 -----------------
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        """按需打开 SQLite（调用方持有 self._lock）；打开失败后只用内存层，不再重试"""
+        if self._conn is not None or not self.db_path or self._conn_failed:
+            return self._conn
+        try:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+            logger.info(f"Embedding cache persisted at {self.db_path}")
+        except Exception as e:
+            logger.warning(f"Embedding disk cache unavailable ({self.db_path}): {e}")
+            self._conn_failed = True
+        return self._conn
+
+    # ----------------- 内存层 -----------------
+
+    def _memory_get(self, key: str) -> Optional[np.ndarray]:
+        vec = self._memory.get(key)
+        if vec is not None:
+            self._memory.move_to_end(key)
+        return vec
+
+    def _memory_put(self, key: str, vec: np.ndarray) -> None:
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    # ----------------- 对外接口 -----------------
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """批量查询；返回与 texts 等长的 float32 向量列表，未命中位置为 None"""
+        keys = [cache_key(model, t) for t in texts]
+        out: List[Optional[np.ndarray]] = [None] * len(keys)
+
+        with self._lock:
+            disk_lookup: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                vec = self._memory_get(key)
+                if vec is not None:
+                    out[i] = vec
+                    self.memory_hits += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            if disk_lookup and self._disk() is not None:
+                found = self._disk_get(list(disk_lookup.keys()))
+                for key, vec in found.items():
+                    self._memory_put(key, vec)
+                    for i in disk_lookup.pop(key):
+                        out[i] = vec
+                        self.disk_hits += 1
+
+            self.misses += sum(len(idx) for idx in disk_lookup.values())
+        return out
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[np.ndarray]) -> None:
+        """写入两级缓存"""
+        rows = []
+        with self._lock:
+            for text, vec in zip(texts, vectors):
+                key = cache_key(model, text)
+                # 复制一份：避免缓存持有整批响应矩阵的视图，也防止调用方原地修改
+                vec = np.array(vec, dtype=np.float32)
+                vec.setflags(write=False)
+                self._memory_put(key, vec)
+                rows.append((key, vec.shape[0], vec.tobytes()))
+
+            if rows and self._disk() is not None:
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)",
+                        rows
+                    )
+                    self._conn.commit()
+                except Exception as e:
+                    logger.warning(f"Embedding disk cache write failed: {e}")
+
+    def _disk_get(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        # SQLite 默认单条语句最多 999 个参数
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            try:
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    part
+                ).fetchall()
+            except Exception as e:
+                logger.warning(f"Embedding disk cache read failed: {e}")
+                return found
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)  # 只读视图，零拷贝
+        return found
+
+    def stats(self) -> Dict[str, object]:
+        """命中/未命中统计"""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_items": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "persistent": bool(self.db_path) and not self._conn_failed,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 创建全局实例（关闭时返回 None，调用方直接跳过缓存）
+embedding_cache: Optional[EmbeddingCache] = (
+    EmbeddingCache(
+        max_memory_items=settings.EMBEDDING_CACHE_MEMORY_ITEMS,
+        db_path=settings.EMBEDDING_CACHE_PATH or None
+    )
+    if settings.EMBEDDING_CACHE_ENABLED
+    else None
+)
@@ -0,0 +1,120 @@
+"""
+查询向量合批（micro-batching）
+
+高峰期大量并发提问各自发一次单条嵌入请求，往返时延主导 p99。
+这里把同一事件循环上、一个很短窗口内到达的查询攒成一批，
+一次 create_embeddings 调用后再把每条向量分发回各自的调用方：
+- 第一条查询到达时开始计时，窗口到期或攒满 max_batch 立即发出
+- 同一批内重复的查询只发送一次
+- 批请求失败时，该批所有调用方收到同一个异常
+"""
+
+import asyncio
+import weakref
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import numpy as np
+from loguru import logger
+
+EmbedBatchFn = Callable[[List[str]], Awaitable[np.ndarray]]
+
+
+@dataclass
+class _PendingBatch:
+    texts: List[str] = field(default_factory=list)
+    futures: List[asyncio.Future] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class EmbeddingCoalescer:
+    """按事件循环收集查询，窗口内合成一次嵌入请求"""
+
+    def __init__(self, embed_batch: EmbedBatchFn, window_ms: float = 5.0, max_batch: int = 32):
+        self.embed_batch = embed_batch
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        # 每个事件循环各自攒批：Future 不能跨循环完成
+        self._pending: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _PendingBatch]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.queries = 0
+        self.batches = 0
+        self.max_batch_seen = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_batch > 1
+
+    async def embed(self, text: str) -> np.ndarray:
+        """返回单条查询的向量（一维 float32）"""
+        self.queries += 1
+        if not self.enabled:
+            self.batches += 1
+            return (await self.embed_batch([text]))[0]
+
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(loop)
+        if batch is None:
+            batch = _PendingBatch()
+            batch.timer = loop.call_later(self.window, self._flush, loop)
+            self._pending[loop] = batch
+
+        future = loop.create_future()
+        batch.texts.append(text)
+        batch.futures.append(future)
+        if len(batch.texts) >= self.max_batch:
+            self._flush(loop)
+        return await future
+
+    def _flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        batch = self._pending.pop(loop, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = loop.create_task(self._dispatch(batch))
+        # 保留引用，避免任务在完成前被垃圾回收
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: _PendingBatch) -> None:
+        # 同一批内去重，只发送不同的文本
+        unique: Dict[str, int] = {}
+        for text in batch.texts:
+            unique.setdefault(text, len(unique))
+
+        self.batches += 1
+        self.max_batch_seen = max(self.max_batch_seen, len(unique))
+        try:
+            vectors = await self.embed_batch(list(unique))
+            if len(vectors) != len(unique):
+                raise RuntimeError(
+                    f"coalesced embedding length mismatch: got={len(vectors)}, expect={len(unique)}"
+                )
+        except asyncio.CancelledError:
+            for future in batch.futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Coalesced query embedding failed for {len(batch.texts)} queries: {e}")
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for text, future in zip(batch.texts, batch.futures):
+            # 调用方可能已被取消（例如客户端断开），跳过即可
+            if not future.done():
+                future.set_result(vectors[unique[text]])
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queries": self.queries,
+            "batches": self.batches,
+            "avg_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+        }
@@ -0,0 +1,364 @@
+"""
+嵌入后端抽象
+
+通过 EMBEDDING_PROVIDER 选择：
+- bailian：百炼 OpenAI 兼容接口（默认，带缓存/限流/合批）
+- hashing：本地特征哈希向量，确定性、无网络、无配额，用于离线入库/检索压测
+- onnx：本地 ONNX 模型（onnxruntime + tokenizers），CPU 推理
+
+不同后端的向量不在同一空间，混用会让检索结果失去意义。
+因此每个后端都有 space 标识，兜底后端必须与主后端 space 相同。
+"""
+
+import asyncio
+import hashlib
+import math
+import re
+from abc import ABC, abstractmethod
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.services.model_registry import model_registry
+
+try:
+    import onnxruntime
+    from tokenizers import Tokenizer
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+
+class EmbeddingProvider(ABC):
+    """嵌入后端接口：输入 N 条文本，返回 (N, d) 的 float32 矩阵"""
+
+    name: str = "base"
+
+    @property
+    @abstractmethod
+    def space(self) -> str:
+        """向量空间标识；只有同一空间的向量可以互相比较"""
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """批量文档向量"""
+
+    async def embed_partial(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量文档向量，允许部分失败：返回 ((N, d) 矩阵, (N,) 失败掩码)，失败行为 NaN。
+        本地后端要么全成要么全败，默认实现即可。
+        """
+        try:
+            vectors = await self.embed(texts)
+        except Exception as e:
+            logger.warning(f"Embedding provider {self.name} failed for {len(texts)} texts: {e}")
+            return np.full((len(texts), self.dimension or 0), np.nan, dtype=np.float32), np.ones(len(texts), dtype=bool)
+        return vectors, np.zeros(len(texts), dtype=bool)
+
+    @property
+    def model(self) -> str:
+        """写入 DocumentChunk.embedding_model 的模型名"""
+        return self.space
+
+    @property
+    def dimension(self) -> Optional[int]:
+        """已知的向量维度；未知时为 None"""
+        return None
+
+    async def embed_query(self, query: str) -> np.ndarray:
+        """单条查询向量（一维）"""
+        return (await self.embed([query]))[0]
+
+    async def aclose(self) -> None:
+        """释放当前事件循环上的资源"""
+
+    def stats(self) -> Dict[str, object]:
+        return {"provider": self.name, "space": self.space, "dimension": self.dimension}
+
+
+class BailianEmbeddingProvider(EmbeddingProvider):
+    """百炼远程嵌入"""
+
+    name = "bailian"
+
+    def __init__(self, client=None, model: Optional[str] = None):
+        if client is None:
+            from app.services.bailian_client import bailian_client as client
+        self.client = client
+        self._model = model or client.embedding_model
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    @property
+    def space(self) -> str:
+        return f"bailian:{self._model}"
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return model_registry.dimension(self._model)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        # 经进程级任务队列统一调度（bulk 优先级）
+        return await self.client.embedding_queue.embed(texts, self._model)
+
+    async def embed_partial(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        return await self.client.embedding_queue.embed_partial(texts, self._model)
+
+    async def embed_query(self, query: str) -> np.ndarray:
+        return await self.client.embed_query(query)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+# 拉丁字母/数字按词切，CJK 按字切后再组二元组
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_CJK_RE = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+
+
+def _features(text: str) -> Counter:
+    text = (text or "").lower()
+    feats: Counter = Counter(_WORD_RE.findall(text))
+    for run in _CJK_RE.findall(text):
+        feats.update(run)
+        feats.update(run[i:i + 2] for i in range(len(run) - 1))
+    return feats
+
+
+@lru_cache(maxsize=200000)
+def _hash_feature(feature: str, dim: int):
+    h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return h % dim, 1.0 if (h >> 63) & 1 else -1.0
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    特征哈希向量（signed hashing trick）
+    - 词/字/二元组哈希到固定维度，词频取 1+log(tf)，结果 L2 归一化
+    - 纯 CPU、确定性，同一文本在任何机器上得到同一向量
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 1536):
+        self.dim = max(8, dim)
+
+    @property
+    def space(self) -> str:
+        return f"hashing:{self.dim}"
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self.dim
+
+    def _embed_sync(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, tf in _features(text).items():
+                idx, sign = _hash_feature(feature, self.dim)
+                out[row, idx] += sign * (1.0 + math.log(tf))
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        if len(texts) <= 32:
+            return self._embed_sync(texts)
+        # 大批量放到线程池，避免阻塞事件循环
+        return await asyncio.get_running_loop().run_in_executor(None, self._embed_sync, texts)
+
+
+class OnnxEmbeddingProvider(EmbeddingProvider):
+    """
+    本地 ONNX 句向量模型（如 bge / m3e 的 ONNX 导出）
+    - 输出为 last_hidden_state 时按 attention_mask 做均值池化；已是句向量时直接使用
+    - 结果 L2 归一化；推理放在线程池中执行
+    """
+
+    name = "onnx"
+
+    def __init__(
+        self,
+        model_path: str,
+        tokenizer_path: str,
+        max_length: int = 512,
+        batch_size: int = 32,
+        space: str = ""
+    ):
+        if not ONNX_AVAILABLE:
+            raise RuntimeError("onnxruntime/tokenizers not installed, cannot use onnx embedding provider")
+        if not model_path or not tokenizer_path:
+            raise ValueError("EMBEDDING_ONNX_MODEL_PATH and EMBEDDING_ONNX_TOKENIZER_PATH are required")
+        self.model_path = model_path
+        self.tokenizer_path = tokenizer_path
+        self.max_length = max_length
+        self.batch_size = max(1, batch_size)
+        self._space = space or f"onnx:{Path(model_path).stem}"
+        self._session = None
+        self._tokenizer = None
+
+    @property
+    def space(self) -> str:
+        return self._space
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return model_registry.dimension(self._space)
+
+    def _load(self) -> None:
+        if self._session is not None:
+            return
+        self._tokenizer = Tokenizer.from_file(self.tokenizer_path)
+        self._tokenizer.enable_truncation(max_length=self.max_length)
+        self._tokenizer.enable_padding()
+        self._session = onnxruntime.InferenceSession(
+            self.model_path, providers=["CPUExecutionProvider"]
+        )
+        logger.info(f"Loaded ONNX embedding model {self.model_path}")
+
+    def _embed_sync(self, texts: List[str]) -> np.ndarray:
+        self._load()
+        input_names = {i.name for i in self._session.get_inputs()}
+        parts = []
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self._tokenizer.encode_batch(texts[start:start + self.batch_size])
+            ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in input_names:
+                feeds["token_type_ids"] = np.zeros_like(ids)
+            output = self._session.run(None, {k: v for k, v in feeds.items() if k in input_names})[0]
+            if output.ndim == 3:
+                weights = mask[:, :, None].astype(np.float32)
+                output = (output * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+            parts.append(output.astype(np.float32, copy=False))
+        out = np.vstack(parts)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        out = await asyncio.get_running_loop().run_in_executor(None, self._embed_sync, texts)
+        if out.size:
+            model_registry.record_dimension(self._space, int(out.shape[1]))
+        return out
+
+
+class FallbackEmbeddingProvider(EmbeddingProvider):
+    """
+    主后端超时或出错时改用兜底后端（两者必须在同一向量空间）
+    - timeout 只约束在线查询（embed_query）；批量嵌入经过队列与限流，耗时以秒计，
+      用单独的 bulk_timeout（None 表示不设超时，只在出错时兜底），避免整批入库被切到兜底模型
+    """
+
+    def __init__(
+        self,
+        primary: EmbeddingProvider,
+        fallback: EmbeddingProvider,
+        timeout: float,
+        bulk_timeout: Optional[float] = None
+    ):
+        if primary.space != fallback.space:
+            raise ValueError(
+                f"fallback embedding provider must share the vector space: "
+                f"{primary.space} != {fallback.space}"
+            )
+        self.primary = primary
+        self.fallback = fallback
+        self.timeout = timeout
+        self.bulk_timeout = bulk_timeout
+        self.name = f"{primary.name}+{fallback.name}"
+        self.fallbacks = 0
+
+    @property
+    def space(self) -> str:
+        return self.primary.space
+
+    @property
+    def model(self) -> str:
+        return self.primary.model
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self.primary.dimension
+
+    async def _call(self, method: str, arg, timeout: Optional[float]):
+        try:
+            return await asyncio.wait_for(getattr(self.primary, method)(arg), timeout)
+        except Exception as e:
+            self.fallbacks += 1
+            logger.warning(f"Primary embedding provider {self.primary.name} failed ({e!r}), using {self.fallback.name}")
+            return await getattr(self.fallback, method)(arg)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        return await self._call("embed", texts, self.bulk_timeout)
+
+    async def embed_partial(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        vectors, failed = await self._call("embed_partial", texts, self.bulk_timeout)
+        if failed.any():
+            # 主后端失败的条目交给兜底后端补齐
+            retry_idx = np.flatnonzero(failed)
+            more, more_failed = await self.fallback.embed_partial([texts[i] for i in retry_idx])
+            if more.size and failed.all():
+                # 主后端一条都没成功时矩阵宽度未知，按兜底结果的维度重建
+                vectors = np.full((len(texts), more.shape[1]), np.nan, dtype=np.float32)
+            if more.size and vectors.shape[1] == more.shape[1]:
+                self.fallbacks += 1
+                vectors[retry_idx] = more
+                failed[retry_idx] = more_failed
+        return vectors, failed
+
+    async def embed_query(self, query: str) -> np.ndarray:
+        return await self._call("embed_query", query, self.timeout)
+
+    async def aclose(self) -> None:
+        await self.primary.aclose()
+        await self.fallback.aclose()
+
+    def stats(self) -> Dict[str, object]:
+        return {**super().stats(), "fallbacks": self.fallbacks}
+
+
+def build_embedding_provider(name: str) -> EmbeddingProvider:
+    name = (name or "bailian").strip().lower()
+    if name == "bailian":
+        return BailianEmbeddingProvider()
+    if name == "hashing":
+        return HashingEmbeddingProvider(dim=settings.EMBEDDING_HASHING_DIM)
+    if name == "onnx":
+        return OnnxEmbeddingProvider(
+            model_path=settings.EMBEDDING_ONNX_MODEL_PATH,
+            tokenizer_path=settings.EMBEDDING_ONNX_TOKENIZER_PATH,
+            max_length=settings.EMBEDDING_ONNX_MAX_LENGTH,
+            batch_size=settings.EMBEDDING_ONNX_BATCH_SIZE,
+            space=settings.EMBEDDING_ONNX_SPACE
+        )
+    raise ValueError(f"Unknown embedding provider: {name}")
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """按配置构建后端；兜底后端构建失败或空间不一致时只告警，不影响主后端"""
+    provider = build_embedding_provider(settings.EMBEDDING_PROVIDER)
+    if settings.EMBEDDING_FALLBACK_PROVIDER:
+        try:
+            provider = FallbackEmbeddingProvider(
+                provider,
+                build_embedding_provider(settings.EMBEDDING_FALLBACK_PROVIDER),
+                timeout=settings.EMBEDDING_FALLBACK_TIMEOUT,
+                bulk_timeout=settings.EMBEDDING_FALLBACK_BULK_TIMEOUT or None
+            )
+        except Exception as e:
+            logger.warning(f"Embedding fallback provider disabled: {e}")
+    logger.info(f"Using embedding provider {provider.name} ({provider.space})")
+    return provider
+
+
+# 创建全局实例
+embedding_provider = get_embedding_provider()
@@ -0,0 +1,307 @@
+"""
+进程级嵌入任务队列
+
+所有嵌入请求（入库与在线查询）都提交到这里，由专用线程上的事件循环统一调度：
+- 按优先级出队：interactive 永远先于 bulk；同一批只含同一模型、同一优先级
+- 另有 interactive_workers 个只取 interactive 的调度协程，bulk 批次占满通用调度协程时查询也不用等
+- 每条文本对应一个 concurrent.futures.Future，任何事件循环/线程都可以等待结果
+- 批内失败的条目按指数退避重新入队，超过最大次数才以 EmbeddingFailedError 失败，不再补零向量
+- 熔断（CircuitOpenError）不重试，直接交给调用方
+限流、并发池、自适应批大小仍由 embed_fn（BailianClient.create_embeddings_partial）负责，
+这里只决定“谁先发、一次发多少”，总吞吐因此只在一个地方受控。
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.services.resilience import BULK, INTERACTIVE, CircuitOpenError
+
+# embed_fn(texts, model, priority) -> ((N, d) 向量, (N,) 失败掩码)
+EmbedPartialFn = Callable[[List[str], str, str], Awaitable[Tuple[np.ndarray, np.ndarray]]]
+
+_PRIORITY_RANK = {INTERACTIVE: 0, BULK: 1}
+
+
+class EmbeddingFailedError(RuntimeError):
+    """重试次数用尽后仍未拿到向量"""
+
+
+@dataclass(order=True)
+class _Job:
+    rank: int
+    seq: int
+    text: str = field(compare=False)
+    model: str = field(compare=False)
+    priority: str = field(compare=False)
+    future: Future = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+class EmbeddingJobQueue:
+    """专用线程 + 事件循环上的优先级嵌入队列"""
+
+    def __init__(
+        self,
+        embed_fn: EmbedPartialFn,
+        default_model: str,
+        workers: int = 2,
+        interactive_workers: int = 1,
+        max_batch: int = 256,
+        max_attempts: int = 4,
+        retry_delay: float = 1.0,
+        on_stop: Optional[Callable[[], Awaitable[None]]] = None
+    ):
+        self.embed_fn = embed_fn
+        self.default_model = default_model
+        self.workers = max(1, workers)
+        self.interactive_workers = max(0, interactive_workers)
+        self.max_batch = max(1, max_batch)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self.on_stop = on_stop
+
+        self._heap: List[_Job] = []
+        # 退避等待重新入队的条目：既不在堆里也不在处理中，停止时要单独结束
+        self._delayed: Dict[int, Tuple[asyncio.TimerHandle, _Job]] = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._ready = threading.Event()
+        self._stopping = False
+
+        self.submitted = 0
+        self.completed = 0
+        self.requeued = 0
+        self.failed = 0
+        self.batches = 0
+        self.dispatched = 0
+
+    # ----------------- 生命周期 -----------------
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run, name="embedding-queue", daemon=True)
+            self._thread.start()
+        self._ready.wait()
+
+    def _run(self) -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._main())
+        finally:
+            loop.close()
+
+    async def _main(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._ready.set()
+        logger.info(
+            f"Embedding queue started with {self.workers} dispatchers "
+            f"(+{self.interactive_workers} interactive-only)"
+        )
+        dispatchers = [self._dispatcher() for _ in range(self.workers)]
+        dispatchers += [self._dispatcher(interactive_only=True) for _ in range(self.interactive_workers)]
+        try:
+            await asyncio.gather(*dispatchers)
+        finally:
+            self._fail_delayed()
+            if self.on_stop is not None:
+                await self.on_stop()
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """停止调度线程；队列里尚未处理的条目以异常结束"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._stopping = True
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        thread.join(timeout)
+        # 正常情况下调度循环退出时已处理；join 超时时这里兜底
+        self._fail_delayed()
+        with self._lock:
+            leftover, self._heap = self._heap, []
+        for job in leftover:
+            if not job.future.done():
+                job.future.set_exception(EmbeddingFailedError("embedding queue stopped"))
+
+    def _fail_delayed(self) -> None:
+        """取消退避中的重新入队定时器，对应条目以异常结束，避免调用方永远等待"""
+        with self._lock:
+            delayed, self._delayed = list(self._delayed.values()), {}
+        for handle, job in delayed:
+            handle.cancel()
+            if not job.future.done():
+                job.future.set_exception(EmbeddingFailedError("embedding queue stopped"))
+
+    # ----------------- 提交 -----------------
+
+    def submit(self, texts: List[str], model: Optional[str] = None, priority: str = BULK) -> List[Future]:
+        """提交一组文本，返回与之等长的 Future 列表（结果为一维 float32 向量）"""
+        self._ensure_started()
+        model_name = model or self.default_model
+        rank = _PRIORITY_RANK.get(priority, _PRIORITY_RANK[BULK])
+        futures: List[Future] = []
+        with self._lock:
+            for text in texts:
+                future: Future = Future()
+                heapq.heappush(self._heap, _Job(rank, next(self._seq), text, model_name, priority, future))
+                futures.append(future)
+            self.submitted += len(texts)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return futures
+
+    async def embed(self, texts: List[str], model: Optional[str] = None, priority: str = BULK) -> np.ndarray:
+        """在调用方自己的事件循环里等待整组结果，返回 (N, d) 矩阵"""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        futures = self.submit(texts, model, priority)
+        vectors = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        return np.stack(vectors)
+
+    async def embed_partial(
+        self,
+        texts: List[str],
+        model: Optional[str] = None,
+        priority: str = BULK
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        同 embed，但单条失败不影响整组：返回 ((N, d) 矩阵, (N,) 失败掩码)，失败行为 NaN。
+        入库用它把失败条目标记为待补齐，而不是让整个文件失败或写入零向量。
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32), np.zeros(0, dtype=bool)
+        futures = self.submit(texts, model, priority)
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures), return_exceptions=True)
+        failed = np.array([isinstance(r, BaseException) for r in results], dtype=bool)
+        dim = next((r.shape[0] for r in results if not isinstance(r, BaseException)), 0)
+        out = np.full((len(texts), dim), np.nan, dtype=np.float32)
+        for i, r in enumerate(results):
+            if not failed[i]:
+                out[i] = r
+        if failed.any():
+            error = next(r for r in results if isinstance(r, BaseException))
+            logger.warning(f"{int(failed.sum())}/{len(texts)} embeddings failed ({type(error).__name__}: {error})")
+        return out, failed
+
+    # ----------------- 调度 -----------------
+
+    def _push(self, job: _Job) -> None:
+        with self._lock:
+            heapq.heappush(self._heap, job)
+        self._wakeup.set()
+
+    def _has_jobs(self, interactive_only: bool = False) -> bool:
+        with self._lock:
+            if interactive_only:
+                # 堆按优先级排序，堆顶不是 interactive 就说明没有 interactive 条目
+                return bool(self._heap) and self._heap[0].priority == INTERACTIVE
+            return bool(self._heap)
+
+    def _take_batch(self, interactive_only: bool = False) -> List[_Job]:
+        """
+        取出优先级最高的一批：同模型、同优先级，最多 max_batch 条；已取消的条目丢弃。
+        interactive_only 时只取 interactive 条目，没有则返回空批
+        """
+        batch: List[_Job] = []
+        skipped: List[_Job] = []
+        with self._lock:
+            if interactive_only and not (self._heap and self._heap[0].priority == INTERACTIVE):
+                return batch
+            while self._heap and len(batch) < self.max_batch:
+                job = heapq.heappop(self._heap)
+                if batch and (job.model, job.priority) != (batch[0].model, batch[0].priority):
+                    skipped.append(job)
+                    if job.rank > batch[0].rank or len(skipped) >= self.max_batch:
+                        break
+                    continue
+                if job.attempts == 0 and not job.future.set_running_or_notify_cancel():
+                    continue
+                batch.append(job)
+            for job in skipped:
+                heapq.heappush(self._heap, job)
+        return batch
+
+    async def _dispatcher(self, interactive_only: bool = False) -> None:
+        while not self._stopping:
+            batch = self._take_batch(interactive_only)
+            if not batch:
+                self._wakeup.clear()
+                if not self._has_jobs(interactive_only):
+                    await self._wakeup.wait()
+                continue
+
+            self.batches += 1
+            self.dispatched += len(batch)
+            model, priority = batch[0].model, batch[0].priority
+            try:
+                vectors, failed = await self.embed_fn([job.text for job in batch], model, priority)
+            except CircuitOpenError as e:
+                for job in batch:
+                    self._fail(job, e)
+                continue
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(batch)} ({model}, {priority}) failed: {e}")
+                for job in batch:
+                    self._retry_or_fail(job, e)
+                continue
+
+            for job, vec, bad in zip(batch, vectors, failed):
+                if bad:
+                    self._retry_or_fail(job, EmbeddingFailedError(f"embedding failed after {job.attempts + 1} attempts"))
+                else:
+                    self.completed += 1
+                    job.future.set_result(vec)
+
+    def _fail(self, job: _Job, error: BaseException) -> None:
+        self.failed += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def _retry_or_fail(self, job: _Job, error: BaseException) -> None:
+        job.attempts += 1
+        if job.attempts >= self.max_attempts or self._stopping:
+            self._fail(job, error)
+            return
+        self.requeued += 1
+        # 退避后重新入队（保持原序号，不会被后来者插队）
+        handle = self._loop.call_later(self.retry_delay * 2 ** (job.attempts - 1), self._resume, job)
+        with self._lock:
+            self._delayed[id(job)] = (handle, job)
+
+    def _resume(self, job: _Job) -> None:
+        with self._lock:
+            if self._delayed.pop(id(job), None) is None:
+                return
+        self._push(job)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            queued = {INTERACTIVE: 0, BULK: 0}
+            for job in self._heap:
+                queued[job.priority] = queued.get(job.priority, 0) + 1
+        return {
+            "queued": queued,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "requeued": self.requeued,
+            "failed": self.failed,
+            "batches": self.batches,
+            "avg_batch_size": round(self.dispatched / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,123 @@
+"""
+跨知识库联邦检索：并发查询多个集合，用 RRF 把各集合的最终排序合并成一个 top-k
+
+- 每个知识库单独设截止时间，超时/出错的知识库直接跳过，总延迟约等于最慢的那个（且不超过截止时间）
+- 各集合返回的是混合检索 / 重排 / MMR 之后的最终顺序，其分数（RRF 融合分、重排分）不可跨集合比较，
+  因此按名次融合：每个集合的排序一路，再加一路“所有结果按向量相似度排序”（权重 FEDERATED_SIMILARITY_WEIGHT），
+  向量相似度 1/(1+d) 在同一嵌入空间内跨集合可比，没有相关内容的知识库不会因名次靠前而压过其他集合
+- 相似度那一路按集合内顺序取后缀最大值：排在前面的结果至少与排在它后面的同样相关，
+  只有 BM25 命中、没有向量分的结果因此沿用后面结果的相似度，不会被丢到最后；重排 / MMR 的顺序也不会被打乱
+- 合并时每个集合内部保持原顺序：每次从各集合队首中取融合分最高的一条
+- 同一问题在多个集合上的查询向量会被 query_coalescer 合并成一次嵌入
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.lexical_index import reciprocal_rank_fusion
+from app.services.resilience import CircuitOpenError
+
+
+def similarity(hit: Dict) -> Optional[float]:
+    """跨集合可比的相关度：混合检索结果取 vector_score，纯向量检索结果的 score 即向量相似度"""
+    if "vector_score" in hit:
+        return hit["vector_score"]
+    return hit.get("score")
+
+
+def merge_rankings(
+    rankings: List[List[Dict]],
+    n_results: int,
+    rrf_k: int = 60,
+    similarity_weight: float = 2.0
+) -> List[Dict]:
+    """
+    rankings: 每个知识库按最终顺序排好的结果列表。
+    返回合并后的前 n_results 条，score 为融合分，集合内原始分保存在 raw_score
+    """
+    keys = [[f"{i}:{j}" for j in range(len(hits))] for i, hits in enumerate(rankings)]
+    by_similarity = []
+    for hits, kb_keys in zip(rankings, keys):
+        floors: List[Optional[float]] = [None] * len(hits)
+        floor = None
+        for j in range(len(hits) - 1, -1, -1):
+            sim = similarity(hits[j])
+            if sim is not None:
+                floor = sim if floor is None else max(floor, sim)
+            floors[j] = floor
+        by_similarity.extend((f, key) for f, key in zip(floors, kb_keys) if f is not None)
+    # 稳定排序：相似度相同时保持集合及集合内的先后
+    by_similarity.sort(key=lambda item: item[0], reverse=True)
+    fused = dict(reciprocal_rank_fusion(
+        [(kb_keys, 1.0) for kb_keys in keys] + [([key for _, key in by_similarity], similarity_weight)],
+        k=rrf_k
+    ))
+
+    merged: List[Dict] = []
+    heads = [0] * len(rankings)
+    while len(merged) < n_results:
+        best = None
+        for i, hits in enumerate(rankings):
+            if heads[i] < len(hits) and (best is None or fused[keys[i][heads[i]]] > fused[keys[best][heads[best]]]):
+                best = i
+        if best is None:
+            break
+        hit = rankings[best][heads[best]]
+        merged.append(dict(hit, raw_score=hit.get("score"), score=round(fused[keys[best][heads[best]]], 6)))
+        heads[best] += 1
+    return merged
+
+
+async def search_knowledge_bases(
+    manager,
+    targets: List[Dict[str, Any]],
+    query: str,
+    n_results: int = 5,
+    filters: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None
+) -> List[Dict]:
+    """
+    targets: [{"knowledge_base_id", "collection_name", "retrieval_config"}, ...]
+    返回合并后的 top-k，每条结果带 knowledge_base_id；score 为跨集合 RRF 融合分，集合内原始分保存在 raw_score
+    """
+    timeout = settings.FEDERATED_SEARCH_TIMEOUT if timeout is None else timeout
+
+    async def one(target: Dict[str, Any]) -> List[Dict]:
+        hits = await asyncio.wait_for(
+            manager.search_knowledge_base(
+                collection_name=target["collection_name"],
+                query=query,
+                n_results=n_results,
+                knowledge_base_id=target["knowledge_base_id"],
+                retrieval_config=target.get("retrieval_config"),
+                filters=filters
+            ),
+            timeout=timeout
+        )
+        return [dict(h, knowledge_base_id=target["knowledge_base_id"]) for h in hits]
+
+    results = await asyncio.gather(*(one(t) for t in targets), return_exceptions=True)
+
+    rankings: List[List[Dict]] = []
+    circuit_errors = []
+    for target, result in zip(targets, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, CircuitOpenError):
+                circuit_errors.append(result)
+            reason = "timed out" if isinstance(result, asyncio.TimeoutError) else f"failed: {result!r}"
+            logger.warning(f"Federated search on kb={target['knowledge_base_id']} {reason}, skipped")
+            continue
+        rankings.append(result)
+
+    # 所有知识库都因嵌入熔断失败时交给接口层返回 503
+    if circuit_errors and len(circuit_errors) == len(targets):
+        raise circuit_errors[0]
+
+    return merge_rankings(
+        rankings, n_results,
+        rrf_k=settings.HYBRID_RRF_K,
+        similarity_weight=settings.FEDERATED_SIMILARITY_WEIGHT
+    )
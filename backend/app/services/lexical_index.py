@@ -0,0 +1,242 @@
+"""
+进程内 BM25 倒排索引（按知识库集合划分），用于与向量检索做混合召回
+
+纯向量检索容易漏掉条款号、法规编号、型号代码这类精确词。这里对 DocumentChunk.content
+做 CJK 友好的切词（中文按单字 + 相邻二字，英文/数字按词），建 BM25 倒排索引：
+- 首次检索某个知识库时从 document_chunks 懒加载
+- 入库成功后增量追加（已加载的索引才追加，未加载的等首次检索时一并读库）
+- 与向量结果用 RRF（倒数排名融合）合并，权重取自 KnowledgeBase.retrieval_config["hybrid"]
+"""
+
+import asyncio
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+
+# 英文/数字词：允许内部的 . - _ / 连接（如 GB/T-19001、v2.1、ISO_9001）
+_ASCII_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._/\-][a-z0-9]+)*")
+# CJK 统一表意文字（含扩展 A）与日文假名
+_CJK_RUN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """CJK 友好切词：中文连续片段产出单字与相邻二字，英文数字按词小写；不依赖分词词典"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens: List[str] = []
+    for match in _ASCII_TOKEN_RE.finditer(text):
+        token = match.group()
+        tokens.append(token)
+        # 带连接符的编号同时索引各段，“19001”也能命中“gb/t-19001”
+        if not token.isalnum():
+            tokens.extend(p for p in re.split(r"[._/\-]", token) if p)
+    for match in _CJK_RUN_RE.finditer(text):
+        run = match.group()
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """单个集合的 BM25 倒排索引（线程安全：入库在后台线程里增量追加）"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._lengths: Dict[str, int] = {}
+        self._doc_terms: Dict[str, Tuple[str, ...]] = {}
+        self._docs: Dict[str, Dict] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, doc_id: str, text: str, payload: Optional[Dict] = None) -> None:
+        """添加或替换一篇文档；payload 原样随检索结果返回"""
+        counts = Counter(tokenize(text))
+        with self._lock:
+            self._remove_locked(doc_id)
+            for term, tf in counts.items():
+                self._postings[term][doc_id] = tf
+            self._doc_terms[doc_id] = tuple(counts)
+            length = sum(counts.values())
+            self._lengths[doc_id] = length
+            self._total_length += length
+            self._docs[doc_id] = payload or {}
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            self._remove_locked(doc_id)
+
+    def _remove_locked(self, doc_id: str) -> None:
+        length = self._lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        self._docs.pop(doc_id, None)
+        for term in self._doc_terms.pop(doc_id, ()):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self._postings[term]
+
+    def payload(self, doc_id: str) -> Optional[Dict]:
+        return self._docs.get(doc_id)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """返回按 BM25 得分降序的 [(doc_id, score)]"""
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._lengths)
+            if not n or not terms:
+                return []
+            avg_len = self._total_length / n or 1.0
+            scores: Dict[str, float] = defaultdict(float)
+            for term in terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_len)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[Tuple[List[str], float]],
+    k: int = 60
+) -> List[Tuple[str, float]]:
+    """
+    RRF 融合：score(d) = Σ weight_i / (k + rank_i(d))，rank 从 1 开始
+    rankings: [(按相关度排好序的 id 列表, 权重), ...]
+    """
+    fused: Dict[str, float] = defaultdict(float)
+    for ids, weight in rankings:
+        if weight <= 0:
+            continue
+        for rank, doc_id in enumerate(ids, start=1):
+            fused[doc_id] += weight / (k + rank)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
+
+
+def hybrid_config(retrieval_config: Optional[Dict]) -> Dict:
+    """合并全局默认与知识库 retrieval_config["hybrid"] 中的覆盖项"""
+    config = {
+        "enabled": settings.HYBRID_SEARCH_ENABLED,
+        "vector_weight": settings.HYBRID_VECTOR_WEIGHT,
+        "bm25_weight": settings.HYBRID_BM25_WEIGHT,
+        "rrf_k": settings.HYBRID_RRF_K,
+        "candidates": settings.HYBRID_CANDIDATES,
+    }
+    overrides = (retrieval_config or {}).get("hybrid")
+    if isinstance(overrides, dict):
+        config.update({k: v for k, v in overrides.items() if k in config})
+    elif isinstance(overrides, bool):
+        config["enabled"] = overrides
+    return config
+
+
+class LexicalIndexManager:
+    """按集合名管理 BM25 索引"""
+
+    def __init__(self):
+        self._indexes: Dict[str, BM25Index] = {}
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+        # 正在从库里构建的索引：构建期间入库的块也追加进去，避免落在读库快照之外而丢失
+        self._loading: Dict[str, BM25Index] = {}
+        self._lock = threading.Lock()
+
+    def get(self, collection_name: str) -> Optional[BM25Index]:
+        return self._indexes.get(collection_name)
+
+    async def ensure_loaded(self, collection_name: str, knowledge_base_id: int) -> BM25Index:
+        """首次使用时从 document_chunks 构建该知识库的索引"""
+        index = self._indexes.get(collection_name)
+        if index is not None:
+            return index
+        lock = self._load_locks.setdefault(collection_name, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(collection_name)
+            if index is not None:
+                return index
+
+            # 延迟导入：避免 services 层在导入时就依赖数据库驱动
+            from sqlalchemy import select
+            from app.db.database import AsyncSessionLocal
+            from app.models.document_chunk import DocumentChunk
+
+            index = BM25Index()
+            self._loading[collection_name] = index
+            try:
+                async with AsyncSessionLocal() as session:
+                    rows = await session.stream(
+                        select(
+                            DocumentChunk.id, DocumentChunk.vector_id, DocumentChunk.file_id,
+                            DocumentChunk.content, DocumentChunk.chunk_metadata, DocumentChunk.created_at
+                        ).where(DocumentChunk.knowledge_base_id == knowledge_base_id)
+                    )
+                    async for chunk_id, vector_id, file_id, content, meta, created_at in rows:
+                        if vector_id:
+                            index.add(vector_id, content, self._payload(
+                                chunk_id, vector_id, file_id, content, meta,
+                                created_at.timestamp() if created_at else None
+                            ))
+                with self._lock:
+                    self._indexes[collection_name] = index
+            finally:
+                self._loading.pop(collection_name, None)
+            logger.info(f"Built BM25 index for {collection_name}: {len(index)} chunks")
+            return index
+
+    @staticmethod
+    def _payload(chunk_id, vector_id, file_id, content, meta, created_ts=None) -> Dict:
+        return {
+            "chunk_id": chunk_id,
+            "vector_id": vector_id,
+            "file_id": file_id,
+            "content": content,
+            "metadata": dict(meta or {}),
+            "created_ts": created_ts,
+        }
+
+    def add_chunks(self, collection_name: str, chunks: Iterable[Dict]) -> None:
+        """
+        入库成功后增量追加；chunks 元素需含 id / vector_id / file_id / content / metadata。
+        索引尚未加载时跳过，首次检索时会从库里一并读到
+        """
+        index = self._indexes.get(collection_name) or self._loading.get(collection_name)
+        if index is None:
+            return
+        added = 0
+        for ch in chunks:
+            if not ch.get("vector_id"):
+                continue
+            index.add(ch["vector_id"], ch.get("content") or "", self._payload(
+                ch.get("id"), ch["vector_id"], ch.get("file_id"), ch.get("content"), ch.get("metadata"),
+                time.time()
+            ))
+            added += 1
+        logger.debug(f"BM25 index {collection_name}: +{added} chunks")
+
+    def drop(self, collection_name: str) -> None:
+        with self._lock:
+            self._indexes.pop(collection_name, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {name: len(index) for name, index in list(self._indexes.items())}
+
+
+# 创建全局实例
+lexical_index_manager = LexicalIndexManager()
@@ -0,0 +1,65 @@
+"""
+MMR（最大边际相关）多样化重排
+
+分块有重叠、短块又会与相邻块合并，top-k 里常出现同一节的近似重复段落，白白占用上下文。
+MMR 先多取 k * fetch_factor 个候选，再贪心地挑出 k 个：
+    score(d) = λ * sim(q, d) - (1 - λ) * max_{s ∈ 已选} sim(d, s)
+λ 越大越偏相关性，越小越偏多样性。相似度均为余弦，整个候选集的两两相似度一次矩阵乘算出。
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+
+def mmr_config(retrieval_config: Optional[Dict]) -> Dict:
+    """合并全局默认与知识库 retrieval_config["mmr"] 中的覆盖项"""
+    config = {
+        "enabled": settings.MMR_ENABLED,
+        "lambda": settings.MMR_LAMBDA,
+        "fetch_factor": settings.MMR_FETCH_FACTOR,
+    }
+    overrides = (retrieval_config or {}).get("mmr")
+    if isinstance(overrides, dict):
+        config.update({k: v for k, v in overrides.items() if k in config})
+    elif isinstance(overrides, bool):
+        config["enabled"] = overrides
+    return config
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def mmr_select(
+    query_embedding: np.ndarray,
+    doc_embeddings: np.ndarray,
+    k: int,
+    lambda_mult: float = 0.7
+) -> List[int]:
+    """返回按 MMR 依次选中的候选下标（最多 k 个）"""
+    n = len(doc_embeddings)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    docs = _normalize(np.asarray(doc_embeddings, dtype=np.float32))
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+    relevance = docs @ query
+    pairwise = docs @ docs.T
+
+    selected: List[int] = []
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(k):
+        # 首轮没有已选项，只看相关性
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * penalty
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return selected
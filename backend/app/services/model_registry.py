@@ -0,0 +1,113 @@
+"""
+嵌入模型元数据登记（维度 / 单条 token 上限 / 单次请求条数上限）
+
+- 已知模型带一份默认值；维度以第一次真实响应为准，发现后写入 JSON 持久化，
+  之后 get_embedding_dimensions、零向量兜底、DocumentChunk.embedding_dimensions 都直接复用
+- 单条 token 上限与批上限供分段与自适应批大小使用，可在 JSON 里按实际配额手工调整
+"""
+
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+
+
+@dataclass
+class ModelInfo:
+    name: str
+    dimension: Optional[int] = None
+    max_input_tokens: int = 8192
+    max_batch: int = 64
+    discovered_at: Optional[str] = None
+
+
+# 百炼（DashScope）常用嵌入模型的默认值；dimension 只作兜底，以实测为准
+_KNOWN_MODELS: Dict[str, Dict] = {
+    "text-embedding-v1": {"dimension": 1536, "max_input_tokens": 2048, "max_batch": 25},
+    "text-embedding-v2": {"dimension": 1536, "max_input_tokens": 2048, "max_batch": 25},
+    "text-embedding-v3": {"dimension": 1024, "max_input_tokens": 8192, "max_batch": 10},
+    "text-embedding-v4": {"dimension": 1024, "max_input_tokens": 8192, "max_batch": 10},
+}
+
+
+class ModelRegistry:
+    """模型元数据登记表（线程安全，JSON 持久化）"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._models: Dict[str, ModelInfo] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            for name, info in raw.items():
+                known = {k: v for k, v in info.items() if k in ModelInfo.__dataclass_fields__}
+                self._models[name] = ModelInfo(**{**known, "name": name})
+            logger.info(f"Loaded {len(self._models)} embedding models from {self.path}")
+        except Exception as e:
+            logger.warning(f"Model registry {self.path} unreadable, starting empty: {e}")
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({name: asdict(info) for name, info in self._models.items()}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning(f"Model registry save failed: {e}")
+
+    def get(self, model: str) -> ModelInfo:
+        with self._lock:
+            info = self._models.get(model)
+            if info is None:
+                info = ModelInfo(name=model, **_KNOWN_MODELS.get(model, {}))
+                self._models[model] = info
+            return info
+
+    def dimension(self, model: str) -> Optional[int]:
+        """已确认（实测过）的维度；未确认时返回 None"""
+        info = self.get(model)
+        return info.dimension if info.discovered_at else None
+
+    def expected_dimension(self, model: str, default: int) -> int:
+        """实测维度，否则已知默认值，再否则 default（用于零向量兜底）"""
+        return self.get(model).dimension or default
+
+    def max_input_tokens(self, model: str, default: int) -> int:
+        return min(default, self.get(model).max_input_tokens)
+
+    def record_dimension(self, model: str, dimension: int) -> None:
+        """记录实测维度；只在首次发现或发生变化时落盘"""
+        info = self.get(model)
+        if info.discovered_at and info.dimension == dimension:
+            return
+        with self._lock:
+            if info.dimension and info.discovered_at and info.dimension != dimension:
+                logger.warning(f"Embedding dimension of {model} changed: {info.dimension} -> {dimension}")
+            info.dimension = dimension
+            info.discovered_at = datetime.now().isoformat()
+            self._save()
+        logger.info(f"Registered embedding model {model}: dimension={dimension}")
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: asdict(info) for name, info in self._models.items()}
+
+
+# 创建全局实例
+model_registry = ModelRegistry(settings.MODEL_REGISTRY_PATH or None)
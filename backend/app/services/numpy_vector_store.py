@@ -0,0 +1,625 @@
+"""
+进程内 NumPy 向量库：不依赖 Chroma 服务，适合小规模部署与 CI
+
+每个集合一个目录：
+- vectors.f32      连续 float32 矩阵（memmap，按容量倍增扩展），第 i 行对应第 i 条记录
+- rows.jsonl       追加写的操作日志：{"op": "add", row, id, document, metadata} / {"op": "del", id}
+- collection.json  集合名、维度与集合 metadata
+删除与覆盖写只打墓碑（del 记录），重启时重放日志恢复；向量先落盘再写日志，
+崩溃时多出来的向量行会被忽略。add 记录带行号，重放时按行号对齐向量；崩溃留下的半截尾行在重新追加前截掉，
+不会和下一条记录粘在一起。
+
+检索为精确暴力搜索（矩阵乘 + argpartition 取 top-k），距离与 Chroma 默认一致（平方 L2）。
+检索过滤用到的元数据字段（见 search_filters）另存一份列式数组，where 直接算成 NumPy 掩码，不逐行求值。
+配置 NUMPY_VECTOR_STORE_IVF_NLIST > 0 时，行数足够后训练 IVF 粗量化器，只扫描最近的
+nprobe 个簇。集合对象的接口与 chromadb 的 Collection 保持一致（add / upsert / delete / query / get / count），
+因此 NumpyVectorStore 直接复用 ChromaVectorStore 的句柄缓存、线程池与入库流水线。
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.services.search_filters import matches_where
+from app.services.vector_quantization import (
+    ProductQuantizer,
+    ScalarInt8Quantizer,
+    build_quantizer,
+    estimate_recall,
+    pq_subspaces,
+    search_compressed,
+)
+from app.services.vector_store import ChromaVectorStore
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._\-]{0,254}$")
+
+# 建列的元数据字段：字符串字段按字典编码成 int32（缺失为 -1），数值字段存 float64（缺失为 NaN）
+_CATEGORICAL_FIELDS = ("file_id", "content_type", "section_title", "source_file")
+_NUMERIC_FIELDS = ("created_ts", "page_number")
+
+
+class _IVFIndex:
+    """IVF 粗量化器：k-means 质心 + 每行所属簇"""
+
+    def __init__(self, nlist: int, nprobe: int, iterations: int = 10, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = max(1, min(nprobe, nlist))
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_rows = 0
+
+    def _nearest(self, vectors: np.ndarray, k: int = 1) -> np.ndarray:
+        dists = (
+            np.einsum("ij,ij->i", vectors, vectors)[:, None]
+            - 2.0 * vectors @ self.centroids.T
+            + np.einsum("ij,ij->i", self.centroids, self.centroids)[None, :]
+        )
+        if k == 1:
+            return dists.argmin(axis=1).astype(np.int32)
+        k = min(k, dists.shape[1])
+        return np.argpartition(dists, k - 1, axis=1)[:, :k]
+
+    def train(self, vectors: np.ndarray) -> None:
+        rng = np.random.default_rng(self.seed)
+        n = len(vectors)
+        sample = vectors[rng.choice(n, size=min(n, self.nlist * 256), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=self.nlist, replace=False)].copy()
+        self.centroids = centroids
+        for _ in range(self.iterations):
+            assign = self._nearest(sample)
+            for c in range(self.nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        self.assignments = np.concatenate([
+            self._nearest(np.asarray(vectors[i:i + 8192])) for i in range(0, n, 8192)
+        ])
+        self.trained_rows = n
+
+    def append(self, vectors: np.ndarray) -> None:
+        self.assignments = np.concatenate([self.assignments, self._nearest(vectors)])
+
+    def candidates(self, query: np.ndarray) -> np.ndarray:
+        probes = self._nearest(query[None, :], self.nprobe).ravel()
+        return np.flatnonzero(np.isin(self.assignments, probes))
+
+
+class NumpyCollection:
+    """单个集合；接口与 chromadb Collection 一致的子集。方法线程安全"""
+
+    def __init__(self, name: str, path: Path, metadata: Optional[Dict] = None):
+        self.name = name
+        self.path = path
+        self.metadata = dict(metadata or {})
+        self.dim: Optional[int] = None
+        self._lock = threading.RLock()
+        self._vectors: Optional[np.memmap] = None
+        self._capacity = 0
+        self._count = 0
+        self._sqnorms = np.empty(0, dtype=np.float32)
+        self._live = bytearray()  # 每行 1 字节存活标记，墓碑置 0
+        self._ids: List[str] = []
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Optional[Dict]] = []
+        self._row_of: Dict[str, int] = {}
+        self._columns: Dict[str, np.ndarray] = {
+            **{f: np.empty(0, dtype=np.int32) for f in _CATEGORICAL_FIELDS},
+            **{f: np.empty(0, dtype=np.float64) for f in _NUMERIC_FIELDS},
+        }
+        self._dictionaries: Dict[str, Dict[str, int]] = {f: {} for f in _CATEGORICAL_FIELDS}
+        self._log = None
+        self._ivf: Optional[_IVFIndex] = None
+        if settings.NUMPY_VECTOR_STORE_IVF_NLIST > 0:
+            self._ivf = _IVFIndex(settings.NUMPY_VECTOR_STORE_IVF_NLIST, settings.NUMPY_VECTOR_STORE_IVF_NPROBE)
+        # 可选压缩：常驻内存的只有压缩码，float32 原向量留在 memmap 里只供精排读取
+        self._quantizer = build_quantizer(
+            settings.NUMPY_VECTOR_STORE_COMPRESSION, settings.NUMPY_VECTOR_STORE_PQ_M
+        )
+        self._codes: Optional[np.ndarray] = None
+        self._quantized_rows = 0
+        self._compression_report: Dict[str, Any] = {}
+        self._load()
+
+    # ----------------- 持久化 -----------------
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.path / "vectors.f32"
+
+    def _save_manifest(self) -> None:
+        manifest = {"name": self.name, "dim": self.dim, "metadata": self.metadata}
+        tmp = self.path / "collection.json.tmp"
+        tmp.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path / "collection.json")
+
+    def _load(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.path / "collection.json"
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            self.dim = manifest.get("dim")
+            self.metadata = manifest.get("metadata") or self.metadata
+            if self.dim:
+                self._fit_quantizer()
+        else:
+            self._save_manifest()
+
+        rows_path = self.path / "rows.jsonl"
+        if self.dim and rows_path.exists():
+            stored_rows = os.path.getsize(self._vectors_path) // (4 * self.dim) if self._vectors_path.exists() else 0
+            self._truncate_partial_line(rows_path)
+            with open(rows_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Collection {self.name}: skipped corrupt record in rows.jsonl")
+                        continue
+                    if record.get("op") == "del":
+                        self._tombstone(record["id"])
+                    elif record.get("op") == "add":
+                        # 旧日志没有行号，按出现顺序
+                        row = record.get("row", self._count)
+                        if row < self._count or row >= stored_rows:
+                            continue
+                        while self._count < row:
+                            # 丢失记录对应的向量行：占位并标记为已删除
+                            self._append_row("", None, None)
+                            self._tombstone("")
+                        self._tombstone(record["id"])
+                        self._append_row(record["id"], record.get("document"), record.get("metadata"))
+            self._open_vectors(max(self._count, 1))
+            self._sqnorms = np.einsum("ij,ij->i", self._vectors[:self._count], self._vectors[:self._count])
+            self._index_metadata(self._metadatas)
+            self._update_ivf(None)
+            self._update_codes(None)
+        self._log = open(rows_path, "a", encoding="utf-8")
+
+    @staticmethod
+    def _truncate_partial_line(rows_path: Path) -> None:
+        """截掉崩溃时写了一半、没有换行结尾的尾行"""
+        with open(rows_path, "r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            pos = size
+            while pos > 0:
+                step = min(pos, 65536)
+                f.seek(pos - step)
+                chunk = f.read(step)
+                newline = chunk.rfind(b"\n")
+                if newline >= 0:
+                    pos = pos - step + newline + 1
+                    break
+                pos -= step
+            f.truncate(pos)
+        logger.warning(f"Truncated partial trailing record in {rows_path}")
+
+    def _open_vectors(self, capacity: int) -> None:
+        """按 capacity 行打开（必要时扩展）memmap 文件"""
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+        nbytes = capacity * self.dim * 4
+        with open(self._vectors_path, "ab"):
+            pass
+        if os.path.getsize(self._vectors_path) < nbytes:
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(nbytes)
+        self._capacity = max(capacity, os.path.getsize(self._vectors_path) // (4 * self.dim))
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dim))
+
+    def close(self) -> None:
+        """落盘并释放 memmap 与日志句柄；仍有映射时 Windows 上无法删除集合目录"""
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    # ----------------- 行管理 -----------------
+
+    def _append_row(self, doc_id: str, document: Optional[str], metadata: Optional[Dict]) -> int:
+        row = self._count
+        self._ids.append(doc_id)
+        self._documents.append(document)
+        self._metadatas.append(metadata)
+        self._row_of[doc_id] = row
+        self._live.append(1)
+        self._count += 1
+        return row
+
+    def _tombstone(self, doc_id: str) -> bool:
+        row = self._row_of.pop(doc_id, None)
+        if row is None:
+            return False
+        self._live[row] = 0
+        return True
+
+    def _index_metadata(self, metadatas: List[Optional[Dict]]) -> None:
+        """新增行的过滤字段追加到列式数组"""
+        for field in _CATEGORICAL_FIELDS:
+            dictionary = self._dictionaries[field]
+            codes = np.full(len(metadatas), -1, dtype=np.int32)
+            for i, metadata in enumerate(metadatas):
+                value = (metadata or {}).get(field)
+                if value is not None:
+                    codes[i] = dictionary.setdefault(str(value), len(dictionary))
+            self._columns[field] = np.concatenate([self._columns[field], codes])
+        for field in _NUMERIC_FIELDS:
+            values = np.full(len(metadatas), np.nan, dtype=np.float64)
+            for i, metadata in enumerate(metadatas):
+                value = (metadata or {}).get(field)
+                try:
+                    values[i] = float(value)
+                except (TypeError, ValueError):
+                    pass
+            self._columns[field] = np.concatenate([self._columns[field], values])
+
+    def _where_mask(self, where: Dict[str, Any], n: int) -> np.ndarray:
+        """把 where 子句算成前 n 行的布尔掩码，语义与 matches_where 一致；未建列的字段/操作符逐行求值"""
+        mask = np.ones(n, dtype=bool)
+        if "$and" in where:
+            for cond in where["$and"]:
+                mask &= self._where_mask(cond, n)
+            return mask
+        for field, cond in where.items():
+            column = self._columns.get(field)
+            for op, expected in cond.items():
+                if column is not None and field in self._dictionaries and op == "$in":
+                    dictionary = self._dictionaries[field]
+                    codes = [dictionary[v] for v in expected if v in dictionary]
+                    mask &= np.isin(column[:n], codes)
+                elif column is not None and field in _NUMERIC_FIELDS and op in ("$gte", "$lte"):
+                    # NaN 比较结果为 False：缺失该字段的行不命中
+                    mask &= column[:n] >= expected if op == "$gte" else column[:n] <= expected
+                else:
+                    single = {field: {op: expected}}
+                    mask &= np.fromiter(
+                        (matches_where(self._metadatas[r] or {}, single) for r in range(n)), dtype=bool, count=n
+                    )
+        return mask
+
+    def _write(self, ids, documents, metadatas, embeddings, replace: bool) -> None:
+        if not ids:
+            return
+        vectors = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError(f"embeddings shape {vectors.shape} does not match {len(ids)} ids")
+        documents = list(documents) if documents is not None else [None] * len(ids)
+        metadatas = list(metadatas) if metadatas is not None else [None] * len(ids)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._fit_quantizer()
+                self._save_manifest()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match collection dimensionality {self.dim}")
+            if not replace:
+                existing = [i for i in ids if i in self._row_of]
+                if existing:
+                    # 与 Chroma 一致：add 遇到已存在的 id 跳过
+                    logger.warning(f"Collection {self.name}: {len(existing)} ids already exist, skipped on add")
+                    keep = [j for j, i in enumerate(ids) if i not in self._row_of]
+                    ids = [ids[j] for j in keep]
+                    documents = [documents[j] for j in keep]
+                    metadatas = [metadatas[j] for j in keep]
+                    vectors = vectors[keep]
+                    if not ids:
+                        return
+
+            start = self._count
+            if self._vectors is None or start + len(ids) > self._capacity:
+                self._open_vectors(max(start + len(ids), self._capacity * 2, 1024))
+            # 先写向量再写日志：日志里出现的行一定有向量
+            self._vectors[start:start + len(ids)] = vectors
+            self._vectors.flush()
+            lines = []
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                self._tombstone(doc_id)
+                row = self._append_row(doc_id, document, metadata)
+                lines.append(json.dumps(
+                    {"op": "add", "row": row, "id": doc_id, "document": document, "metadata": metadata},
+                    ensure_ascii=False
+                ))
+            self._log.write("\n".join(lines) + "\n")
+            self._log.flush()
+            self._sqnorms = np.concatenate([self._sqnorms, np.einsum("ij,ij->i", vectors, vectors)])
+            self._index_metadata(metadatas)
+            self._update_ivf(vectors)
+            self._update_codes(vectors)
+
+    def _update_ivf(self, vectors: np.ndarray) -> None:
+        ivf = self._ivf
+        if ivf is None:
+            return
+        if ivf.centroids is None or self._count >= 2 * ivf.trained_rows:
+            # 行数足够（每簇约 39 行）才训练；规模翻倍后重训以跟上数据分布
+            if self._count >= ivf.nlist * 39:
+                ivf.train(self._vectors[:self._count])
+                logger.info(f"Collection {self.name}: IVF trained on {self._count} rows (nlist={ivf.nlist})")
+        else:
+            ivf.append(vectors)
+
+    def _fit_quantizer(self) -> None:
+        """维度确定后校正 PQ 子空间数：取能整除维度的最大 m，没有合适的（m 只能为 1）时改用 int8"""
+        quantizer = self._quantizer
+        if not isinstance(quantizer, ProductQuantizer) or self.dim % quantizer.m == 0:
+            return
+        m = pq_subspaces(self.dim, quantizer.m)
+        if m > 1:
+            logger.warning(
+                f"Collection {self.name}: PQ m={quantizer.m} does not divide dimension {self.dim}, using m={m}"
+            )
+            quantizer.m = m
+        else:
+            logger.warning(
+                f"Collection {self.name}: no valid PQ subspace count for dimension {self.dim}, using int8"
+            )
+            self._quantizer = ScalarInt8Quantizer()
+
+    def _update_codes(self, vectors: Optional[np.ndarray]) -> None:
+        """维护压缩码：行数达到阈值时训练，规模翻倍后重训；之间只编码新增行"""
+        quantizer = self._quantizer
+        if quantizer is None:
+            return
+        n = self._count
+        if self._codes is not None and n < 2 * self._quantized_rows and vectors is not None:
+            self._codes = np.concatenate([self._codes, quantizer.encode(vectors)])
+            return
+        if n < max(settings.NUMPY_VECTOR_STORE_COMPRESSION_MIN_ROWS, 256):
+            return
+        matrix = self._vectors[:n]
+        rng = np.random.default_rng(0)
+        sample = np.asarray(matrix[np.sort(rng.choice(n, size=min(n, 65536), replace=False))])
+        try:
+            quantizer.train(sample)
+            self._codes = quantizer.encode(matrix)
+        except Exception as e:
+            # 行已经落盘，压缩失败只退回未压缩检索，不能让写入/加载报错
+            logger.error(f"Collection {self.name}: {quantizer.name} compression disabled: {e}")
+            self._quantizer = None
+            self._codes = None
+            return
+        self._quantized_rows = n
+        rerank = settings.NUMPY_VECTOR_STORE_RERANK
+        self._compression_report = {
+            **estimate_recall(quantizer, matrix, k=10, rerank=rerank),
+            "rerank_factor": rerank,
+        }
+        logger.info(
+            f"Collection {self.name}: {quantizer.name} codes built for {n} rows "
+            f"({quantizer.bytes_per_vector(self.dim)} B/vector), {self._compression_report}"
+        )
+
+    def compression_stats(self) -> Dict[str, Any]:
+        """压缩方式、每向量内存与抽样召回，用于权衡内存与召回"""
+        with self._lock:
+            quantizer = self._quantizer
+            float_bytes = 4 * (self.dim or 0)
+            if quantizer is None or self._codes is None:
+                return {
+                    "compression": quantizer.name if quantizer else "none",
+                    "active": False,
+                    "rows": self._count,
+                    "bytes_per_vector": float_bytes,
+                }
+            code_bytes = quantizer.bytes_per_vector(self.dim)
+            return {
+                "compression": quantizer.name,
+                "active": True,
+                "rows": self._count,
+                "trained_rows": self._quantized_rows,
+                "bytes_per_vector": code_bytes,
+                "float32_bytes_per_vector": float_bytes,
+                "memory_ratio": round(code_bytes / float_bytes, 4) if float_bytes else None,
+                "resident_mb": round(self._codes.nbytes / 2 ** 20, 2),
+                **self._compression_report,
+            }
+
+    # ----------------- Collection 接口 -----------------
+
+    def count(self) -> int:
+        return len(self._row_of)
+
+    def add(self, ids, embeddings, documents=None, metadatas=None, **kwargs) -> None:
+        self._write(list(ids), documents, metadatas, embeddings, replace=False)
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None, **kwargs) -> None:
+        self._write(list(ids), documents, metadatas, embeddings, replace=True)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None, **kwargs) -> None:
+        with self._lock:
+            targets = list(ids or [])
+            if where:
+                mask = self._where_mask(where, self._count)
+                targets += [self._ids[r] for r in self._row_of.values() if mask[r]]
+            deleted = [doc_id for doc_id in dict.fromkeys(targets) if self._tombstone(doc_id)]
+            if deleted and self._log is not None:
+                self._log.write("".join(json.dumps({"op": "del", "id": d}) + "\n" for d in deleted))
+                self._log.flush()
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None, include=None, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            rows = [self._row_of[i] for i in ids if i in self._row_of] if ids is not None else sorted(self._row_of.values())
+            if where:
+                mask = self._where_mask(where, self._count)
+                rows = [r for r in rows if mask[r]]
+            out = {
+                "ids": [self._ids[r] for r in rows],
+                "documents": [self._documents[r] for r in rows],
+                "metadatas": [self._metadatas[r] for r in rows],
+            }
+            if include and "embeddings" in include:
+                out["embeddings"] = [np.array(self._vectors[r]) for r in rows]
+            return out
+
+    def query(
+        self,
+        query_embeddings,
+        n_results: int = 10,
+        where: Optional[Dict] = None,
+        include=None,
+        **kwargs
+    ) -> Dict[str, List[List[Any]]]:
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        out: Dict[str, List[List[Any]]] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if include and "embeddings" in include:
+            out["embeddings"] = []
+        with self._lock:
+            n = self._count
+            if n == 0 or self.dim is None:
+                for key in out:
+                    out[key] = [[] for _ in queries]
+                return out
+            if queries.shape[1] != self.dim:
+                raise ValueError(f"Query dimension {queries.shape[1]} does not match collection dimensionality {self.dim}")
+
+            vectors = self._vectors[:n]
+            base_mask = np.frombuffer(self._live, dtype=np.uint8, count=n).astype(bool)
+            if where:
+                base_mask &= self._where_mask(where, n)
+
+            live = int(np.count_nonzero(base_mask))
+            all_live = live == n
+            for q in queries:
+                rows = None
+                ivf = self._ivf
+                if ivf is not None and ivf.centroids is not None and len(ivf.assignments) == n:
+                    probe_mask = np.zeros(n, dtype=bool)
+                    probe_mask[ivf.candidates(q)] = True
+                    probe_mask &= base_mask
+                    # 探测到的簇里候选不足时退回全量扫描，保证返回条数
+                    if np.count_nonzero(probe_mask) >= n_results:
+                        rows = np.flatnonzero(probe_mask)
+
+                if self._codes is not None and len(self._codes) == n:
+                    # 压缩码上按非对称距离选候选，再从 memmap 读原向量精排
+                    k = min(n_results, live if rows is None else len(rows))
+                    if k <= 0:
+                        for key in out:
+                            out[key].append([])
+                        continue
+                    picked, exact = search_compressed(
+                        self._quantizer, self._codes, vectors, q, k, settings.NUMPY_VECTOR_STORE_RERANK,
+                        rows=rows, mask=None if all_live else base_mask
+                    )
+                    out["ids"].append([self._ids[r] for r in picked])
+                    out["documents"].append([self._documents[r] for r in picked])
+                    out["metadatas"].append([self._metadatas[r] for r in picked])
+                    out["distances"].append([float(d) for d in exact])
+                    if "embeddings" in out:
+                        out["embeddings"].append([np.array(vectors[r]) for r in picked])
+                    continue
+
+                # 平方 L2 距离：|x|^2 - 2 x·q + |q|^2
+                if rows is not None:
+                    dists = self._sqnorms[rows] - 2.0 * (vectors[rows] @ q) + float(q @ q)
+                else:
+                    # 全量扫描直接在连续矩阵上做矩阵向量乘，墓碑/不满足过滤的行距离置为 inf
+                    dists = self._sqnorms[:n] - 2.0 * (vectors @ q) + float(q @ q)
+                    if not all_live:
+                        dists[~base_mask] = np.inf
+                candidates = len(dists) if rows is not None else live
+                k = min(n_results, candidates)
+                if k <= 0:
+                    for key in out:
+                        out[key].append([])
+                    continue
+                top = np.argpartition(dists, k - 1)[:k] if k < len(dists) else np.arange(len(dists))
+                top = top[np.argsort(dists[top])]
+                picked = rows[top] if rows is not None else top
+                out["ids"].append([self._ids[r] for r in picked])
+                out["documents"].append([self._documents[r] for r in picked])
+                out["metadatas"].append([self._metadatas[r] for r in picked])
+                out["distances"].append([float(max(d, 0.0)) for d in dists[top]])
+                if "embeddings" in out:
+                    out["embeddings"].append([np.array(vectors[r]) for r in picked])
+        return out
+
+
+class NumpyVectorClient:
+    """与 chromadb 客户端同名的集合管理方法，集合存放在 root 下的子目录"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._collections: Dict[str, NumpyCollection] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> Path:
+        if not _NAME_RE.match(name or ""):
+            raise ValueError(f"Invalid collection name: {name!r}")
+        return self.root / name
+
+    def get_collection(self, name: str, **kwargs) -> NumpyCollection:
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                path = self._path(name)
+                if not (path / "collection.json").exists():
+                    raise ValueError(f"Collection {name} does not exist.")
+                collection = self._collections[name] = NumpyCollection(name, path)
+            return collection
+
+    def create_collection(self, name: str, metadata: Optional[Dict] = None, **kwargs) -> NumpyCollection:
+        with self._lock:
+            path = self._path(name)
+            if name in self._collections or (path / "collection.json").exists():
+                raise ValueError(f"Collection {name} already exists.")
+            collection = self._collections[name] = NumpyCollection(name, path, metadata)
+            return collection
+
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict] = None, **kwargs) -> NumpyCollection:
+        try:
+            return self.get_collection(name)
+        except ValueError:
+            try:
+                return self.create_collection(name, metadata)
+            except ValueError:
+                # 并发创建：另一个线程刚建好
+                return self.get_collection(name)
+
+    def delete_collection(self, name: str) -> None:
+        with self._lock:
+            path = self._path(name)
+            collection = self._collections.pop(name, None)
+            if collection is not None:
+                collection.close()
+            if not path.exists():
+                raise ValueError(f"Collection {name} does not exist.")
+            shutil.rmtree(path)
+
+    def list_collections(self) -> List[str]:
+        return sorted(p.name for p in self.root.iterdir() if (p / "collection.json").exists())
+
+    def heartbeat(self) -> int:
+        return 0
+
+
+class NumpyVectorStore(ChromaVectorStore):
+    """进程内向量库：复用 ChromaVectorStore 的句柄缓存、线程池与入库流水线，只替换底层 client"""
+
+    def _connect(self):
+        self.client = NumpyVectorClient(settings.NUMPY_VECTOR_STORE_PATH)
+        logger.info(f"Using in-process NumPy vector store at {settings.NUMPY_VECTOR_STORE_PATH}")
+
+    def compression_stats(self) -> Dict[str, Dict[str, Any]]:
+        """已打开集合的压缩统计"""
+        return {name: c.compression_stats() for name, c in list(self.client._collections.items())}
@@ -0,0 +1,97 @@
+"""
+请求限流工具：令牌桶（请求数/秒 + token 数/分钟）
+
+状态只用线程锁保护、等待只用 asyncio.sleep，不绑定任何事件循环，
+因此主事件循环和后台入库任务自建的事件循环可以共享同一个限流器。
+
+所有调用都要等到令牌足够才放行（不透支），优先级靠预留额度实现：
+入库（bulk）只能用到桶里 interactive_reserve 比例以上的令牌，剩下的那一截只留给在线查询，
+查询因此不用排在入库积压之后，同时总量仍不超过配额。
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict
+
+from app.services.resilience import BULK, INTERACTIVE
+
+
+class TokenBucket:
+    """令牌桶：按 rate/秒 补充，最多积攒 capacity 个令牌。方法由调用方加锁"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, floor: float = 0.0) -> float:
+        """扣掉 amount 后仍不低于 floor 还需等待的秒数（0 表示现在就够）"""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        # 超过可用容量的单次请求按可用容量计，否则永远等不到
+        amount = min(float(amount), self.capacity - floor)
+        deficit = amount + floor - self._tokens
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def take(self, amount: float, floor: float = 0.0) -> None:
+        if not self.unlimited:
+            self._tokens -= min(float(amount), self.capacity - floor)
+
+
+class RequestRateLimiter:
+    """同时约束请求数/秒与 token 数/分钟；rate <= 0 表示该维度不限"""
+
+    def __init__(self, requests_per_second: float, tokens_per_minute: float, interactive_reserve: float = 0.1):
+        self.requests = TokenBucket(requests_per_second, capacity=max(1.0, requests_per_second))
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, capacity=tokens_per_minute)
+        self.interactive_reserve = min(max(interactive_reserve, 0.0), 0.9)
+        self._lock = threading.Lock()
+        self.throttled = {INTERACTIVE: 0, BULK: 0}
+        self.throttled_seconds = {INTERACTIVE: 0.0, BULK: 0.0}
+
+    def try_acquire(self, tokens: int = 0, priority: str = BULK) -> float:
+        """两个维度都够时一起扣除并返回 0；否则不扣，返回还需等待的秒数"""
+        share = 0.0 if priority == INTERACTIVE else self.interactive_reserve
+        with self._lock:
+            request_floor = self.requests.capacity * share
+            token_floor = self.tokens.capacity * share
+            wait = max(
+                self.requests.wait_time(1, request_floor),
+                self.tokens.wait_time(tokens, token_floor)
+            )
+            if wait <= 0:
+                self.requests.take(1, request_floor)
+                self.tokens.take(tokens, token_floor)
+            return wait
+
+    async def acquire(self, tokens: int = 0, priority: str = BULK) -> None:
+        """等到令牌足够再返回；醒来后重新检查，期间被其他调用抢先则继续等"""
+        priority = priority if priority in self.throttled else BULK
+        waited = False
+        while True:
+            wait = self.try_acquire(tokens, priority)
+            if wait <= 0:
+                return
+            if not waited:
+                self.throttled[priority] += 1
+                waited = True
+            self.throttled_seconds[priority] += wait
+            await asyncio.sleep(wait)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "throttled": dict(self.throttled),
+            "throttled_seconds": {k: round(v, 3) for k, v in self.throttled_seconds.items()},
+        }
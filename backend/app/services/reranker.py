@@ -0,0 +1,213 @@
+"""
+检索结果重排：在放大的候选集上用更精细的相关性打分重新排序
+
+向量检索只按距离排序（score = 1/(1+d)），小 k 时精度有限。这里在 n_results * fetch_factor 个候选上重排，
+精度上去后可以少给大模型送块。重排器可插拔：
+- lexical: 查询词覆盖率（复用 BM25 的 CJK 切词），纯 CPU、微秒级，默认
+- onnx:    本地 ONNX 交叉编码器（如 bge-reranker 导出），onnxruntime CPU 推理
+控制项（知识库可在 retrieval_config["rerank"] 中覆盖）：
+- 按 batch_size 分批打分，超出 latency_budget_ms 后剩余候选不再打分，保持原顺序排在已打分的之后
+- 原排序第一名已明显领先（与第二名分差 >= skip_margin）时跳过重排
+"""
+
+import asyncio
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.services.lexical_index import tokenize
+
+try:
+    import onnxruntime
+    from tokenizers import Tokenizer
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+
+class Reranker(ABC):
+    """重排器接口：对 (query, 文档) 打分，分数越大越相关"""
+
+    name: str = "base"
+
+    @abstractmethod
+    def score(self, query: str, documents: List[str]) -> List[float]:
+        """返回与 documents 等长的相关度分数"""
+
+
+class LexicalOverlapReranker(Reranker):
+    """查询词覆盖率：文档中出现的查询词（去重）权重之和 / 查询词总权重；二字词与英文词权重高于单字"""
+
+    name = "lexical"
+
+    @staticmethod
+    def _weights(query: str) -> Dict[str, float]:
+        return {token: (1.0 if len(token) == 1 else 2.0) for token in tokenize(query)}
+
+    def score(self, query: str, documents: List[str]) -> List[float]:
+        weights = self._weights(query)
+        total = sum(weights.values())
+        if not total:
+            return [0.0] * len(documents)
+        out = []
+        for document in documents:
+            terms = set(tokenize(document))
+            out.append(sum(w for token, w in weights.items() if token in terms) / total)
+        return out
+
+
+class OnnxCrossEncoderReranker(Reranker):
+    """本地 ONNX 交叉编码器：(query, 文档) 成对输入，取最后一维 logit 过 sigmoid"""
+
+    name = "onnx"
+
+    def __init__(self, model_path: str, tokenizer_path: str, max_length: int = 512):
+        if not ONNX_AVAILABLE:
+            raise RuntimeError("onnxruntime/tokenizers not installed, cannot use onnx reranker")
+        if not model_path or not tokenizer_path:
+            raise ValueError("RERANK_ONNX_MODEL_PATH and RERANK_ONNX_TOKENIZER_PATH are required")
+        self.model_path = model_path
+        self.tokenizer_path = tokenizer_path
+        self.max_length = max_length
+        self._session = None
+        self._tokenizer = None
+        self._load_lock = threading.Lock()
+
+    def _load(self) -> None:
+        with self._load_lock:
+            if self._session is not None:
+                return
+            tokenizer = Tokenizer.from_file(self.tokenizer_path)
+            tokenizer.enable_truncation(max_length=self.max_length)
+            tokenizer.enable_padding()
+            self._tokenizer = tokenizer
+            self._session = onnxruntime.InferenceSession(
+                self.model_path, providers=["CPUExecutionProvider"]
+            )
+            logger.info(f"Loaded ONNX reranker {Path(self.model_path).name}")
+
+    def score(self, query: str, documents: List[str]) -> List[float]:
+        self._load()
+        input_names = {i.name for i in self._session.get_inputs()}
+        encodings = self._tokenizer.encode_batch([(query, document) for document in documents])
+        ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        feeds = {
+            "input_ids": ids,
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        logits = self._session.run(None, {k: v for k, v in feeds.items() if k in input_names})[0]
+        logits = np.asarray(logits, dtype=np.float32).reshape(len(documents), -1)[:, -1]
+        return [float(1.0 / (1.0 + math.exp(-x))) for x in logits]
+
+
+def build_reranker(name: str) -> Reranker:
+    name = (name or "lexical").strip().lower()
+    if name == "lexical":
+        return LexicalOverlapReranker()
+    if name == "onnx":
+        return OnnxCrossEncoderReranker(
+            model_path=settings.RERANK_ONNX_MODEL_PATH,
+            tokenizer_path=settings.RERANK_ONNX_TOKENIZER_PATH,
+            max_length=settings.RERANK_ONNX_MAX_LENGTH
+        )
+    raise ValueError(f"Unknown reranker: {name}")
+
+
+def rerank_config(retrieval_config: Optional[Dict]) -> Dict:
+    """合并全局默认与知识库 retrieval_config["rerank"] 中的覆盖项"""
+    config = {
+        "enabled": settings.RERANK_ENABLED,
+        "provider": settings.RERANK_PROVIDER,
+        "fetch_factor": settings.RERANK_FETCH_FACTOR,
+        "batch_size": settings.RERANK_BATCH_SIZE,
+        "latency_budget_ms": settings.RERANK_LATENCY_BUDGET_MS,
+        "skip_margin": settings.RERANK_SKIP_MARGIN,
+    }
+    overrides = (retrieval_config or {}).get("rerank")
+    if isinstance(overrides, dict):
+        config.update({k: v for k, v in overrides.items() if k in config})
+    elif isinstance(overrides, bool):
+        config["enabled"] = overrides
+    return config
+
+
+class RerankStage:
+    """按名称缓存重排器实例，执行分批 / 限时 / 跳过规则，并记录统计"""
+
+    def __init__(self):
+        self._rerankers: Dict[str, Reranker] = {}
+        self._lock = threading.Lock()
+        self.reranked = 0
+        self.skipped = 0
+        self.budget_exceeded = 0
+        self.errors = 0
+
+    def get_reranker(self, name: str) -> Reranker:
+        with self._lock:
+            reranker = self._rerankers.get(name)
+            if reranker is None:
+                reranker = self._rerankers[name] = build_reranker(name)
+            return reranker
+
+    @staticmethod
+    def _dominant(hits: List[Dict], margin: float) -> bool:
+        if len(hits) < 2:
+            return True
+        first, second = hits[0].get("score"), hits[1].get("score")
+        return first is not None and second is not None and first - second >= margin
+
+    def _score_within_budget(self, reranker: Reranker, query: str, hits: List[Dict], config: Dict) -> List[float]:
+        """分批打分；超出时间预算后停止（至少打完第一批），返回已打分部分的分数"""
+        batch_size = max(1, int(config["batch_size"]))
+        deadline = time.monotonic() + float(config["latency_budget_ms"]) / 1000.0
+        scores: List[float] = []
+        for start in range(0, len(hits), batch_size):
+            if start and time.monotonic() >= deadline:
+                break
+            batch = hits[start:start + batch_size]
+            scores.extend(reranker.score(query, [h.get("content") or "" for h in batch]))
+        return scores
+
+    async def rerank(self, query: str, hits: List[Dict], config: Dict) -> List[Dict]:
+        """返回重排后的全部候选；打过分的带 rerank_score。出错时原样返回，不影响检索"""
+        if self._dominant(hits, float(config["skip_margin"])):
+            self.skipped += 1
+            return hits
+        try:
+            reranker = self.get_reranker(config["provider"])
+            scores = await asyncio.get_running_loop().run_in_executor(
+                None, self._score_within_budget, reranker, query, hits, config
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Rerank with {config['provider']} failed, keeping retrieval order: {e!r}")
+            return hits
+
+        self.reranked += 1
+        if len(scores) < len(hits):
+            self.budget_exceeded += 1
+            logger.debug(f"Rerank budget exceeded, scored {len(scores)}/{len(hits)} candidates")
+        scored = [dict(hit, rerank_score=round(float(s), 6)) for hit, s in zip(hits, scores)]
+        # 稳定排序：分数相同时保持检索顺序
+        scored.sort(key=lambda h: h["rerank_score"], reverse=True)
+        return scored + hits[len(scores):]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "reranked": self.reranked,
+            "skipped": self.skipped,
+            "budget_exceeded": self.budget_exceeded,
+            "errors": self.errors,
+        }
+
+
+# 创建全局实例
+rerank_stage = RerankStage()
@@ -0,0 +1,234 @@
+"""
+上游调用的熔断与舱壁隔离
+
+- CircuitBreaker：连续失败达到阈值后熔断，熔断期间直接抛 CircuitOpenError；
+  冷却结束进入半开状态，只放行少量探测请求，成功即恢复、失败重新熔断
+- Bulkhead：进程级并发上限（跨事件循环），入库与在线查询各用一个，互不挤占
+
+状态只用线程锁保护，与 rate_limit 一样可被主事件循环和后台任务的事件循环共享。
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Tuple
+
+import httpx
+from loguru import logger
+
+# 嵌入请求优先级：在线查询 / 批量入库
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态，请求未发出即失败"""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"Upstream '{name}' is unavailable (circuit open, retry in {retry_after:.0f}s)")
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """是否算作上游故障：网络错误/超时/5xx 计入；4xx（含 429 限流）是请求本身的问题，不计入"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response is not None and exc.response.status_code >= 500
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """tenacity 重试条件：熔断直接失败，客户端错误重试也没用"""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, httpx.HTTPStatusError) and exc.response is not None:
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return True
+
+
+class CircuitBreaker:
+    """closed -> open -> half_open -> closed/open"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self) -> None:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+            logger.info(f"Circuit '{self.name}' half-open, probing upstream")
+
+    def check(self) -> None:
+        """只检查不占用探测名额：打开状态直接抛 CircuitOpenError（用于排队前的快速失败）"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state != self.OPEN:
+                return
+            self.rejected += 1
+            retry_after = max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+        raise CircuitOpenError(self.name, retry_after)
+
+    def before_call(self) -> None:
+        """放行则返回，否则抛 CircuitOpenError"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return
+            self.rejected += 1
+            retry_after = max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+        raise CircuitOpenError(self.name, retry_after)
+
+    def on_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"Circuit '{self.name}' closed, upstream recovered")
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def on_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                logger.warning(
+                    f"Circuit '{self.name}' opened after {self._failures} failures, "
+                    f"failing fast for {self.recovery_timeout:.0f}s"
+                )
+
+    def on_release(self) -> None:
+        """调用被取消（如对冲落败）：不计成败，只归还半开探测名额"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        self.before_call()
+        try:
+            yield
+        except asyncio.CancelledError:
+            self.on_release()
+            raise
+        except Exception as e:
+            if is_upstream_failure(e):
+                self.on_failure()
+            else:
+                # 4xx 说明上游是通的
+                self.on_success()
+            raise
+        else:
+            self.on_success()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class Bulkhead:
+    """跨事件循环的并发上限；等待者按先来先到被唤醒"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self._active = 0
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self._lock = threading.Lock()
+        self.peak_waiting = 0
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+            self.peak_waiting = max(self.peak_waiting, len(self._waiters))
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove((loop, future))
+                    granted = False
+                except ValueError:
+                    # 已被唤醒（名额已转交给本等待者）
+                    granted = future.done() and not future.cancelled()
+            if granted:
+                self.release()
+            raise
+
+    def _grant(self, future: asyncio.Future) -> None:
+        if future.done():
+            # 等待者在唤醒前被取消：名额继续往下传
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                if loop.is_closed():
+                    continue
+                # 名额直接转交，不减 active
+                loop.call_soon_threadsafe(self._grant, future)
+                return
+            self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "waiting": len(self._waiters),
+                "peak_waiting": self.peak_waiting,
+            }
@@ -0,0 +1,166 @@
+"""
+检索结果缓存：相同（或近似）问题直接复用上一次的检索结果，省掉查询嵌入与向量检索
+
+- 键：(集合, 规范化后的问题, n_results, 过滤条件 + 检索配置)；值为检索结果列表（含 id、分数与内容）
+- 每个集合一个写入版本号，入库 / 补齐 / 删除知识库时递增（见 VectorStoreManager），旧版本的条目随即作废；
+  检索开始时记下版本号，写缓存时带上，检索期间发生写入的结果不会被后续请求命中
+- 可选语义命中：RETRIEVAL_CACHE_SIMILARITY_THRESHOLD > 0 时，精确未命中后用查询向量与同参数下已缓存问题的
+  向量比较余弦相似度，超过阈值即复用（换个说法的同一问题）。查询向量照常传给后续检索，不会多算一次
+- 版本号只在本进程内有效，多进程部署时其他进程的写入靠 RETRIEVAL_CACHE_TTL 兜底过期
+"""
+
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+CacheKey = Tuple[str, str, int, str]
+
+# 句末标点与空白不影响检索结果
+_TRAILING_PUNCT_RE = re.compile(r"[\s?？!！。.,，;；~～]+$")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    text = unicodedata.normalize("NFKC", query or "").lower()
+    text = _SPACE_RE.sub(" ", text).strip()
+    return _TRAILING_PUNCT_RE.sub("", text)
+
+
+class _Entry:
+    __slots__ = ("hits", "version", "expires_at", "embedding")
+
+    def __init__(self, hits: List[Dict], version: int, expires_at: float, embedding: Optional[np.ndarray]):
+        self.hits = hits
+        self.version = version
+        self.expires_at = expires_at
+        self.embedding = embedding
+
+
+class RetrievalCache:
+    """进程内 LRU 检索结果缓存（线程安全：入库在后台线程里递增版本号）"""
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 300.0, similarity_threshold: float = 0.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def semantic(self) -> bool:
+        return self.similarity_threshold > 0
+
+    @staticmethod
+    def make_key(
+        collection_name: str,
+        query: str,
+        n_results: int,
+        filters: Optional[Dict[str, Any]] = None,
+        retrieval_config: Optional[Dict] = None,
+        knowledge_base_id: Optional[int] = None
+    ) -> CacheKey:
+        params = json.dumps(
+            {"filters": filters or {}, "config": retrieval_config or {}, "kb": knowledge_base_id},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return (collection_name, normalize_query(query), int(n_results), params)
+
+    def version(self, collection_name: str) -> int:
+        with self._lock:
+            return self._versions.get(collection_name, 0)
+
+    def bump(self, collection_name: str) -> None:
+        """集合内容变化：版本号递增，并清掉该集合的条目"""
+        with self._lock:
+            self._versions[collection_name] = self._versions.get(collection_name, 0) + 1
+            stale = [key for key in self._entries if key[0] == collection_name]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += 1
+
+    def _valid(self, key: CacheKey, entry: _Entry, now: float) -> bool:
+        return entry.version == self._versions.get(key[0], 0) and entry.expires_at > now
+
+    def get(self, key: CacheKey) -> Optional[List[Dict]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._valid(key, entry, now):
+                if entry is not None:
+                    del self._entries[key]
+                if not self.semantic:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return [dict(hit) for hit in entry.hits]
+
+    def get_similar(self, key: CacheKey, query_embedding: np.ndarray) -> Optional[List[Dict]]:
+        """在同一集合、同一参数的条目中找问题向量最相近的一条，余弦相似度达到阈值才算命中"""
+        query = self._unit(query_embedding)
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                (k, e) for k, e in self._entries.items()
+                if k[0] == key[0] and k[2:] == key[2:] and e.embedding is not None
+                and e.embedding.shape == query.shape and self._valid(k, e, now)
+            ]
+            if candidates:
+                sims = np.stack([e.embedding for _, e in candidates]) @ query
+                best = int(np.argmax(sims))
+                if sims[best] >= self.similarity_threshold:
+                    best_key, entry = candidates[best]
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return [dict(hit) for hit in entry.hits]
+            self.misses += 1
+            return None
+
+    def put(self, key: CacheKey, hits: List[Dict], version: int, query_embedding: Optional[np.ndarray] = None) -> None:
+        """version 为检索开始前读到的版本号；期间集合已被写入时不缓存"""
+        embedding = self._unit(query_embedding) if self.semantic and query_embedding is not None else None
+        with self._lock:
+            if version != self._versions.get(key[0], 0):
+                return
+            self._entries[key] = _Entry([dict(hit) for hit in hits], version, time.monotonic() + self.ttl, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+# 创建全局实例
+retrieval_cache = RetrievalCache(
+    max_entries=settings.RETRIEVAL_CACHE_MAX_ENTRIES,
+    ttl=settings.RETRIEVAL_CACHE_TTL,
+    similarity_threshold=settings.RETRIEVAL_CACHE_SIMILARITY_THRESHOLD
+) if settings.RETRIEVAL_CACHE_ENABLED else None
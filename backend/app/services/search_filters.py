@@ -0,0 +1,89 @@
+"""
+检索过滤条件：转换为 Chroma where 子句下推到向量检索，并在 BM25 等进程内召回上做同样的匹配
+
+支持的条件（均可省略）：
+- file_ids:        只在这些文件中检索
+- content_types:   内容类型（text / table / list / code ...）
+- section_titles:  章节标题
+- source_files:    源文件名
+- page_from / page_to:          页码范围（闭区间）
+- created_after / created_before: 入库时间范围，按块元数据中的 created_ts（epoch 秒）比较；
+  没有 created_ts 的旧块不会命中时间条件
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Union
+
+TimeLike = Union[datetime, str, int, float]
+
+
+def _to_ts(value: TimeLike) -> float:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value)).timestamp()
+
+
+def _as_list(value: Any) -> List:
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def build_where_clause(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """把过滤条件转成 Chroma where；没有条件时返回 None（Chroma 不接受空 where）"""
+    if not filters:
+        return None
+    conditions: List[Dict[str, Any]] = []
+
+    # 入库时 *_id 元数据统一存成字符串（见 clean_metadata）
+    file_ids = [str(v) for v in _as_list(filters.get("file_ids"))]
+    if file_ids:
+        conditions.append({"file_id": {"$in": file_ids}})
+    for key, field in (
+        ("content_types", "content_type"),
+        ("section_titles", "section_title"),
+        ("source_files", "source_file"),
+    ):
+        values = [str(v) for v in _as_list(filters.get(key))]
+        if values:
+            conditions.append({field: {"$in": values}})
+
+    if filters.get("page_from") is not None:
+        conditions.append({"page_number": {"$gte": int(filters["page_from"])}})
+    if filters.get("page_to") is not None:
+        conditions.append({"page_number": {"$lte": int(filters["page_to"])}})
+    if filters.get("created_after") is not None:
+        conditions.append({"created_ts": {"$gte": _to_ts(filters["created_after"])}})
+    if filters.get("created_before") is not None:
+        conditions.append({"created_ts": {"$lte": _to_ts(filters["created_before"])}})
+
+    if not conditions:
+        return None
+    # Chroma 的 $and 至少需要两个子条件
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def _compare(op: str, actual: Any, expected: Any) -> bool:
+    if op == "$in":
+        return actual is not None and str(actual) in expected
+    if actual is None:
+        return False
+    try:
+        actual = float(actual)
+    except (TypeError, ValueError):
+        return False
+    return actual >= expected if op == "$gte" else actual <= expected
+
+
+def matches_where(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """在进程内对一条元数据求值 build_where_clause 产生的 where（BM25 等非 Chroma 召回路径用）"""
+    if not where:
+        return True
+    if "$and" in where:
+        return all(matches_where(metadata, cond) for cond in where["$and"])
+    for field, cond in where.items():
+        if not all(_compare(op, metadata.get(field), expected) for op, expected in cond.items()):
+            return False
+    return True
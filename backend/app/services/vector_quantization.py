@@ -0,0 +1,227 @@
+"""
+向量压缩：标量 int8 量化（SQ8）与乘积量化（PQ），供进程内向量库使用
+
+常驻内存的只有压缩码：SQ8 每维 1 字节（1536 维约 1.5 KB，float32 的 1/4），
+PQ 每个子空间 1 字节（M=96 时 96 字节，约 1/64）。检索先用非对称距离（查询保持 float32，
+与压缩码直接算距离）在压缩码上选出候选，再从磁盘上的 float32 原向量精排。
+estimate_recall 用抽样数据衡量压缩 + 精排相对精确检索的召回，便于权衡内存与召回。
+"""
+
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# 分块计算，避免一次性把 (n, d) 压缩码展开成 float32（4096 x 1536 维约 25 MB）
+_CHUNK_ROWS = 4096
+
+
+class Quantizer(ABC):
+    """压缩器接口"""
+
+    name = "none"
+
+    @abstractmethod
+    def train(self, sample: np.ndarray) -> None:
+        """在抽样向量上训练码本/量化参数"""
+
+    @abstractmethod
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, d) float32 -> (n, 每向量字节数) 压缩码"""
+
+    @abstractmethod
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """查询（float32）到各压缩码的近似平方 L2 距离"""
+
+    @abstractmethod
+    def bytes_per_vector(self, dim: int) -> int:
+        """每个向量压缩码占用的字节数"""
+
+
+class ScalarInt8Quantizer(Quantizer):
+    """按维度 min/max 线性映射到 int8；超出训练范围的值截断"""
+
+    name = "int8"
+
+    def __init__(self):
+        self.offset: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    def train(self, sample: np.ndarray) -> None:
+        low = sample.min(axis=0)
+        high = sample.max(axis=0)
+        self.offset = low.astype(np.float32)
+        self.scale = np.maximum((high - low) / 255.0, 1e-12).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.offset) / self.scale) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.offset + (codes.astype(np.float32) + 128) * self.scale
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # |q - x̂|^2，x̂ = offset + (c + 128) * scale；分块展开避免 n*d 的 float32 临时矩阵
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _CHUNK_ROWS):
+            diff = self.decode(codes[start:start + _CHUNK_ROWS]) - query
+            out[start:start + len(diff)] = np.einsum("ij,ij->i", diff, diff)
+        return out
+
+    def bytes_per_vector(self, dim: int) -> int:
+        return dim
+
+
+class ProductQuantizer(Quantizer):
+    """乘积量化：向量切成 m 段，每段用 256 个质心的码本编码为 1 字节"""
+
+    name = "pq"
+
+    def __init__(self, m: int = 96, iterations: int = 12, seed: int = 0):
+        self.m = m
+        self.iterations = iterations
+        self.seed = seed
+        self.codebooks: Optional[np.ndarray] = None  # (m, 256, dsub)
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        n, dim = vectors.shape
+        return vectors.reshape(n, self.m, dim // self.m)
+
+    def train(self, sample: np.ndarray) -> None:
+        dim = sample.shape[1]
+        if dim % self.m:
+            raise ValueError(f"PQ subspaces m={self.m} must divide dimension {dim}")
+        rng = np.random.default_rng(self.seed)
+        parts = self._split(sample.astype(np.float32))
+        k = min(256, len(sample))
+        codebooks = np.zeros((self.m, 256, dim // self.m), dtype=np.float32)
+        for j in range(self.m):
+            data = parts[:, j, :]
+            centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+            for _ in range(self.iterations):
+                assign = self._nearest(data, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, data)
+                counts = np.bincount(assign, minlength=k)[:, None]
+                filled = counts[:, 0] > 0
+                centroids[filled] = sums[filled] / counts[filled]
+            codebooks[j, :k] = centroids
+            if k < 256:
+                codebooks[j, k:] = centroids[0]
+        self.codebooks = codebooks
+
+    @staticmethod
+    def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        dists = (
+            np.einsum("ij,ij->i", data, data)[:, None]
+            - 2.0 * data @ centroids.T
+            + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+        )
+        return dists.argmin(axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for start in range(0, len(vectors), _CHUNK_ROWS):
+            parts = self._split(np.asarray(vectors[start:start + _CHUNK_ROWS], dtype=np.float32))
+            for j in range(self.m):
+                codes[start:start + len(parts), j] = self._nearest(parts[:, j, :], self.codebooks[j])
+        return codes
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # ADC：先算查询每段到 256 个质心的距离表，再按压缩码查表求和
+        q = query.reshape(self.m, -1)
+        table = ((self.codebooks - q[:, None, :]) ** 2).sum(axis=2)  # (m, 256)
+        out = np.empty(len(codes), dtype=np.float32)
+        cols = np.arange(self.m)
+        for start in range(0, len(codes), _CHUNK_ROWS):
+            block = codes[start:start + _CHUNK_ROWS]
+            out[start:start + len(block)] = table[cols, block].sum(axis=1)
+        return out
+
+    def bytes_per_vector(self, dim: int) -> int:
+        return self.m
+
+
+def pq_subspaces(dim: int, m: int) -> int:
+    """不超过 m 且能整除 dim 的最大子空间数（如 1024 维、m=96 时为 64）"""
+    for candidate in range(min(m, dim), 0, -1):
+        if dim % candidate == 0:
+            return candidate
+    return 1
+
+
+def build_quantizer(kind: str, pq_m: int = 96) -> Optional[Quantizer]:
+    kind = (kind or "none").lower()
+    if kind == "int8":
+        return ScalarInt8Quantizer()
+    if kind == "pq":
+        return ProductQuantizer(m=pq_m)
+    if kind in ("", "none"):
+        return None
+    raise ValueError(f"Unknown vector compression: {kind}")
+
+
+def search_compressed(
+    quantizer: Quantizer,
+    codes: np.ndarray,
+    vectors: np.ndarray,
+    query: np.ndarray,
+    k: int,
+    rerank: int,
+    rows: Optional[np.ndarray] = None,
+    mask: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    压缩码上取 k*rerank 个候选，再从原向量精排，返回 (top-k 行号, 精确平方 L2 距离)，按距离升序。
+    codes 与 vectors 逐行对应。rows 只在这些行上检索（如 IVF 选出的簇）；
+    否则在全部压缩码上算距离，mask 为 False 的行（墓碑 / 不满足过滤）距离置为 inf，不复制压缩码
+    """
+    approx = quantizer.distances(query, codes if rows is None else codes[rows])
+    available = len(approx)
+    if rows is None and mask is not None:
+        approx[~mask] = np.inf
+        available = int(np.count_nonzero(mask))
+    k = min(k, available)
+    candidates = min(available, max(k, k * rerank))
+    top = np.argpartition(approx, candidates - 1)[:candidates] if candidates < len(approx) else np.arange(len(approx))
+    picked = np.sort(top if rows is None else rows[top])  # 按行号顺序读 memmap
+    exact = ((np.asarray(vectors[picked]) - query) ** 2).sum(axis=1)
+    order = np.argsort(exact)[:k]
+    return picked[order], exact[order]
+
+
+def estimate_recall(
+    quantizer: Quantizer,
+    vectors: np.ndarray,
+    k: int = 10,
+    rerank: int = 4,
+    queries: int = 32,
+    max_rows: int = 5000,
+    seed: int = 0
+) -> Dict[str, float]:
+    """
+    在至多 max_rows 行的抽样上估计 recall@k：查询取抽样中的向量加少量噪声，
+    分别报告只用压缩码（ADC）与压缩码 + 精排两种情况
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    rows = np.sort(rng.choice(n, size=min(n, max_rows), replace=False))
+    base = np.asarray(vectors[rows], dtype=np.float32)
+    codes = quantizer.encode(base)
+    k = min(k, len(base))
+    noise = base.std() * 0.05
+    hits_adc = hits_rerank = 0
+    picks = rng.choice(len(base), size=min(queries, len(base)), replace=False)
+    for i in picks:
+        q = base[i] + rng.normal(scale=noise, size=base.shape[1]).astype(np.float32)
+        exact = set(np.argsort(((base - q) ** 2).sum(axis=1))[:k])
+        adc = set(np.argsort(quantizer.distances(q, codes))[:k])
+        reranked = set(search_compressed(quantizer, codes, base, q, k, rerank)[0])
+        hits_adc += len(exact & adc)
+        hits_rerank += len(exact & reranked)
+    total = k * len(picks) or 1
+    return {
+        f"recall_at_{k}_adc": round(hits_adc / total, 4),
+        f"recall_at_{k}_reranked": round(hits_rerank / total, 4),
+        "sample_rows": len(base),
+    }
@@ -1,10 +1,17 @@
+import asyncio
 import json
+import threading
+import time
 import uuid
-from typing import List, Dict, Optional, Tuple, Any, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Set, Tuple, Any, Union
+
+import numpy as np
 from loguru import logger
 from datetime import datetime
 
 from app.core.config import settings
+from app.services.tokenizer import count_tokens, clip_tokens
 
 try:
     import chromadb
@@ -14,12 +21,18 @@ except ImportError:
     CHROMADB_AVAILABLE = False
     logger.warning("ChromaDB not available, using mock implementation")
 
-try:
-    from app.services.bailian_client import bailian_client
-    BAILIAN_AVAILABLE = True
-except ImportError:
-    BAILIAN_AVAILABLE = False
-    logger.warning("Bailian client not available, using mock embeddings")
+from app.services.embedding_provider import embedding_provider
+from app.services.resilience import CircuitOpenError
+from app.services.search_filters import build_where_clause, matches_where
+from app.services.lexical_index import (
+    BM25Index,
+    hybrid_config,
+    lexical_index_manager,
+    reciprocal_rank_fusion,
+)
+from app.services.mmr import mmr_config, mmr_select
+from app.services.reranker import rerank_config, rerank_stage
+from app.services.retrieval_cache import retrieval_cache
 
 # 安全转换ID为字符串
 def safe_convert_id(value: Any) -> Optional[str]:
@@ -116,6 +129,19 @@ class ChromaVectorStore:
 
     def __init__(self):
         self.client = None
+        # 集合句柄缓存：name -> Collection。热路径（检索/分批入库）不再每次远程 get_or_create，
+        # 也不会每次改写集合 metadata；删除时失效，调用出错时重新获取
+        self._collections: Dict[str, Any] = {}
+        self._collections_lock = threading.Lock()
+        self.collection_cache_hits = 0
+        self.collection_cache_misses = 0
+        # 同步 Chroma 调用的专用线程池：大批写入/慢查询期间事件循环仍能处理其他请求，
+        # 池大小同时限制了打到 Chroma 的并发
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.CHROMA_EXECUTOR_WORKERS),
+            thread_name_prefix="chroma"
+        )
+        self.timeouts = 0
         self._connect()
 
     # 连接到Chroma数据库
@@ -195,9 +221,71 @@ class ChromaVectorStore:
             logger.error(f"Failed to get_or_create_collection {name}: {e!r}")
             raise
 
+    # 获取集合句柄（带进程内缓存）
+    def get_collection_handle(self, name: str, metadata: Optional[dict] = None):
+        """命中缓存直接返回；未命中时 get_or_create 一次并缓存（metadata 只在首次创建时生效）"""
+        with self._collections_lock:
+            collection = self._collections.get(name)
+            if collection is not None:
+                self.collection_cache_hits += 1
+                return collection
+            self.collection_cache_misses += 1
+        collection = self.get_or_create_collection(name, metadata=metadata)
+        with self._collections_lock:
+            self._collections[name] = collection
+        return collection
+
+    def invalidate_collection(self, name: str) -> None:
+        """丢弃缓存的集合句柄（集合被删除/重建、句柄调用出错时）"""
+        with self._collections_lock:
+            self._collections.pop(name, None)
+
+    def call_collection(self, name: str, fn, metadata: Optional[dict] = None):
+        """
+        用缓存句柄执行 fn(collection)；出错时认为句柄可能过期（集合被其他进程删除重建等），
+        失效后重新获取句柄再试一次，仍失败则抛出
+        """
+        collection = self.get_collection_handle(name, metadata)
+        try:
+            return fn(collection)
+        except Exception as e:
+            logger.warning(f"Chroma call on collection {name} failed ({e!r}), refreshing handle")
+            self.invalidate_collection(name)
+            return fn(self.get_collection_handle(name, metadata))
+
+    async def run_sync(self, fn, *args, timeout: Optional[float] = None):
+        """在 Chroma 线程池中执行同步调用并等待结果；超时抛 asyncio.TimeoutError（线程内调用会自然跑完）"""
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"Chroma call {getattr(fn, '__name__', fn)} timed out after {timeout}s")
+            raise
+
+    async def acall_collection(
+        self,
+        name: str,
+        fn,
+        metadata: Optional[dict] = None,
+        timeout: Optional[float] = None
+    ):
+        """call_collection 的异步版本：在线程池中执行，带超时"""
+        return await self.run_sync(lambda: self.call_collection(name, fn, metadata), timeout=timeout)
+
+    def collection_cache_stats(self) -> Dict[str, int]:
+        with self._collections_lock:
+            return {
+                "cached": len(self._collections),
+                "hits": self.collection_cache_hits,
+                "misses": self.collection_cache_misses,
+                "timeouts": self.timeouts,
+            }
+
     # 删除集合
     def delete_collection(self, name: str) -> bool:
         """删除集合（不存在也不报错）"""
+        self.invalidate_collection(name)
         try:
             # chroma http client
             self.client.delete_collection(name)
@@ -207,6 +295,10 @@ class ChromaVectorStore:
             # 某些实现会抛 NotFound，也统一吞掉
             logger.warning(f"Delete collection {name} got: {e} (ignored if not found)")
             return False
+
+    async def adelete_collection(self, name: str) -> bool:
+        """delete_collection 的异步版本：在线程池中执行，带写超时"""
+        return await self.run_sync(self.delete_collection, name, timeout=settings.CHROMA_WRITE_TIMEOUT)
         
     # 获取或创建集合
     async def add_documents(
@@ -216,90 +308,148 @@ class ChromaVectorStore:
         batch_size: int = 100
     ) -> List[str]:
         """
-        正确的分批入库流程：
-        1) 先从 documents 中提取 batch_ids / batch_texts / batch_metadatas
-        2) 再批量生成 embeddings
-        3) 校验四个数组长度一致
-        4) 最后只调用一次 collection.add(...)
+        分批入库，返回全部文档 id（含嵌入失败、暂未写入索引的文档）；
+        需要区分待补齐文档时使用 add_documents_with_pending
         """
-        collection = self.get_or_create_collection(
-            collection_name,
-            metadata={"purpose": "document_storage", "created_at": datetime.now().isoformat()}
-        )
+        ids, _ = await self.add_documents_with_pending(collection_name, documents, batch_size)
+        return ids
+
+    @staticmethod
+    def _prepare_batch(batch_docs: List[Dict]) -> Tuple[List[str], List[str], List[Dict]]:
+        """准备批次数据（清洗元数据、跳过空文本），返回 (ids, texts, metadatas)"""
+        batch_ids: List[str] = []
+        batch_texts: List[str] = []
+        batch_metadatas: List[Dict] = []
+
+        for doc in batch_docs:
+            doc_id = doc.get("id") or str(uuid.uuid4())
+            text = (doc.get("content") or "").strip()
+            if not text:
+                logger.warning(f"Skipping empty document text: id={doc_id}")
+                continue
 
-        all_ids: List[str] = []
+            metadata = doc.get("metadata", {}) or {}
+            cleaned_metadata = clean_metadata(metadata)
+            if not validate_metadata(cleaned_metadata):
+                logger.error(f"Invalid metadata for document {doc_id}: {cleaned_metadata}")
+                cleaned_metadata = {
+                    "validated": False,
+                    "original_id": doc_id,
+                    "created_at": datetime.now().isoformat()
+                }
+                if not validate_metadata(cleaned_metadata):
+                    logger.error(f"Skipping document {doc_id} due to invalid fallback metadata")
+                    continue
 
-        for i in range(0, len(documents), batch_size):
-            batch_docs = documents[i:i + batch_size]
+            batch_ids.append(doc_id)
+            batch_texts.append(text)
+            batch_metadatas.append(cleaned_metadata)
+        return batch_ids, batch_texts, batch_metadatas
 
-            batch_ids: List[str] = []
-            batch_texts: List[str] = []
-            batch_metadatas: List[Dict] = []
+    async def add_documents_with_pending(
+        self,
+        collection_name: str,
+        documents: List[Dict],
+        batch_size: int = 100,
+        upsert: bool = False
+    ) -> Tuple[List[str], Set[str]]:
+        """
+        流水线分批入库（生产者嵌入、消费者写入，两者重叠执行）：
+        1) 生产者按批提取 batch_ids / batch_texts / batch_metadatas
+        2) 批量生成 embeddings（允许部分失败），校验四个数组长度一致后放入有界队列；
+           队列满时生产者等待（背压），最多领先写入 VECTOR_INGEST_PIPELINE_DEPTH 批
+        3) 消费者只把成功拿到向量的文档写入集合；嵌入失败的文档不写零向量，id 放进 pending 由后台补齐
+        总耗时趋近 max(嵌入, 写入) 而不是两者之和。
+        返回 (全部文档 id，顺序与 documents 一致, 待补齐的 id 集合)；upsert=True 用于补齐时覆盖写入
+        """
+        collection_meta = {"purpose": "document_storage", "created_at": datetime.now().isoformat()}
 
-            # 1) 准备批次数据（清洗元数据  跳过空文本）
-            for doc in batch_docs:
-                doc_id = doc.get("id") or str(uuid.uuid4())
-                text = (doc.get("content") or "").strip()
-                if not text:
-                    logger.warning(f"Skipping empty document text: id={doc_id}")
+        # id 按批次顺序由生产者追加，与写入完成顺序无关，保证与输入 1:1 对齐
+        all_ids: List[str] = []
+        pending_ids: Set[str] = set()
+        written = 0
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, settings.VECTOR_INGEST_PIPELINE_DEPTH))
+
+        async def produce():
+            for i in range(0, len(documents), batch_size):
+                batch_no = i // batch_size + 1
+                batch_ids, batch_texts, batch_metadatas = self._prepare_batch(documents[i:i + batch_size])
+                if not batch_ids:
+                    logger.warning(f"No valid documents in batch {batch_no}, skipping.")
                     continue
 
-                metadata = doc.get("metadata", {}) or {}
-                cleaned_metadata = clean_metadata(metadata)
-                if not validate_metadata(cleaned_metadata):
-                    logger.error(f"Invalid metadata for document {doc_id}: {cleaned_metadata}")
-                    cleaned_metadata = {
-                        "validated": False,
-                        "original_id": doc_id,
-                        "created_at": datetime.now().isoformat()
-                    }
-                    if not validate_metadata(cleaned_metadata):
-                        logger.error(f"Skipping document {doc_id} due to invalid fallback metadata")
-                        continue
-
-                batch_ids.append(doc_id)
-                batch_texts.append(text)
-                batch_metadatas.append(cleaned_metadata)
-
-            if not batch_ids:
-                logger.warning(f"No valid documents in batch {i // batch_size + 1}, skipping.")
-                continue
+                # 生成 embeddings（由配置的嵌入后端生成；远程后端内部负责子批切分、并发与限流）
+                batch_embeddings, failed = await embedding_provider.embed_partial(batch_texts)
+                if batch_embeddings is None or len(batch_embeddings) != len(batch_texts):
+                    raise RuntimeError(
+                        f"Embeddings count mismatch: got={0 if batch_embeddings is None else len(batch_embeddings)}, "
+                        f"expect={len(batch_texts)}"
+                    )
 
-            # 2) 生成 embeddings（分小批防止超时/限流）
-            batch_embeddings: List[List[float]] = []
-            sub_size = 10
-            for j in range(0, len(batch_texts), sub_size):
-                sub_texts = batch_texts[j:j + sub_size]
-                try:
-                    sub_embs = await bailian_client.create_embeddings(sub_texts)
-                except Exception as e:
-                    raise RuntimeError(f"Embedding sub-batch failed at {j // sub_size + 1}: {e}")
-                if not sub_embs or len(sub_embs) != len(sub_texts):
+                # 一致性校验
+                if not (len(batch_ids) == len(batch_texts) == len(batch_metadatas) == len(batch_embeddings)):
                     raise RuntimeError(
-                        f"Embeddings count mismatch: got={len(sub_embs) if sub_embs else 0}, "
-                        f"expect={len(sub_texts)}"
+                        "Batch arrays length mismatch before collection.add: "
+                        f"ids={len(batch_ids)}, docs={len(batch_texts)}, "
+                        f"metas={len(batch_metadatas)}, embs={len(batch_embeddings)}"
                     )
-                batch_embeddings.extend(sub_embs)
-
-            # 3) 一致性校验
-            if not (len(batch_ids) == len(batch_texts) == len(batch_metadatas) == len(batch_embeddings)):
-                raise RuntimeError(
-                    "Batch arrays length mismatch before collection.add: "
-                    f"ids={len(batch_ids)}, docs={len(batch_texts)}, "
-                    f"metas={len(batch_metadatas)}, embs={len(batch_embeddings)}"
+
+                all_ids.extend(batch_ids)
+                pending_ids.update(batch_ids[j] for j in np.flatnonzero(failed))
+                ok = np.flatnonzero(~failed)
+                if not len(ok):
+                    logger.warning(f"Batch {batch_no}: all {len(batch_ids)} embeddings failed, deferred")
+                    continue
+                await queue.put((batch_no, len(batch_ids), {
+                    "ids": [batch_ids[j] for j in ok],
+                    "documents": [batch_texts[j] for j in ok],
+                    "metadatas": [batch_metadatas[j] for j in ok],
+                    # (N, d) float32 矩阵，Chroma 直接接受，无需 tolist()
+                    "embeddings": batch_embeddings[ok],
+                }))
+            await queue.put(None)
+
+        async def consume():
+            nonlocal written
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                batch_no, total, payload = item
+                # 仅在准备完毕后调用一次 add/upsert（绝不传空列表）；按 id 幂等，句柄过期重试不会重复写入。
+                # 写入在线程池中执行，不阻塞事件循环，期间生产者继续嵌入下一批
+                await self.acall_collection(
+                    collection_name,
+                    lambda collection: (collection.upsert if upsert else collection.add)(**payload),
+                    metadata=collection_meta,
+                    timeout=settings.CHROMA_WRITE_TIMEOUT
+                )
+                written += len(payload["ids"])
+                deferred = total - len(payload["ids"])
+                logger.info(
+                    f"Added batch {batch_no}: {len(payload['ids'])} documents"
+                    + (f", {deferred} deferred" if deferred else "")
                 )
 
-            # 4) 仅在准备完毕后调用一次 add（绝不传空列表）
-            collection.add(
-                ids=batch_ids,
-                documents=batch_texts,
-                metadatas=batch_metadatas,
-                embeddings=batch_embeddings,
-            )
-            all_ids.extend(batch_ids)
-            logger.info(f"Added batch {i // batch_size + 1}: {len(batch_ids)} documents")
-        logger.info(f"Added {len(all_ids)} documents to collection {collection_name}")
-        return all_ids
+        producer = asyncio.ensure_future(produce())
+        consumer = asyncio.ensure_future(consume())
+        try:
+            # 任一侧出错立即取消另一侧：生产者失败时消费者不会永远等待，消费者失败时生产者不会卡在满队列上
+            done, _ = await asyncio.wait({producer, consumer}, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+            await asyncio.gather(producer, consumer)
+        finally:
+            for task in (producer, consumer):
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(producer, consumer, return_exceptions=True)
+
+        logger.info(
+            f"Added {written} documents to collection {collection_name}"
+            f" ({len(pending_ids)} pending embedding)"
+        )
+        return all_ids, pending_ids
 
 
 # 统一的向量存储管理器
@@ -311,61 +461,237 @@ class VectorStoreManager:
         self,
         collection_name: str,
         query: str,
-        n_results: int = 5
+        n_results: int = 5,
+        knowledge_base_id: Optional[int] = None,
+        retrieval_config: Optional[Dict] = None,
+        filters: Optional[Dict[str, Any]] = None
     ) -> List[Dict]:
         """
         在指定集合中检索，返回 [{content, source_file, file_type, id, score, metadata, file_id, vector_id}, ...]
+        传入 knowledge_base_id 时做混合检索：向量结果与 BM25 结果按 RRF 融合
+        （权重等取自 retrieval_config["hybrid"]），此时 score 为归一化到 [0, 1] 的融合分
+        filters 见 search_filters：转成 where 下推到 Chroma，BM25 路径在进程内做同样的过滤
+        retrieval_config["mmr"] 启用时先取 n_results * fetch_factor 个候选，再按 MMR 挑出多样的 n_results 个
+        retrieval_config["rerank"] 启用时在放大的候选集上重排（见 reranker）；与 MMR 同时启用时
+        先重排，再从重排后的前 n_results * MMR fetch_factor 个里做 MMR
+        结果按 (集合, 问题, n_results, 过滤条件与配置) 缓存，集合写入后失效（见 retrieval_cache）
         """
-        from app.services.bailian_client import bailian_client
         try:
-            # 1) 拿到/创建集合（带非空 metadata）
-            collection = self.vector_store.get_or_create_collection(
-                collection_name,
-                metadata={"purpose": "search"}
-            )
+            cache_key = version = query_embedding = None
+            if retrieval_cache is not None:
+                cache_key = retrieval_cache.make_key(
+                    collection_name, query, n_results, filters, retrieval_config, knowledge_base_id
+                )
+                version = retrieval_cache.version(collection_name)
+                cached = retrieval_cache.get(cache_key)
+                if cached is None and retrieval_cache.semantic:
+                    # 换个说法的同一问题：比较查询向量；向量留给下面的检索复用
+                    query_embedding = await embedding_provider.embed_query(query)
+                    cached = retrieval_cache.get_similar(cache_key, query_embedding)
+                if cached is not None:
+                    return cached
+
+            where = build_where_clause(filters)
+            hybrid = hybrid_config(retrieval_config)
+            mmr = mmr_config(retrieval_config)
+            rerank = rerank_config(retrieval_config)
+            mmr_pool = n_results * max(1, int(mmr["fetch_factor"])) if mmr["enabled"] else n_results
+            rerank_pool = n_results * max(1, int(rerank["fetch_factor"])) if rerank["enabled"] else n_results
+            fetch = max(mmr_pool, rerank_pool)
+
+            if knowledge_base_id is None or not hybrid["enabled"]:
+                hits, emb = await self._vector_search(
+                    collection_name, query, fetch, where, with_embeddings=mmr["enabled"],
+                    query_embedding=query_embedding
+                )
+            else:
+                hits, emb = await self._hybrid_search(
+                    collection_name, query, fetch, knowledge_base_id, hybrid, where, mmr["enabled"],
+                    query_embedding
+                )
 
-            # 2) 生成查询向量
-            emb = (await bailian_client.create_embeddings(query))[0]
+            if rerank["enabled"] and len(hits) > 1:
+                hits = (await rerank_stage.rerank(query, hits, rerank))[:mmr_pool]
+            if mmr["enabled"] and len(hits) > n_results:
+                hits = await self._diversify(collection_name, hits, emb, n_results, float(mmr["lambda"]))
+            # 内部字段不外传（检索结果会原样写入消息记录）
+            results = [{k: v for k, v in hit.items() if k != "_embedding"} for hit in hits[:n_results]]
+            if cache_key is not None:
+                retrieval_cache.put(cache_key, results, version, emb)
+            return results
+        except CircuitOpenError:
+            # 嵌入服务熔断：交给接口层返回 503，而不是当作“没检索到内容”继续回答
+            raise
+        except Exception as e:
+            logger.error(f"search_knowledge_base error on collection={collection_name}: {e}")
+            return []
 
-            # 3) 查询（包含需要的字段，新增 ids）
-            res = collection.query(
-                query_embeddings=[emb],
-                n_results=max(1, n_results),
-                include=["documents", "metadatas", "distances"]  
-            )
+    async def _hybrid_search(
+        self,
+        collection_name: str,
+        query: str,
+        n_results: int,
+        knowledge_base_id: int,
+        hybrid: Dict,
+        where: Optional[Dict[str, Any]],
+        with_embeddings: bool,
+        query_embedding: Optional[np.ndarray] = None
+    ) -> Tuple[List[Dict], np.ndarray]:
+        candidates = max(n_results, int(hybrid["candidates"]))
+        # 向量召回与 BM25 索引（首次使用时读库构建）并行
+        (vector_hits, emb), index = await asyncio.gather(
+            self._vector_search(collection_name, query, candidates, where, with_embeddings, query_embedding),
+            lexical_index_manager.ensure_loaded(collection_name, knowledge_base_id)
+        )
+        if where:
+            # 先多取再过滤，尽量保证过滤后仍有 candidates 条
+            lexical_hits = [
+                (vid, score) for vid, score in index.search(query, candidates * 5)
+                if matches_where(self._lexical_metadata(index.payload(vid)), where)
+            ][:candidates]
+        else:
+            lexical_hits = index.search(query, candidates)
+        return self._fuse(vector_hits, lexical_hits, index, hybrid, n_results), emb
 
-            ids = (res.get("ids") or [[]])[0]
-            docs = (res.get("documents") or [[]])[0]
-            metas = (res.get("metadatas") or [[]])[0]
-            dists = (res.get("distances") or [[]])[0]
+    async def _diversify(
+        self,
+        collection_name: str,
+        hits: List[Dict],
+        query_embedding: np.ndarray,
+        k: int,
+        lambda_mult: float
+    ) -> List[Dict]:
+        """MMR 重排；只有 BM25 命中、没带向量的候选按 vector_id 从集合里补取向量，取不到的放到最后"""
+        missing = [h["vector_id"] for h in hits if h.get("_embedding") is None and h.get("vector_id")]
+        if missing:
+            got = await self.vector_store.acall_collection(
+                collection_name,
+                lambda collection: collection.get(ids=missing, include=["embeddings"]),
+                timeout=settings.CHROMA_QUERY_TIMEOUT
+            )
+            fetched = dict(zip(got.get("ids") or [], got.get("embeddings") if got.get("embeddings") is not None else []))
+            for hit in hits:
+                if hit.get("_embedding") is None and hit.get("vector_id") in fetched:
+                    hit["_embedding"] = np.asarray(fetched[hit["vector_id"]], dtype=np.float32)
+
+        usable = [h for h in hits if h.get("_embedding") is not None]
+        rest = [h for h in hits if h.get("_embedding") is None]
+        if len(usable) <= 1:
+            return hits
+        order = mmr_select(query_embedding, np.stack([h["_embedding"] for h in usable]), k, lambda_mult)
+        return [usable[i] for i in order] + rest
+
+    @staticmethod
+    def _lexical_metadata(payload: Optional[Dict]) -> Dict:
+        """BM25 索引条目的元数据，补上与 Chroma 元数据同名的过滤字段"""
+        payload = payload or {}
+        md = dict(payload.get("metadata") or {})
+        md["file_id"] = safe_convert_id(payload.get("file_id"))
+        md.setdefault("created_ts", payload.get("created_ts"))
+        return md
+
+    async def _vector_search(
+        self,
+        collection_name: str,
+        query: str,
+        n_results: int,
+        where: Optional[Dict[str, Any]] = None,
+        with_embeddings: bool = False,
+        query_embedding: Optional[np.ndarray] = None
+    ) -> Tuple[List[Dict], np.ndarray]:
+        """向量召回，返回 (结果, 查询向量)；with_embeddings 时每条结果带 _embedding 供 MMR 使用"""
+        # 1) 生成查询向量（与并发请求的查询合批）；调用方已算过时直接用
+        emb = query_embedding if query_embedding is not None else await embedding_provider.embed_query(query)
+
+        # 2) 用缓存的集合句柄查询（包含需要的字段，新增 ids）；首次访问时才创建集合。
+        #    过滤条件下推到 Chroma，ANN 只在满足条件的块里找
+        query_kwargs = {"where": where} if where else {}
+        res = await self.vector_store.acall_collection(
+            collection_name,
+            lambda collection: collection.query(
+                query_embeddings=emb[None, :],
+                n_results=max(1, n_results),
+                include=["documents", "metadatas", "distances"] + (["embeddings"] if with_embeddings else []),
+                **query_kwargs
+            ),
+            metadata={"purpose": "search"},
+            timeout=settings.CHROMA_QUERY_TIMEOUT
+        )
 
-            out = []
-            for i, content in enumerate(docs):
-                md = metas[i] or {}
-                vid = ids[i] if i < len(ids) else None
+        ids = (res.get("ids") or [[]])[0]
+        docs = (res.get("documents") or [[]])[0]
+        metas = (res.get("metadatas") or [[]])[0]
+        dists = (res.get("distances") or [[]])[0]
+        embeddings = (res.get("embeddings") if res.get("embeddings") is not None else [[]])[0] if with_embeddings else None
 
-                # 距离 -> 简易得分（越小越好）
-                score = None
-                try:
-                    d = float(dists[i])
-                    score = 1.0 / (1.0 + d)
-                except Exception:
-                    pass
+        out = []
+        for i, content in enumerate(docs):
+            md = metas[i] or {}
+            vid = ids[i] if i < len(ids) else None
 
-                out.append({
-                    "content": content,
+            # 距离 -> 简易得分（越小越好）
+            score = None
+            try:
+                d = float(dists[i])
+                score = 1.0 / (1.0 + d)
+            except Exception:
+                pass
+
+            hit = {
+                "content": content,
+                "source_file": md.get("source_file") or md.get("file_name"),
+                "file_type": md.get("file_type"),
+                "id": md.get("chunk_id") or md.get("id"),
+                "score": score,
+                "metadata": md,
+                "file_id": md.get("file_id"),
+                "vector_id": md.get("vector_id") or vid  # 用 metadata 回传 vector_id
+            }
+            if embeddings is not None and i < len(embeddings):
+                hit["_embedding"] = np.asarray(embeddings[i], dtype=np.float32)
+            out.append(hit)
+        return out, emb
+
+    @staticmethod
+    def _fuse(
+        vector_hits: List[Dict],
+        lexical_hits: List[Tuple[str, float]],
+        index: BM25Index,
+        hybrid: Dict,
+        n_results: int
+    ) -> List[Dict]:
+        """RRF 融合两路结果；只有 BM25 命中的块用索引里保存的内容/元数据补全"""
+        by_id = {hit["vector_id"]: hit for hit in vector_hits if hit.get("vector_id")}
+        bm25_scores = dict(lexical_hits)
+        vector_weight = float(hybrid["vector_weight"])
+        bm25_weight = float(hybrid["bm25_weight"])
+        k = int(hybrid["rrf_k"])
+        fused = reciprocal_rank_fusion(
+            [(list(by_id), vector_weight), ([vid for vid, _ in lexical_hits], bm25_weight)],
+            k=k
+        )
+        # 两路都排第一时的融合分，用来把 score 归一化到 [0, 1]
+        best = (max(vector_weight, 0.0) + max(bm25_weight, 0.0)) / (k + 1) or 1.0
+
+        out = []
+        for vid, rrf in fused[:n_results]:
+            hit = by_id.get(vid)
+            if hit is None:
+                payload = index.payload(vid) or {}
+                md = payload.get("metadata") or {}
+                hit = {
+                    "content": payload.get("content"),
                     "source_file": md.get("source_file") or md.get("file_name"),
                     "file_type": md.get("file_type"),
-                    "id": md.get("chunk_id") or md.get("id"),
-                    "score": score,
+                    "id": payload.get("chunk_id"),
                     "metadata": md,
-                    "file_id": md.get("file_id"),
-                    "vector_id": md.get("vector_id")  # 用 metadata 回传 vector_id
-                })
-            return out
-        except Exception as e:
-            logger.error(f"search_knowledge_base error on collection={collection_name}: {e}")
-            return []
+                    "file_id": payload.get("file_id"),
+                    "vector_id": vid
+                }
+            hit = dict(hit, vector_score=hit.get("score"), bm25_score=bm25_scores.get(vid))
+            hit["score"] = round(rrf / best, 6)
+            out.append(hit)
+        return out
 
 
     ## 创建知识库集合，不需要异步处理
@@ -378,21 +704,32 @@ class VectorStoreManager:
         meta = {
             "kb_name": name,
             "description": description or "",
-            "created_at": datetime.now().isoformat()
+            "created_at": datetime.now().isoformat(),
+            # 记录集合所在的向量空间，便于切换嵌入后端/模型时发现不一致
+            "embedding_space": embedding_provider.space
         }
-        # 直接确保集合存在（幂等）
-        self.vector_store.get_or_create_collection(collection_name, metadata=meta)
+        if embedding_provider.dimension:
+            meta["embedding_dimensions"] = embedding_provider.dimension
+        # 直接确保集合存在（幂等），并放进句柄缓存
+        self.vector_store.invalidate_collection(collection_name)
+        await self.vector_store.run_sync(
+            self.vector_store.get_collection_handle, collection_name, meta,
+            timeout=settings.CHROMA_WRITE_TIMEOUT
+        )
         logger.info(f"Ensured Chroma collection exists: {collection_name}")
         return True
 
-    ## 删除知识库，不需要异步处理
-    def delete_knowledge_base_collection(self, collection_name: str) -> bool:
-        ok = self.vector_store.delete_collection(collection_name)
+    ## 删除知识库集合（在 Chroma 线程池中执行，不阻塞事件循环）
+    async def delete_knowledge_base_collection(self, collection_name: str) -> bool:
+        ok = await self.vector_store.adelete_collection(collection_name)
+        lexical_index_manager.drop(collection_name)
+        if retrieval_cache is not None:
+            retrieval_cache.bump(collection_name)
         logger.info(f"Deleted Chroma collection (if exists): {collection_name}")
         return ok
 
-    def __init__(self):
-        self.vector_store = ChromaVectorStore()
+    def __init__(self, vector_store: Optional[ChromaVectorStore] = None):
+        self.vector_store = vector_store or ChromaVectorStore()
 
     async def add_document_chunks(
         self,
@@ -403,87 +740,108 @@ class VectorStoreManager:
         """
         添加文档块到向量库（全量批处理 + 1:1 对齐返回）
         """
+        ids, _ = await self.add_document_chunks_with_pending(collection_name, chunks, batch_size)
+        return ids
+
+    def _build_document(self, chunk: Dict, idx: int, doc_id: Optional[str] = None) -> Dict:
+        """把一个 chunk 转成写入 Chroma 的 {id, content, metadata}；doc_id 用于补齐时沿用原 vector_id"""
+        # —— 原有逻辑：构造元数据 ——
+        raw_meta = chunk.get("metadata") or {}
+
+        chunk_id = safe_convert_id(chunk.get("id"))
+        file_id = safe_convert_id(chunk.get("file_id"))
+        knowledge_base_id = safe_convert_id(chunk.get("knowledge_base_id"))
+
+        doc_metadata = {
+            "chunk_id": chunk_id,
+            "file_id": file_id,
+            "knowledge_base_id": knowledge_base_id,
+            # 注意：尽量把 chunk_index 放进 metadata，后续召回时可定位
+            "chunk_index": chunk.get("chunk_index", raw_meta.get("chunk_index", idx)),
+            "source_file": raw_meta.get("source_file"),
+            "file_type": raw_meta.get("file_type"),
+            "content_type": raw_meta.get("content_type"),
+            "keywords": raw_meta.get("keywords", ""),
+            "page_number": raw_meta.get("page_number"),
+            "section_title": raw_meta.get("section_title"),
+            "created_at": datetime.now().isoformat(),
+            # 数值时间戳：Chroma where 的 $gte/$lte 只支持数值，按时间过滤用它
+            "created_ts": int(time.time())
+        }
 
-        # 1) 预构建 documents
-        documents: List[Dict] = []
-        for idx, chunk in enumerate(chunks):
-            # —— 原有逻辑：构造元数据 ——
-            raw_meta = chunk.get("metadata") or {}
+        # 附加未覆盖的元数据字段
+        for k, v in raw_meta.items():
+            if k not in doc_metadata:
+                doc_metadata[k] = v
 
-            chunk_id = safe_convert_id(chunk.get("id"))
-            file_id = safe_convert_id(chunk.get("file_id"))
-            knowledge_base_id = safe_convert_id(chunk.get("knowledge_base_id"))
+        # —— 在 metadata 里写入 vector_id（= 我们即将作为 Chroma 文档 id 传入的值） ——
+        doc_id = doc_id or str(uuid.uuid4())
+        doc_metadata["vector_id"] = doc_id
 
+        # —— 兜底：Chroma 禁止空 metadata，这里双保险 ——
+        if not doc_metadata:
             doc_metadata = {
-                "chunk_id": chunk_id,
-                "file_id": file_id,
-                "knowledge_base_id": knowledge_base_id,
-                # 注意：尽量把 chunk_index 放进 metadata，后续召回时可定位
-                "chunk_index": chunk.get("chunk_index", raw_meta.get("chunk_index", idx)),
-                "source_file": raw_meta.get("source_file"),
-                "file_type": raw_meta.get("file_type"),
-                "content_type": raw_meta.get("content_type"),
-                "keywords": raw_meta.get("keywords", ""),
-                "page_number": raw_meta.get("page_number"),
-                "section_title": raw_meta.get("section_title"),
+                "default_metadata": "true",
                 "created_at": datetime.now().isoformat()
             }
 
-            # 附加未覆盖的元数据字段
-            for k, v in raw_meta.items():
-                if k not in doc_metadata:
-                    doc_metadata[k] = v
+        cleaned_metadata = clean_metadata(doc_metadata)
 
-            # —— 在 metadata 里写入 vector_id（= 我们即将作为 Chroma 文档 id 传入的值） ——
-            doc_id = str(uuid.uuid4())
-            doc_metadata["vector_id"] = doc_id
-
-            # —— 兜底：Chroma 禁止空 metadata，这里双保险 ——
-            if not doc_metadata:
-                doc_metadata = {
-                    "default_metadata": "true",
-                    "created_at": datetime.now().isoformat()
-                }
+        # 限制 content 的 token 数，防止超过嵌入接口的单条上限
+        content = clip_tokens(chunk.get("content", "") or "", settings.BAILIAN_EMBEDDING_MAX_INPUT_TOKENS)
+        cleaned_metadata["token_count"] = count_tokens(content)
 
-            cleaned_metadata = clean_metadata(doc_metadata)
-
-            # 限制 content 长度，防止超长
-            SAFE_MAX_CHARS = 6000
+        return {
+            "id": doc_id,                              # 用上面生成的 doc_id
+            "content": content,
+            "metadata": cleaned_metadata
+        }
 
-            def _clip(txt: str, max_chars: int = SAFE_MAX_CHARS) -> str:
-                if not txt:
-                    return ""
-                return txt if len(txt) <= max_chars else txt[:max_chars]
+    async def add_document_chunks_with_pending(
+        self,
+        collection_name: str,
+        chunks: List[Dict],
+        batch_size: int = 64,
+        upsert: bool = False
+    ) -> Tuple[List[str], Set[str]]:
+        """
+        添加文档块到向量库，返回 (与 chunks 1:1 对齐的 vector_id, 嵌入失败待补齐的 vector_id 集合)
+        - chunk 带 vector_id 时沿用（补齐场景），否则新生成
+        """
 
-            documents.append({
-                "id": doc_id,                              # 用上面生成的 doc_id
-                "content": _clip(chunk.get("content", "") or ""),
-                "metadata": cleaned_metadata
-            })
+        # 1) 预构建 documents
+        documents: List[Dict] = [
+            self._build_document(chunk, idx, chunk.get("vector_id"))
+            for idx, chunk in enumerate(chunks)
+        ]
 
-        # 2) 批量写入：保证“全量输入 -> 全量ID输出”
-        all_ids: List[str] = []
-        for start in range(0, len(documents), batch_size):
-            batch = documents[start:start + batch_size]
-            # 这里沿用你现有的底层实现；务必确保它对一个 batch 返回等长的 id 列表
-            ids = await self.vector_store.add_documents(collection_name, batch)
-            if not ids or len(ids) != len(batch):
-                raise RuntimeError(
-                    f"Vector store returned invalid ids: got {0 if not ids else len(ids)} vs expected {len(batch)}"
-                )
-            all_ids.extend(ids)
+        # 2) 整个文件交给底层流水线分批写入（嵌入与写入重叠）；保证“全量输入 -> 全量ID输出”
+        try:
+            all_ids, pending_ids = await self.vector_store.add_documents_with_pending(
+                collection_name, documents, batch_size=batch_size, upsert=upsert
+            )
+        finally:
+            # 失败时也可能已写入部分批次，一律作废该集合的检索缓存
+            if retrieval_cache is not None:
+                retrieval_cache.bump(collection_name)
 
-        # 最终返回列表长度必须与输入 chunks 相等
+        # 最终返回列表长度必须与输入 chunks 相等，且逐位对齐
         if len(all_ids) != len(chunks):
             raise RuntimeError(
                 f"Vectorization size mismatch: ids={len(all_ids)} vs chunks={len(chunks)}"
             )
+        if all_ids != [doc["id"] for doc in documents]:
+            raise RuntimeError("Vectorization id order mismatch between chunks and vector store")
 
-        return all_ids
+        return all_ids, pending_ids
 
 
-# 根据可用性选择向量存储实现
-if CHROMADB_AVAILABLE:
+# 根据配置与可用性选择向量存储实现
+if settings.VECTOR_STORE_BACKEND == "numpy":
+    # 进程内 NumPy 向量库（memmap 持久化），不需要 Chroma 服务
+    from app.services.numpy_vector_store import NumpyVectorStore
+    vector_store_manager = VectorStoreManager(NumpyVectorStore())
+elif CHROMADB_AVAILABLE:
     # 使用真实的ChromaDB实现
     vector_store_manager = VectorStoreManager()
     logger.info("Using ChromaDB vector store")
@@ -5,7 +5,7 @@
 
 import uuid
 import json
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Set, Tuple
 from loguru import logger
 
 
@@ -200,15 +200,28 @@ class MockVectorStoreManager:
 
         return await self.vector_store.add_documents(collection_name, documents)
 
+    async def add_document_chunks_with_pending(
+        self,
+        collection_name: str,
+        chunks: List[Dict],
+        batch_size: int = 64,
+        upsert: bool = False
+    ) -> Tuple[List[str], Set[str]]:
+        """添加文档块到向量库；模拟实现不会嵌入失败，待补齐集合恒为空"""
+        return await self.add_document_chunks(collection_name, chunks), set()
+
     async def search_knowledge_base(
         self,
         collection_name: str,
         query: str,
         n_results: int = 5,
         file_filters: Optional[List[str]] = None,
-        content_type_filters: Optional[List[str]] = None
+        content_type_filters: Optional[List[str]] = None,
+        knowledge_base_id: Optional[int] = None,
+        retrieval_config: Optional[Dict] = None,
+        filters: Optional[Dict] = None
     ) -> List[Dict]:
-        """在知识库中搜索"""
+        """在知识库中搜索（模拟实现只做向量检索，忽略混合检索与过滤参数）"""
         results = await self.vector_store.search_similar(
             collection_name=collection_name,
             query_text=query,
@@ -231,7 +244,7 @@ class MockVectorStoreManager:
 
         return formatted_results
 
-    def delete_knowledge_base_collection(self, collection_name: str) -> bool:
+    async def delete_knowledge_base_collection(self, collection_name: str) -> bool:
         """删除知识库集合"""
         return self.vector_store.delete_collection(collection_name)
 
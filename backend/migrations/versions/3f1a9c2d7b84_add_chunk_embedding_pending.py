@@ -0,0 +1,28 @@
+"""Add embedding pending flags to document chunks
+
+Revision ID: 3f1a9c2d7b84
+Revises: 708a0e262c72
+Create Date: 2026-10-16 10:12:04.511203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a9c2d7b84'
+down_revision = '708a0e262c72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('document_chunks', sa.Column('embedding_pending', sa.Boolean(), server_default=sa.false(), nullable=True, comment='嵌入失败、等待后台补齐'))
+    op.add_column('document_chunks', sa.Column('embedding_attempts', sa.Integer(), server_default='0', nullable=True, comment='补齐嵌入的失败次数'))
+    op.create_index(op.f('ix_document_chunks_embedding_pending'), 'document_chunks', ['embedding_pending'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_document_chunks_embedding_pending'), table_name='document_chunks')
+    op.drop_column('document_chunks', 'embedding_attempts')
+    op.drop_column('document_chunks', 'embedding_pending')
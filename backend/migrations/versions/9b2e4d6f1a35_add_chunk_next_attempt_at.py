@@ -0,0 +1,26 @@
+"""Add next embedding attempt time to document chunks
+
+Revision ID: 9b2e4d6f1a35
+Revises: 3f1a9c2d7b84
+Create Date: 2026-10-16 15:40:18.220917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2e4d6f1a35'
+down_revision = '3f1a9c2d7b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('document_chunks', sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=True, comment='下次补齐嵌入的时间（退避）'))
+    op.create_index(op.f('ix_document_chunks_next_attempt_at'), 'document_chunks', ['next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_document_chunks_next_attempt_at'), table_name='document_chunks')
+    op.drop_column('document_chunks', 'next_attempt_at')
@@ -0,0 +1,5 @@
+import os
+
+# 测试不落盘：嵌入缓存与模型表的持久化路径默认指向工作目录下的 ./cache
+os.environ.setdefault("EMBEDDING_CACHE_ENABLED", "false")
+os.environ.setdefault("MODEL_REGISTRY_PATH", "")
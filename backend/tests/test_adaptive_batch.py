@@ -0,0 +1,33 @@
+from app.services.adaptive_batch import AdaptiveBatchController
+from app.services.bailian_client import BailianClient
+
+
+def test_ceiling_seeded_from_model_and_recovers():
+    """测试批大小从模型上限起步，批过大后上限收紧，满批连续成功后再恢复"""
+    controller = AdaptiveBatchController(step=2, grow_after=1, recover_after=3)
+    controller.configure("m", 10)
+    assert controller.current("m") == 10
+
+    controller.on_too_large("m", 10)
+    assert controller.stats()["m"]["ceiling"] == 9
+    assert controller.current("m") == 5
+
+    for _ in range(20):
+        controller.on_success("m", controller.current("m"))
+    state = controller.stats()["m"]
+    assert state["ceiling"] == 10 and state["batch_size"] == 10 and state["recoveries"] == 1
+
+    controller.on_too_large("m", 10, allowed=6)
+    for _ in range(50):
+        controller.on_success("m", controller.current("m"))
+    assert controller.stats()["m"]["ceiling"] == 6
+
+
+def test_only_batch_size_errors_count_as_too_large():
+    """测试只有批大小类错误触发二分，单条输入过长的 400 不算"""
+    assert BailianClient._batch_too_large(413, "") == (True, None)
+    assert BailianClient._batch_too_large(
+        400, "Value error, batch size is invalid, it should not be larger than 10."
+    ) == (True, 10)
+    assert BailianClient._batch_too_large(400, "Range of input length should be [1, 8192]") == (False, None)
+    assert BailianClient._batch_too_large(500, "batch size") == (False, None)
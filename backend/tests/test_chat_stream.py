@@ -0,0 +1,37 @@
+from app.services.chat_stream import SSEParser, StreamLatencyStats, StreamTimer
+
+
+def test_sse_parser_handles_arbitrary_chunk_boundaries():
+    """测试事件跨字节块、CRLF、注释与多行 data"""
+    stream = (
+        b": keep-alive\r\n\r\n"
+        b'data: {"a": 1}\r\n\r\n'
+        b"event: message\ndata: line1\ndata: line2\n\n"
+        b"data: [DONE]\n\n"
+    )
+    parser = SSEParser()
+    events = []
+    for i in range(0, len(stream), 3):
+        events.extend(parser.feed(stream[i:i + 3]))
+    events.extend(parser.flush())
+
+    assert events == [b'{"a": 1}', b"line1\nline2", b"[DONE]"]
+
+
+def test_stream_timer_records_ttft_and_throughput():
+    """测试单次请求的 TTFT/token 统计进入汇总"""
+    timer = StreamTimer()
+    for _ in range(3):
+        timer.on_token()
+
+    summary = timer.summary()
+    assert summary["tokens"] == 3
+    assert summary["ttft_ms"] is not None
+
+    stats = StreamLatencyStats()
+    stats.record(timer)
+    stats.record(StreamTimer())
+    result = stats.stats()
+    assert result["requests"] == 2
+    assert result["no_token"] == 1
+    assert result["ttft_ms"]["p50"] >= 0
@@ -0,0 +1,43 @@
+import numpy as np
+
+from app.services.embedding_cache import EmbeddingCache, cache_key
+
+
+def test_cache_key_normalizes_whitespace():
+    """测试空白/全角差异命中同一缓存键"""
+    assert cache_key("m", "  hello   world ") == cache_key("m", "hello world")
+    assert cache_key("m", "ＡＢＣ") == cache_key("m", "ABC")
+    assert cache_key("m1", "abc") != cache_key("m2", "abc")
+
+
+def test_memory_lru_eviction():
+    """测试内存层按 LRU 淘汰"""
+    cache = EmbeddingCache(max_memory_items=2)
+    cache.put_many("m", ["a", "b"], [np.array([1.0]), np.array([2.0])])
+    cache.get_many("m", ["a"])                     # a 变为最近使用
+    cache.put_many("m", ["c"], [np.array([3.0])])  # 淘汰 b
+
+    result = cache.get_many("m", ["a", "b", "c"])
+    assert result[0].tolist() == [1.0]
+    assert result[1] is None
+    assert result[2].tolist() == [3.0]
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    """测试 SQLite 持久层跨实例命中并统计"""
+    db_path = str(tmp_path / "emb.sqlite3")
+    cache = EmbeddingCache(max_memory_items=10, db_path=db_path)
+    assert not (tmp_path / "emb.sqlite3").exists()  # 首次读写时才建库
+    cache.put_many("m", ["alpha"], [np.array([0.5, 0.25])])
+    cache.close()
+
+    reopened = EmbeddingCache(max_memory_items=10, db_path=db_path)
+    result = reopened.get_many("m", ["alpha", "beta"])
+    assert result[0].dtype == np.float32
+    assert result[0].tolist() == [0.5, 0.25]
+    assert result[1] is None
+
+    stats = reopened.stats()
+    assert stats["disk_hits"] == 1
+    assert stats["misses"] == 1
+    reopened.close()
@@ -0,0 +1,45 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.services.embedding_coalescer import EmbeddingCoalescer
+
+
+class _FakeEmbedder:
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.fail = fail
+
+    async def __call__(self, texts):
+        self.calls.append(list(texts))
+        if self.fail:
+            raise RuntimeError("boom")
+        return np.array([[float(len(t))] for t in texts], dtype=np.float32)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_queries_share_one_request():
+    """测试窗口内的并发查询合成一次请求，并按调用方分发结果"""
+    embedder = _FakeEmbedder()
+    coalescer = EmbeddingCoalescer(embedder, window_ms=20, max_batch=32)
+
+    results = await asyncio.gather(*(coalescer.embed(q) for q in ["a", "bb", "a", "ccc"]))
+
+    assert embedder.calls == [["a", "bb", "ccc"]]
+    assert [r.tolist() for r in results] == [[1.0], [2.0], [1.0], [3.0]]
+
+
+@pytest.mark.asyncio
+async def test_max_batch_flushes_early_and_errors_propagate():
+    """测试攒满即发，批失败时每个调用方都收到异常"""
+    embedder = _FakeEmbedder(fail=True)
+    coalescer = EmbeddingCoalescer(embedder, window_ms=10_000, max_batch=2)
+
+    results = await asyncio.wait_for(
+        asyncio.gather(coalescer.embed("x"), coalescer.embed("y"), return_exceptions=True),
+        timeout=1
+    )
+
+    assert embedder.calls == [["x", "y"]]
+    assert all(isinstance(r, RuntimeError) for r in results)
@@ -0,0 +1,63 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.services.embedding_provider import (
+    EmbeddingProvider,
+    FallbackEmbeddingProvider,
+    HashingEmbeddingProvider,
+)
+
+
+@pytest.mark.asyncio
+async def test_hashing_provider_is_deterministic_and_normalized():
+    """测试哈希向量确定、归一化，且相似文本更接近"""
+    provider = HashingEmbeddingProvider(dim=256)
+    vecs = await provider.embed(["知识库检索 test", "知识库检索 test", "完全无关的句子"])
+
+    assert vecs.shape == (3, 256) and vecs.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(vecs, axis=1), 1.0, rtol=1e-5)
+    assert vecs[0] @ vecs[1] > 0.99
+    assert vecs[0] @ vecs[2] < 0.5
+
+
+class _BrokenProvider(EmbeddingProvider):
+    name = "broken"
+    space = "hashing:256"
+
+    async def embed(self, texts):
+        raise RuntimeError("remote down")
+
+
+@pytest.mark.asyncio
+async def test_fallback_requires_same_space_and_recovers():
+    """测试兜底后端只接受同一向量空间，并在主后端失败时接管"""
+    with pytest.raises(ValueError):
+        FallbackEmbeddingProvider(_BrokenProvider(), HashingEmbeddingProvider(dim=64), timeout=1)
+
+    provider = FallbackEmbeddingProvider(_BrokenProvider(), HashingEmbeddingProvider(dim=256), timeout=1)
+    vec = await provider.embed_query("hello")
+    assert vec.shape == (256,)
+    assert provider.stats()["fallbacks"] == 1
+
+
+class _SlowProvider(EmbeddingProvider):
+    name = "slow"
+    space = "hashing:64"
+
+    async def embed(self, texts):
+        await asyncio.sleep(0.05)
+        return np.ones((len(texts), 64), dtype=np.float32)
+
+
+@pytest.mark.asyncio
+async def test_fallback_query_timeout_does_not_apply_to_bulk():
+    """测试短超时只作用于在线查询，批量嵌入不会因为排队耗时被切到兜底后端"""
+    provider = FallbackEmbeddingProvider(_SlowProvider(), HashingEmbeddingProvider(dim=64), timeout=0.01)
+    vectors, failed = await provider.embed_partial(["a", "b"])
+    assert np.all(vectors == 1.0) and not failed.any()
+    assert provider.stats()["fallbacks"] == 0
+
+    await provider.embed_query("a")
+    assert provider.stats()["fallbacks"] == 1
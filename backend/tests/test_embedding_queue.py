@@ -0,0 +1,123 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.services.embedding_queue import EmbeddingFailedError, EmbeddingJobQueue
+from app.services.resilience import BULK, INTERACTIVE
+
+
+class _FlakyEmbedder:
+    """每条文本前 fail_times 次返回失败，之后成功；记录每批的 (优先级, 文本)"""
+
+    def __init__(self, fail_times=None):
+        self.fail_times = dict(fail_times or {})
+        self.batches = []
+
+    async def __call__(self, texts, model, priority):
+        self.batches.append((priority, list(texts)))
+        failed = np.zeros(len(texts), dtype=bool)
+        for i, text in enumerate(texts):
+            if self.fail_times.get(text, 0) > 0:
+                self.fail_times[text] -= 1
+                failed[i] = True
+        vectors = np.array([[float(len(t))] for t in texts], dtype=np.float32)
+        return vectors, failed
+
+
+@pytest.mark.asyncio
+async def test_failed_items_are_requeued_not_zero_filled():
+    """测试批内失败条目重新入队，成功后按原顺序返回"""
+    embedder = _FlakyEmbedder({"bb": 2})
+    queue = EmbeddingJobQueue(embedder, "m", workers=1, retry_delay=0.01)
+    try:
+        result = await queue.embed(["a", "bb", "ccc"])
+        assert result.tolist() == [[1.0], [2.0], [3.0]]
+        assert queue.stats()["requeued"] == 2
+    finally:
+        queue.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_exhausted_retries_raise_and_interactive_goes_first():
+    """测试重试用尽抛错；积压时 interactive 先于 bulk 出队"""
+    embedder = _FlakyEmbedder({"x": 10})
+    queue = EmbeddingJobQueue(embedder, "m", workers=1, max_attempts=2, retry_delay=0.01)
+    try:
+        with pytest.raises(EmbeddingFailedError):
+            await queue.embed(["x"])
+
+        gate = asyncio.Event()
+        original = queue.embed_fn
+
+        async def slow_first(texts, model, priority):
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(gate.wait(), main_loop))
+            return await original(texts, model, priority)
+
+        main_loop = asyncio.get_running_loop()
+        queue.embed_fn = slow_first
+        embedder.batches.clear()
+        first = asyncio.ensure_future(queue.embed(["warm"], priority=BULK))
+        await asyncio.sleep(0.05)
+        bulk = asyncio.ensure_future(queue.embed(["b1", "b2"], priority=BULK))
+        interactive = asyncio.ensure_future(queue.embed(["q"], priority=INTERACTIVE))
+        await asyncio.sleep(0.05)
+        gate.set()
+        await asyncio.gather(first, bulk, interactive)
+
+        assert [p for p, _ in embedder.batches] == [BULK, INTERACTIVE, BULK]
+    finally:
+        queue.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_interactive_does_not_wait_behind_slow_bulk_batch():
+    """测试 bulk 批次占满通用调度协程时，查询由专用调度协程立即发出"""
+    embedder = _FlakyEmbedder()
+
+    async def slow_bulk(texts, model, priority):
+        if priority == BULK:
+            await asyncio.sleep(1.0)
+        return await embedder(texts, model, priority)
+
+    queue = EmbeddingJobQueue(slow_bulk, "m", workers=1, max_batch=2, retry_delay=0.01)
+    try:
+        bulk = asyncio.ensure_future(queue.embed(["b1", "b2", "b3", "b4"], priority=BULK))
+        await asyncio.sleep(0.05)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await queue.embed(["q"], priority=INTERACTIVE)
+        assert result.tolist() == [[1.0]]
+        assert loop.time() - started < 0.5
+        assert not bulk.done()
+        await bulk
+    finally:
+        queue.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_embed_partial_marks_failed_rows_instead_of_raising():
+    """测试 embed_partial 不整组抛错：失败行为 NaN 并在掩码中标出"""
+    embedder = _FlakyEmbedder({"bad": 10})
+    queue = EmbeddingJobQueue(embedder, "m", workers=1, max_attempts=2, retry_delay=0.01)
+    try:
+        vectors, failed = await queue.embed_partial(["ok", "bad", "fine"])
+        assert failed.tolist() == [False, True, False]
+        assert vectors[0].tolist() == [2.0] and vectors[2].tolist() == [4.0]
+        assert np.isnan(vectors[1]).all()
+    finally:
+        queue.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_shutdown_fails_jobs_waiting_for_retry():
+    """测试停止时退避中的条目以异常结束，而不是让调用方一直等待"""
+    queue = EmbeddingJobQueue(_FlakyEmbedder({"slow": 10}), "m", workers=1, retry_delay=30.0)
+    future = queue.submit(["slow"])[0]
+    for _ in range(100):
+        if queue.stats()["requeued"]:
+            break
+        await asyncio.sleep(0.01)
+    queue.shutdown()
+    with pytest.raises(EmbeddingFailedError):
+        future.result(timeout=1)
@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.federated_search import search_knowledge_bases
+
+
+class _FakeManager:
+    def __init__(self, delays, results):
+        self.delays = delays
+        self.results = results
+
+    async def search_knowledge_base(self, collection_name, query, n_results, **kwargs):
+        await asyncio.sleep(self.delays[collection_name])
+        return self.results[collection_name]
+
+
+@pytest.mark.asyncio
+async def test_merge_compares_vector_similarity_across_kbs():
+    """测试按跨集合可比的向量相似度合并：弱相关知识库的第一条不会压过强相关的结果"""
+    manager = _FakeManager(
+        delays={"strong": 0, "weak": 0},
+        results={
+            # 混合检索：score 为集合内 RRF 融合分，vector_score 才是向量相似度
+            "strong": [
+                {"vector_id": "s1", "score": 1.0, "vector_score": 0.8},
+                {"vector_id": "s2", "score": 0.9, "vector_score": 0.7},
+                {"vector_id": "s3", "score": 0.8, "vector_score": None},
+            ],
+            "weak": [{"vector_id": "w1", "score": 0.2}],
+        },
+    )
+    targets = [{"knowledge_base_id": 1, "collection_name": "strong"}, {"knowledge_base_id": 2, "collection_name": "weak"}]
+    hits = await search_knowledge_bases(manager, targets, "q", n_results=4)
+    assert [h["vector_id"] for h in hits] == ["s1", "s2", "w1", "s3"]
+    assert hits[0]["raw_score"] == 1.0
+    assert hits[0]["score"] > hits[1]["score"] > hits[2]["score"] > hits[3]["score"]
+
+
+@pytest.mark.asyncio
+async def test_merge_keeps_bm25_only_hits_and_kb_order():
+    """测试只有 BM25 命中的结果在两库合并后仍能进入 top-k，且各知识库内部（重排后）的顺序不变"""
+    manager = _FakeManager(
+        delays={"a": 0, "b": 0},
+        results={
+            "a": [
+                {"vector_id": "x", "score": 0.03, "vector_score": None},   # 只有 BM25 命中，排在第一
+                {"vector_id": "a2", "score": 0.02, "vector_score": 0.5},
+            ],
+            "b": [
+                {"vector_id": "b2", "score": 0.9, "rerank_score": 0.9, "vector_score": 0.8},   # 重排后排第一
+                {"vector_id": "b1", "score": 0.7, "rerank_score": 0.7, "vector_score": 0.9},
+            ],
+        },
+    )
+    targets = [{"knowledge_base_id": 1, "collection_name": "a"}, {"knowledge_base_id": 2, "collection_name": "b"}]
+    hits = await search_knowledge_bases(manager, targets, "q", n_results=3)
+    assert [h["vector_id"] for h in hits] == ["b2", "b1", "x"]
+
+
+@pytest.mark.asyncio
+async def test_fan_out_runs_concurrently_and_skips_slow_kb():
+    """测试并发检索、合并排序，超过截止时间的知识库被跳过"""
+    manager = _FakeManager(
+        delays={"a": 0.1, "b": 0.1, "slow": 1.0},
+        results={
+            "a": [{"vector_id": "a1", "score": 0.9}, {"vector_id": "a2", "score": 0.5}],
+            "b": [{"vector_id": "b1", "score": 0.1}, {"vector_id": "b2", "score": 0.05}],
+            "slow": [{"vector_id": "s1", "score": 1.0}],
+        },
+    )
+    targets = [
+        {"knowledge_base_id": i, "collection_name": name}
+        for i, name in enumerate(["a", "b", "slow"], start=1)
+    ]
+    started = time.monotonic()
+    hits = await search_knowledge_bases(manager, targets, "q", n_results=3, timeout=0.3)
+    elapsed = time.monotonic() - started
+
+    assert elapsed < 0.5
+    assert [h["vector_id"] for h in hits] == ["a1", "a2", "b1"]
+    assert all(h["knowledge_base_id"] != 3 for h in hits)
+    assert len(hits) == 3
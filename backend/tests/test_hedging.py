@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from app.services.hedging import HedgePolicy
+
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_cancelled():
+    """测试主请求过慢时发出对冲请求，采用先返回的结果并取消落败者"""
+    policy = HedgePolicy("test", min_delay=0.01, max_delay=0.01)
+    calls = []
+    cancelled = []
+
+    async def start():
+        attempt = len(calls)
+        calls.append(attempt)
+        try:
+            await asyncio.sleep(1.0 if attempt == 0 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        return attempt
+
+    assert await policy.run(start) == 1
+    assert cancelled == [0]
+    stats = policy.stats()
+    assert stats["hedges_fired"] == 1 and stats["hedge_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_fast_primary_is_not_hedged_and_errors_fall_through():
+    """测试快请求不对冲；对冲中一方失败时等待另一方"""
+    policy = HedgePolicy("test", min_delay=0.01, max_delay=0.05)
+
+    async def fast():
+        return "ok"
+
+    assert await policy.run(fast) == "ok"
+    assert policy.stats()["hedges_fired"] == 0
+
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            await asyncio.sleep(0.1)
+            raise RuntimeError("primary failed")
+        await asyncio.sleep(0.2)
+        return "hedge"
+
+    assert await policy.run(flaky) == "hedge"
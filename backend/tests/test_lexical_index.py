@@ -0,0 +1,41 @@
+from app.services.lexical_index import (
+    BM25Index,
+    hybrid_config,
+    reciprocal_rank_fusion,
+    tokenize,
+)
+
+
+def test_tokenize_cjk_bigrams_and_codes():
+    """测试中文产出单字与二字、编号同时保留整体与分段"""
+    tokens = tokenize("依据GB/T-19001第三条")
+    assert "gb/t-19001" in tokens and "19001" in tokens
+    assert "第三" in tokens and "三条" in tokens and "依" in tokens
+
+
+def test_bm25_prefers_exact_term_and_supports_replace():
+    """测试精确编号命中排第一，替换文档后旧词不再命中"""
+    index = BM25Index()
+    index.add("a", "安全生产管理规定第十二条")
+    index.add("b", "依据 GB/T-19001 质量管理体系要求")
+    index.add("c", "质量管理的一般原则")
+
+    assert index.search("19001", k=3)[0][0] == "b"
+    assert index.search("第十二条", k=3)[0][0] == "a"
+
+    index.add("b", "无关内容")
+    assert all(doc_id != "b" for doc_id, _ in index.search("19001"))
+    assert len(index) == 3
+
+
+def test_rrf_weights_and_config_overrides():
+    """测试 RRF 融合按权重合并两路排名，retrieval_config 覆盖默认值"""
+    fused = reciprocal_rank_fusion([(["x", "y"], 1.0), (["y", "z"], 1.0)], k=60)
+    assert fused[0][0] == "y"
+
+    only_lexical = reciprocal_rank_fusion([(["x"], 0.0), (["z"], 1.0)], k=60)
+    assert [doc_id for doc_id, _ in only_lexical] == ["z"]
+
+    config = hybrid_config({"hybrid": {"bm25_weight": 0.5, "unknown": 1}})
+    assert config["bm25_weight"] == 0.5 and "unknown" not in config
+    assert hybrid_config({"hybrid": False})["enabled"] is False
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.services import vector_store as vector_store_module
+from app.services.mmr import mmr_config, mmr_select
+from app.services.numpy_vector_store import NumpyVectorStore
+from app.services.vector_store import VectorStoreManager
+
+
+def test_mmr_skips_near_duplicates():
+    """测试近似重复的候选只选一个，λ=1 时退化为按相关性排序"""
+    query = np.array([1.0, 0.0, 0.0])
+    docs = np.array([
+        [1.0, 0.05, 0.0],
+        [1.0, 0.06, 0.0],   # 与第一个几乎相同
+        [0.8, 0.0, 0.6],
+    ])
+    assert mmr_select(query, docs, 2, lambda_mult=0.5) == [0, 2]
+    assert mmr_select(query, docs, 2, lambda_mult=1.0) == [0, 1]
+    assert mmr_select(query, docs, 10, lambda_mult=0.5) == [0, 2, 1]
+
+    assert mmr_config({"mmr": True})["enabled"] is True
+    assert mmr_config({"mmr": {"lambda": 0.3}})["lambda"] == 0.3
+
+
+@pytest.mark.asyncio
+async def test_search_knowledge_base_diversifies(tmp_path, monkeypatch):
+    """测试启用 MMR 后检索结果去掉重复段落，且不带内部向量字段"""
+    monkeypatch.setattr(settings, "NUMPY_VECTOR_STORE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "HYBRID_SEARCH_ENABLED", False)
+    manager = VectorStoreManager(NumpyVectorStore())
+    collection = manager.vector_store.get_collection_handle("kb_mmr")
+    collection.add(
+        ids=["a", "a_dup", "b"],
+        embeddings=np.array([[1.0, 0.05, 0.0], [1.0, 0.06, 0.0], [0.8, 0.0, 0.6]], dtype=np.float32),
+        documents=["第一节", "第一节（重叠）", "第二节"],
+        metadatas=[{"vector_id": "a"}, {"vector_id": "a_dup"}, {"vector_id": "b"}],
+    )
+
+    async def embed_query(query):
+        return np.array([1.0, 0.0, 0.0], dtype=np.float32)
+
+    monkeypatch.setattr(vector_store_module.embedding_provider, "embed_query", embed_query)
+
+    plain = await manager.search_knowledge_base("kb_mmr", "q", n_results=2)
+    assert [h["vector_id"] for h in plain] == ["a", "a_dup"]
+
+    diverse = await manager.search_knowledge_base(
+        "kb_mmr", "q", n_results=2, retrieval_config={"mmr": {"enabled": True, "lambda": 0.5}}
+    )
+    assert [h["vector_id"] for h in diverse] == ["a", "b"]
+    assert all("_embedding" not in h for h in diverse)
@@ -0,0 +1,18 @@
+from app.services.model_registry import ModelRegistry
+
+
+def test_dimension_is_discovered_once_and_persisted(tmp_path):
+    """测试实测维度覆盖默认值并跨实例复用"""
+    path = str(tmp_path / "models.json")
+    registry = ModelRegistry(path)
+
+    assert registry.dimension("text-embedding-v3") is None
+    assert registry.expected_dimension("text-embedding-v3", 1536) == 1024
+    assert registry.expected_dimension("unknown-model", 1536) == 1536
+    assert registry.max_input_tokens("text-embedding-v1", 8000) == 2048
+
+    registry.record_dimension("text-embedding-v3", 768)
+
+    reopened = ModelRegistry(path)
+    assert reopened.dimension("text-embedding-v3") == 768
+    assert reopened.get("text-embedding-v3").max_batch == 10
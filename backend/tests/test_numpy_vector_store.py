@@ -0,0 +1,142 @@
+import numpy as np
+
+from app.core.config import settings
+from app.services.numpy_vector_store import NumpyCollection, NumpyVectorClient
+from app.services.search_filters import build_where_clause, matches_where
+
+
+def _vectors(n, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def test_query_matches_brute_force_and_survives_reopen(tmp_path):
+    """测试 top-k 与暴力计算一致、墓碑删除生效，重新打开后数据仍在"""
+    client = NumpyVectorClient(str(tmp_path))
+    collection = client.get_or_create_collection("kb_test")
+    vecs = _vectors(50)
+    ids = [f"id{i}" for i in range(50)]
+    collection.add(ids=ids, embeddings=vecs, documents=[f"doc{i}" for i in range(50)],
+                   metadatas=[{"file_id": str(i % 2)} for i in range(50)])
+
+    query = vecs[7] + 0.01
+    res = collection.query(query_embeddings=query[None, :], n_results=5)
+    expected = np.argsort(((vecs - query) ** 2).sum(axis=1))[:5]
+    assert res["ids"][0] == [ids[i] for i in expected]
+    assert res["distances"][0] == sorted(res["distances"][0])
+
+    collection.delete(ids=["id7"])
+    collection.upsert(ids=["id8"], embeddings=vecs[8:9] * 0 + 100, documents=["moved"], metadatas=[{"file_id": "0"}])
+    filtered = collection.query(query_embeddings=query[None, :], n_results=3, where={"file_id": {"$in": ["1"]}})
+    assert "id7" not in filtered["ids"][0]
+    assert all(m["file_id"] == "1" for m in filtered["metadatas"][0])
+    collection.close()
+
+    reopened = NumpyVectorClient(str(tmp_path)).get_collection("kb_test")
+    assert reopened.count() == 49
+    assert reopened.get(ids=["id8"])["documents"] == ["moved"]
+    again = reopened.query(query_embeddings=query[None, :], n_results=5)
+    assert again["ids"][0][0] != "id7"
+
+
+def test_reopen_after_truncated_trailing_record(tmp_path):
+    """测试日志尾行写了一半时重新打开：半截记录被截掉，之后写入的行仍与向量对齐"""
+    vecs = _vectors(4, seed=4)
+    collection = NumpyCollection("crash", tmp_path / "crash")
+    collection.add(ids=["a", "b"], embeddings=vecs[:2], documents=["a", "b"])
+    collection.close()
+    with open(tmp_path / "crash" / "rows.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "row": 2, "id": "lost", "docu')
+
+    reopened = NumpyCollection("crash", tmp_path / "crash")
+    assert reopened.count() == 2
+    reopened.add(ids=["c", "d"], embeddings=vecs[2:], documents=["c", "d"])
+    reopened.close()
+
+    again = NumpyCollection("crash", tmp_path / "crash")
+    assert again.count() == 4
+    for i, doc_id in enumerate("abcd"):
+        assert again.query(query_embeddings=vecs[i][None, :], n_results=1)["ids"][0] == [doc_id]
+
+
+def test_columnar_where_matches_row_filter(tmp_path):
+    """测试列式 where 掩码与逐行 matches_where 结果一致，重新打开后列重建"""
+    metadatas = [
+        {"file_id": str(i % 3), "page_number": i % 7, "created_ts": 1000.0 + i, "lang": "zh" if i % 2 else "en"}
+        for i in range(40)
+    ]
+    metadatas[5] = {"file_id": "1"}   # 缺失数值字段的旧块
+    collection = NumpyCollection("cols", tmp_path / "cols")
+    collection.add(ids=[str(i) for i in range(40)], embeddings=_vectors(40, seed=5), metadatas=metadatas)
+    wheres = [
+        build_where_clause({"file_ids": ["1", "2"], "page_from": 2, "page_to": 5}),
+        build_where_clause({"created_after": 1010, "created_before": 1030.5}),
+        {"$and": [{"file_id": {"$in": ["0", "9"]}}, {"lang": {"$in": ["zh"]}}]},
+    ]
+
+    def check(current):
+        for where in wheres:
+            expected = [str(i) for i, m in enumerate(metadatas) if matches_where(m, where)]
+            assert current._where_mask(where, 40).tolist() == [matches_where(m, where) for m in metadatas]
+            assert sorted(current.get(where=where)["ids"], key=int) == expected
+            res = current.query(query_embeddings=_vectors(1, seed=6), n_results=40, where=where)
+            assert sorted(res["ids"][0], key=int) == expected
+
+    check(collection)
+    collection.close()
+    check(NumpyCollection("cols", tmp_path / "cols"))
+
+
+def test_ivf_probe_returns_nearest(tmp_path, monkeypatch):
+    """测试启用 IVF 后仍能找回最近邻"""
+    monkeypatch.setattr(settings, "NUMPY_VECTOR_STORE_IVF_NLIST", 4)
+    monkeypatch.setattr(settings, "NUMPY_VECTOR_STORE_IVF_NPROBE", 2)
+    collection = NumpyCollection("ivf", tmp_path / "ivf")
+    vecs = _vectors(400, seed=1)
+    collection.add(ids=[str(i) for i in range(400)], embeddings=vecs)
+    assert collection._ivf.centroids is not None
+
+    res = collection.query(query_embeddings=vecs[123][None, :], n_results=1)
+    assert res["ids"][0] == ["123"]
+
+
+def test_compressed_search_reports_memory_and_recall(tmp_path, monkeypatch):
+    """测试 int8 / PQ 压缩后检索仍找回近邻，并报告内存与召回"""
+    monkeypatch.setattr(settings, "NUMPY_VECTOR_STORE_COMPRESSION_MIN_ROWS", 300)
+    monkeypatch.setattr(settings, "NUMPY_VECTOR_STORE_PQ_M", 4)
+    vecs = _vectors(600, dim=16, seed=2)
+    for kind in ("int8", "pq"):
+        monkeypatch.setattr(settings, "NUMPY_VECTOR_STORE_COMPRESSION", kind)
+        collection = NumpyCollection(kind, tmp_path / kind)
+        collection.add(ids=[str(i) for i in range(600)], embeddings=vecs,
+                       metadatas=[{"file_id": str(i % 2)} for i in range(600)])
+
+        stats = collection.compression_stats()
+        assert stats["active"] and stats["bytes_per_vector"] < stats["float32_bytes_per_vector"]
+        assert stats["recall_at_10_reranked"] >= stats["recall_at_10_adc"]
+        assert stats["recall_at_10_reranked"] > 0.8
+
+        res = collection.query(query_embeddings=vecs[42][None, :], n_results=3)
+        assert res["ids"][0][0] == "42"
+        assert res["distances"][0][0] < 1e-4
+
+        # 墓碑与过滤掉的行不会出现在压缩检索结果里
+        collection.delete(ids=["43"])
+        res = collection.query(query_embeddings=vecs[43][None, :], n_results=600, where={"file_id": {"$in": ["1"]}})
+        assert len(res["ids"][0]) == 299 and "43" not in res["ids"][0]
+        assert all(int(i) % 2 == 1 for i in res["ids"][0])
+
+
+def test_pq_subspaces_adapt_to_dimension(tmp_path, monkeypatch):
+    """测试 PQ 子空间数不能整除维度时自动调整，写入与重新打开都不报错"""
+    monkeypatch.setattr(settings, "NUMPY_VECTOR_STORE_COMPRESSION", "pq")
+    monkeypatch.setattr(settings, "NUMPY_VECTOR_STORE_COMPRESSION_MIN_ROWS", 300)
+    monkeypatch.setattr(settings, "NUMPY_VECTOR_STORE_PQ_M", 16)
+    vecs = _vectors(400, dim=24, seed=3)
+    collection = NumpyCollection("pq_dim", tmp_path / "pq_dim")
+    collection.add(ids=[str(i) for i in range(400)], embeddings=vecs)
+    assert collection._quantizer.m == 12
+    assert collection.compression_stats()["active"] is True
+    collection.close()
+
+    reopened = NumpyCollection("pq_dim", tmp_path / "pq_dim")
+    assert reopened.query(query_embeddings=vecs[5][None, :], n_results=1)["ids"][0] == ["5"]
@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.rate_limit import RequestRateLimiter
+from app.services.resilience import BULK, INTERACTIVE
+
+
+def test_bulk_leaves_reserve_for_interactive():
+    """测试入库用不到预留额度，在线查询可以用；两者都不透支"""
+    limiter = RequestRateLimiter(requests_per_second=10, tokens_per_minute=0, interactive_reserve=0.2)
+    granted = 0
+    while limiter.try_acquire(priority=BULK) == 0:
+        granted += 1
+    assert granted == 8
+
+    assert limiter.try_acquire(priority=INTERACTIVE) == 0
+    assert limiter.try_acquire(priority=INTERACTIVE) == 0
+    assert limiter.try_acquire(priority=INTERACTIVE) > 0
+
+
+@pytest.mark.asyncio
+async def test_interactive_waits_instead_of_overdrawing():
+    """测试桶空时在线查询也要等待补充，而不是直接放行"""
+    limiter = RequestRateLimiter(requests_per_second=20, tokens_per_minute=0, interactive_reserve=0.0)
+    while limiter.try_acquire(priority=INTERACTIVE) == 0:
+        pass
+    start = time.monotonic()
+    await asyncio.gather(*(limiter.acquire(priority=INTERACTIVE) for _ in range(3)))
+    assert time.monotonic() - start >= 0.1
+    assert limiter.stats()["throttled"][INTERACTIVE] == 3
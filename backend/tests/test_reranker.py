@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from app.services.reranker import LexicalOverlapReranker, RerankStage, Reranker, rerank_config
+
+
+class SlowReranker(Reranker):
+    name = "slow"
+
+    def score(self, query, documents):
+        time.sleep(0.02)
+        return [float(len(d)) for d in documents]
+
+
+def _hits(*pairs):
+    return [{"content": content, "score": score} for content, score in pairs]
+
+
+def test_lexical_overlap_prefers_covering_document():
+    """测试查询词覆盖多的文档得分更高"""
+    scores = LexicalOverlapReranker().score("排污许可证 有效期", ["排污许可证的有效期为五年", "许可证办理流程", "无关内容"])
+    assert scores[0] > scores[1] > scores[2] == 0.0
+
+
+@pytest.mark.asyncio
+async def test_rerank_reorders_skips_dominant_and_respects_budget():
+    """测试重排改变顺序、第一名明显领先时跳过、超出预算时剩余候选保持原顺序"""
+    stage = RerankStage()
+    config = dict(rerank_config({"rerank": True}), skip_margin=0.3)
+
+    hits = _hits(("许可证办理流程", 0.52), ("排污许可证的有效期为五年", 0.5))
+    out = await stage.rerank("排污许可证 有效期", hits, config)
+    assert out[0]["content"] == "排污许可证的有效期为五年"
+    assert "rerank_score" in out[0]
+
+    dominant = _hits(("a", 0.9), ("b", 0.2))
+    assert await stage.rerank("q", dominant, config) is dominant
+
+    stage._rerankers["slow"] = SlowReranker()
+    slow_config = dict(config, provider="slow", batch_size=2, latency_budget_ms=1)
+    out = await stage.rerank("q", _hits(("x", 0.5), ("xx", 0.5), ("yyy", 0.5), ("zzzz", 0.5)), slow_config)
+    assert [h["content"] for h in out] == ["xx", "x", "yyy", "zzzz"]
+    assert stage.stats() == {"reranked": 2, "skipped": 1, "budget_exceeded": 1, "errors": 0}
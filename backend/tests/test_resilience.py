@@ -0,0 +1,53 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.resilience import Bulkhead, CircuitBreaker, CircuitOpenError
+
+
+def _server_error() -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://upstream/embeddings")
+    return httpx.HTTPStatusError("boom", request=request, response=httpx.Response(503, request=request))
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_fails_fast_and_recovers_through_half_open():
+    """测试连续 5xx 后熔断、快速失败，冷却后半开探测成功即恢复"""
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=0.05)
+
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            async with breaker.guard():
+                raise _server_error()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        async with breaker.guard():
+            pass
+
+    await asyncio.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    async with breaker.guard():
+        pass
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_bulkhead_caps_concurrency():
+    """测试舱壁限制同时在途的调用数"""
+    bulkhead = Bulkhead("test", limit=2)
+    active = 0
+    peak = 0
+
+    async def call():
+        nonlocal active, peak
+        async with bulkhead.slot():
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    await asyncio.gather(*(call() for _ in range(6)))
+    assert peak == 2
+    assert bulkhead.stats()["active"] == 0
@@ -0,0 +1,37 @@
+import numpy as np
+
+from app.services.retrieval_cache import RetrievalCache, normalize_query
+
+
+def test_exact_hit_and_version_invalidation():
+    """测试规范化后的相同问题命中，集合写入后失效，检索期间发生写入的结果不缓存"""
+    cache = RetrievalCache(max_entries=2)
+    assert normalize_query("  排污许可证 有效期？ ") == normalize_query("排污许可证  有效期")
+
+    key = cache.make_key("kb_1", "排污许可证有效期？", 5, {"file_ids": [1]})
+    version = cache.version("kb_1")
+    cache.put(key, [{"vector_id": "a", "score": 0.9}], version)
+    assert cache.get(cache.make_key("kb_1", "排污许可证有效期", 5, {"file_ids": [1]})) == [{"vector_id": "a", "score": 0.9}]
+    assert cache.get(cache.make_key("kb_1", "排污许可证有效期", 3, {"file_ids": [1]})) is None
+
+    cache.bump("kb_1")
+    assert cache.get(key) is None
+    cache.put(key, [{"vector_id": "stale"}], version)
+    assert cache.get(key) is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["invalidations"] == 1 and stats["entries"] == 0
+
+
+def test_semantic_hit_respects_threshold_and_scope():
+    """测试相似问题在阈值以上复用，其他集合或参数不复用"""
+    cache = RetrievalCache(similarity_threshold=0.95)
+    key = cache.make_key("kb_1", "有效期多久", 5)
+    cache.put(key, [{"vector_id": "a"}], cache.version("kb_1"), np.array([1.0, 0.0, 0.0]))
+
+    paraphrase = cache.make_key("kb_1", "有效期是多长时间", 5)
+    assert cache.get(paraphrase) is None
+    assert cache.get_similar(paraphrase, np.array([0.99, 0.05, 0.0])) == [{"vector_id": "a"}]
+    assert cache.get_similar(paraphrase, np.array([0.5, 0.5, 0.5])) is None
+    assert cache.get_similar(cache.make_key("kb_2", "有效期是多长时间", 5), np.array([1.0, 0.0, 0.0])) is None
+    assert cache.stats()["semantic_hits"] == 1
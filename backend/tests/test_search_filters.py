@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from app.services.search_filters import build_where_clause, matches_where
+
+
+def test_build_where_clause_shapes():
+    """测试单条件不包 $and、多条件用 $and，文件 id 按字符串匹配"""
+    assert build_where_clause(None) is None
+    assert build_where_clause({"file_ids": []}) is None
+    assert build_where_clause({"file_ids": [3, 4]}) == {"file_id": {"$in": ["3", "4"]}}
+
+    where = build_where_clause({
+        "content_types": ["table"],
+        "page_from": 2,
+        "created_after": datetime.fromtimestamp(1000),
+    })
+    assert where == {"$and": [
+        {"content_type": {"$in": ["table"]}},
+        {"page_number": {"$gte": 2}},
+        {"created_ts": {"$gte": 1000.0}},
+    ]}
+
+
+def test_matches_where_evaluates_in_process():
+    """测试进程内求值与下推语义一致；缺字段不命中范围条件"""
+    where = build_where_clause({"file_ids": [7], "page_from": 1, "page_to": 3})
+    assert matches_where({"file_id": "7", "page_number": 2}, where)
+    assert not matches_where({"file_id": "8", "page_number": 2}, where)
+    assert not matches_where({"file_id": "7"}, where)
+    assert matches_where({"anything": 1}, None)
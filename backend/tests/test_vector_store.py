@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.vector_store import ChromaVectorStore
+
+
+class _FakeCollection:
+    def __init__(self, name, broken=False):
+        self.name = name
+        self.broken = broken
+
+    def query(self, **kwargs):
+        if self.broken:
+            raise RuntimeError("collection does not exist")
+        return {"ids": [[self.name]]}
+
+
+class _FakeClient:
+    def __init__(self):
+        self.calls = 0
+        self.break_next = False
+
+    def get_or_create_collection(self, name, metadata=None):
+        self.calls += 1
+        broken, self.break_next = self.break_next, False
+        return _FakeCollection(name, broken)
+
+    def delete_collection(self, name):
+        pass
+
+
+def _store(monkeypatch):
+    monkeypatch.setattr(ChromaVectorStore, "_connect", lambda self: None)
+    store = ChromaVectorStore()
+    store.client = _FakeClient()
+    return store
+
+
+def test_collection_handle_is_cached_and_invalidated_on_delete(monkeypatch):
+    """测试集合句柄命中缓存、删除后失效"""
+    store = _store(monkeypatch)
+    for _ in range(3):
+        store.call_collection("kb", lambda c: c.query())
+    assert store.client.calls == 1
+    assert store.collection_cache_stats()["hits"] == 2
+
+    store.delete_collection("kb")
+    store.call_collection("kb", lambda c: c.query())
+    assert store.client.calls == 2
+
+
+def test_stale_handle_is_refreshed_on_error(monkeypatch):
+    """测试句柄调用出错时重新获取并重试一次"""
+    store = _store(monkeypatch)
+    store.client.break_next = True
+    assert store.call_collection("kb", lambda c: c.query()) == {"ids": [["kb"]]}
+    assert store.client.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_slow_chroma_calls_do_not_block_event_loop(monkeypatch):
+    """测试同步 Chroma 调用在线程池中执行，慢调用期间事件循环照常调度，并按超时返回"""
+    store = _store(monkeypatch)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    task = asyncio.ensure_future(ticker())
+    try:
+        result = await store.acall_collection("kb", lambda c: (time.sleep(0.2), c.query())[1], timeout=5)
+        assert result == {"ids": [["kb"]]}
+        assert ticks >= 5
+
+        with pytest.raises(asyncio.TimeoutError):
+            await store.acall_collection("kb", lambda c: time.sleep(0.3), timeout=0.05)
+        assert store.collection_cache_stats()["timeouts"] == 1
+
+        store.client.delete_collection = lambda name: time.sleep(0.2)
+        before = ticks
+        assert await store.adelete_collection("kb") is True
+        assert ticks - before >= 5
+    finally:
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_ingest_pipeline_overlaps_embedding_and_writes(monkeypatch):
+    """测试嵌入与写入重叠执行，id 顺序与输入一致，失败条目进入 pending"""
+    import numpy as np
+    import app.services.vector_store as vector_store
+
+    class _SlowProvider:
+        async def embed_partial(self, texts):
+            await asyncio.sleep(0.1)
+            failed = np.array([t == "bad" for t in texts])
+            return np.ones((len(texts), 2), dtype=np.float32), failed
+
+    written = []
+
+    class _SlowCollection(_FakeCollection):
+        def add(self, ids, **kwargs):
+            time.sleep(0.1)
+            written.extend(ids)
+
+    store = _store(monkeypatch)
+    store.client.get_or_create_collection = lambda name, metadata=None: _SlowCollection(name)
+    monkeypatch.setattr(vector_store, "embedding_provider", _SlowProvider())
+
+    docs = [{"id": str(i), "content": "bad" if i == 3 else f"t{i}"} for i in range(8)]
+    started = time.monotonic()
+    ids, pending = await store.add_documents_with_pending("kb", docs, batch_size=2)
+    elapsed = time.monotonic() - started
+
+    assert ids == [str(i) for i in range(8)]
+    assert pending == {"3"}
+    assert written == [str(i) for i in range(8) if i != 3]
+    # 串行约 0.8s；流水线约 4 次嵌入 + 最后 1 次写入
+    assert elapsed < 0.7